@@ -1,17 +1,54 @@
+import io
+import os
+import time
 import streamlit as st
 from utils import dex_subgraphs_wrapper
+from utils.chart_rendering import MAX_SCATTER_POINTS, cap_groups, scatter_figure, swap_details
+from utils.instrumentation import RequestProfiler, configure_logging, instruments
+from utils.result_cache import SwapsResultCache
+from utils.swaps_export import EXPORT_FORMATS, export_swaps
+from utils.swaps_filters import SwapsFilter, split_project
+from utils.swaps_tail import SwapsTail
 import plotly.graph_objects as go
 import plotly.express as px
 import pandas as pd
 
 @st.cache(allow_output_mutation=True, show_spinner=False)
 def st_get_dex_subgraphs_wrapper():
-	return dex_subgraphs_wrapper.DexSubgraphsWrapper()
+	cache_dir = os.environ.get("SWAPS_CACHE_DIR", ".swaps_cache")
+	return dex_subgraphs_wrapper.DexSubgraphsWrapper(cache_dir=cache_dir, schema_cache_dir=os.path.join(cache_dir, "schemas"))
 
-@st.cache(show_spinner=False)
-def st_get_swaps_df_from_all_dexes_singlethreaded(list_of_wallets):
-     dex_subgraphs_wrapper = st_get_dex_subgraphs_wrapper()
-     return dex_subgraphs_wrapper.get_swaps_df(list_of_wallets)
+@st.cache(allow_output_mutation=True, show_spinner=False)
+def st_get_result_cache():
+     # swaps of every wallet fetched so far, shared by all sessions: overlapping requests only fetch the missing wallets, once
+     max_bytes = int(os.environ.get("SWAPS_RESULT_CACHE_MB", 2048)) * 2**20
+     # wallets fetched longer ago than this are fetched again, to pick up their new swaps
+     ttl = float(os.environ.get("SWAPS_RESULT_CACHE_TTL", 10 * 60))
+     return SwapsResultCache(st_get_dex_subgraphs_wrapper(), max_bytes=max_bytes, ttl=ttl)
+
+@st.cache(allow_output_mutation=True, show_spinner=False)
+def st_start_instrumentation():
+     # structured logs on stderr (DEBUG logs every span), and a Prometheus `/metrics` endpoint if a port is given
+     configure_logging(os.environ.get("ANALYZOOOR_LOG_LEVEL", "WARNING"))
+     metrics_port = os.environ.get("ANALYZOOOR_METRICS_PORT")
+     return instruments.serve_prometheus(int(metrics_port)) if metrics_port else None
+
+def st_iter_swaps_dfs(list_of_wallets, swaps_filter=None):
+     # yields the compact swaps, cube and failed dexes fetched so far whenever more dexes answered, the last ones are complete
+     yield from st_get_result_cache().iter_swaps(list_of_wallets, swaps_filter)
+
+def st_iter_live_swaps(list_of_wallets, swaps_filter):
+     # the swaps as usual the first time, then the ones of the tail of this session, which survives its reruns and is polled at the end of each
+     tail_key = (tuple(list_of_wallets), swaps_filter)
+     if st.session_state.get('tail_key') != tail_key:
+          for swaps, swaps_cube, failed_report in st_iter_swaps_dfs(list_of_wallets, swaps_filter):
+               yield swaps, swaps_cube, failed_report
+          st.session_state['tail'] = SwapsTail.from_swaps(st_get_dex_subgraphs_wrapper(), list_of_wallets, swaps, swaps_cube.cells, swaps_filter)
+          st.session_state['tail_key'] = tail_key
+          st.session_state['tail_failed_report'] = failed_report
+     else:
+          tail = st.session_state['tail']
+          yield tail.swaps, tail.cube, st.session_state['tail_failed_report']
 
 st.set_page_config(
      page_title="Swaps Analyzooor",
@@ -22,10 +59,14 @@ st.set_page_config(
           'About': 'analyzooor.notawizard.xyz'}
  )
 
+st_start_instrumentation()
+# every span of this run shares its trace id
+trace_id = instruments.start_trace()
+
 st.title("Swaps Analyzooor")
 st.markdown('check our landing page: [analyzooor.notawizard.xyz](http://analyzooor.notawizard.xyz/)')
 
-st.info("Fetching the data may take some time. Please be patient. (it usually takes less than 1 minute)")
+st.info("Fetching the data may take some time. Please be patient. (it usually takes less than 1 minute, wallets that were looked up before only fetch their new swaps)")
 
 wallets = st.text_input(
      label="Enter the wallet address here (or multiple addresses, separated by commas)", 
@@ -34,6 +75,36 @@ wallets = st.text_input(
 
 list_of_wallets = [wallet.strip() for wallet in wallets.split(",")]
 
+live_mode = st.checkbox('Keep watching for new swaps', False, help='polls the dexes for swaps newer than the ones shown and updates the charts as they arrive, paused while a download is offered')
+
+# the filters narrow the subgraph queries themselves, so narrow ones fetch much less
+filters_expander = st.expander("Filters")
+should_filter_dates = filters_expander.checkbox('Only swaps between two dates', False)
+if should_filter_dates:
+     today = pd.Timestamp.utcnow().date()
+     filter_dates = filters_expander.date_input('Swaps between', value=(today - pd.Timedelta(days=30), today))
+all_projects = dex_subgraphs_wrapper.DexSubgraphsWrapper.projects
+filter_chains = filters_expander.multiselect('Only these chains (all if empty)', sorted({split_project(project)[1] for project in all_projects}))
+filter_protocols = filters_expander.multiselect('Only these protocols (all if empty)', sorted({split_project(project)[0] for project in all_projects}))
+filter_min_amount_usd = filters_expander.number_input('Only swaps selling more than this amount in USD', value=0.0, min_value=0.0, step=100.0, help="compared with the USD value the dex gave the swap, so swaps it didn't value are left out even when their filled value is higher")
+filter_tokens_in = filters_expander.text_input('Only swaps selling these token addresses (separated by commas)', value='')
+filter_tokens_out = filters_expander.text_input('Only swaps buying these token addresses (separated by commas)', value='')
+
+filter_start, filter_end = None, None
+if should_filter_dates and len(filter_dates) == 2:
+     # the end date is included
+     filter_start, filter_end = pd.Timestamp(filter_dates[0]), pd.Timestamp(filter_dates[1]) + pd.Timedelta(days=1)
+
+swaps_filter = SwapsFilter(
+     start=filter_start,
+     end=filter_end,
+     chains=tuple(filter_chains),
+     protocols=tuple(filter_protocols),
+     min_amount_usd=filter_min_amount_usd if filter_min_amount_usd > 0 else None,
+     tokens_in=tuple(token.strip() for token in filter_tokens_in.split(",") if token.strip()),
+     tokens_out=tuple(token.strip() for token in filter_tokens_out.split(",") if token.strip()),
+)
+
 should_show_processed_wallets = st.checkbox('Show processed wallets', False)
 
 if should_show_processed_wallets:
@@ -68,6 +139,12 @@ if show_available_dexes:
 
      st.write(projects)
 
+diagnostics_expander = st.expander("Diagnostics")
+show_timings = diagnostics_expander.checkbox('Show the timings of this run', False)
+profiler_mode = diagnostics_expander.selectbox('Profile this run', ['off', 'cprofile', 'sampling'], help='cprofile only sees the script thread, sampling sees the fetches running in the background too')
+profile_report = None
+export_file = None
+
 
 types_of_plots = st.multiselect(
      'Select what you want to see', 
@@ -88,11 +165,13 @@ cols_desc_expander.markdown("""
 - dex: the name of the decentralized exchange
 - token_address_in: token address that was sold on the swap
 - token_symbol_in: token symbol that was sold on the swap
+- token_asset_in: asset of the token that was sold on the swap, the same for its wrapped and bridged copies on every chain (the charts group tokens by asset)
 - amount_in: amount of tokens sold on the swap
-- amount_in_usd: amount of tokens sold on the swap in USD
+- amount_in_usd: amount of tokens sold on the swap in USD (when the dex didn't price it, the value of the tokens bought, or the amount times the price of the token around that time in the other swaps fetched)
 - token_in_approx_price_usd: approximate price of the token sold on the swap in USD
 - token_address_out: token address that was bought on the swap
 - token_symbol_out: token symbol that was bought on the swap
+- token_asset_out: asset of the token that was bought on the swap
 - amount_out: amount of tokens bought on the swap
 - amount_out_usd: amount of tokens bought on the swap in USD
 - token_out_approx_price_usd: approximate price of the token bought on the swap in USD
@@ -105,10 +184,10 @@ cols_desc_expander.markdown("""
 """)
 
 if types_of_plots:
-     with st.spinner('Loading data...'):
-          swaps_df = st_get_swaps_df_from_all_dexes_singlethreaded(list_of_wallets).copy()
-          swaps_df['dummy'] = 999
-          dex_data_cols = list(swaps_df.columns)
+     dex_data_cols = dex_subgraphs_wrapper.CLEAN_COLUMNS + ['dummy']
+     # charts are drawn with the dexes that already answered and redrawn as the others arrive
+     loading_status = st.empty()
+     live_status = st.empty()
 
      if 'scatter' in types_of_plots:
           st.subheader("Scatter plot")
@@ -128,14 +207,13 @@ if types_of_plots:
           dot_opacity = scatter_col2.number_input('Select opacity', value=0.5, step=0.1, min_value=0.1, max_value=1.0)
           dot_max_size = scatter_col1.number_input('Select max size', value=10, step=1, min_value=1)
           plot_title = scatter_col2.text_input('Title', value='dex scatter plot')
+          scatter_max_points = scatter_col1.number_input('Max points to draw (more swaps are downsampled, keeping the outliers)', value=MAX_SCATTER_POINTS, step=1_000, min_value=1_000)
+          scatter_swap_ids = scatter_col2.text_input('Show every column of these swaps (swap_id of the hover, separated by commas)', value='')
+          scatter_hover_cols = ['swap_datetime', 'dex', 'token_symbol_in', 'amount_in', 'amount_in_usd', 'token_in_approx_price_usd', 
+               'token_symbol_out', 'amount_out', 'amount_out_usd', 'token_out_approx_price_usd', 'conversion_rate_in_to_out', 'pool_name']
 
-          fig = px.scatter(
-               swaps_df, x=x_col, y=y_col, color=color_col, size=size_col, title=plot_title, height=plot_height, # width=plot_width,
-               opacity=dot_opacity, size_max=dot_max_size, marginal_y='box' if show_boxplot else None, facet_row=facet_row_col,
-               hover_data=['swap_datetime', 'dex', 'token_symbol_in', 'amount_in', 'amount_in_usd', 'token_in_approx_price_usd', 
-               'token_symbol_out', 'amount_out', 'amount_out_usd', 'token_out_approx_price_usd', 'conversion_rate_in_to_out', 'pool_name'])
-
-          st.plotly_chart(fig, use_container_width=True)
+          scatter_placeholder = st.empty()
+          scatter_details_placeholder = st.empty()
 
      
      if 'heatmap per symbol' in types_of_plots:
@@ -145,18 +223,7 @@ if types_of_plots:
           heatmap_metric = st.selectbox('Select a metric for the heatmap', ['usd volume', 'number of swaps'])
           heatmap_show_top_n = st.number_input('Show top n swap pairs', value=30, step=1, min_value=1)
 
-          if heatmap_metric=='usd volume':
-               agg_tokens_by_volume = swaps_df.groupby(['token_symbol_in','token_symbol_out'])['amount_in_usd'].sum().sort_values(ascending=False).reset_index().head(heatmap_show_top_n)
-          elif heatmap_metric=='number of swaps':
-               agg_tokens_by_volume = swaps_df.groupby(['token_symbol_in','token_symbol_out'])['amount_in_usd'].count().sort_values(ascending=False).reset_index().head(heatmap_show_top_n)
-
-          pivoted_tokens_by_volumes = pd.pivot(agg_tokens_by_volume, index='token_symbol_in', columns='token_symbol_out', values='amount_in_usd')
-
-          fig = px.imshow(pivoted_tokens_by_volumes, text_auto=True, title=f'Heatmap of the {heatmap_metric} by token in and out', aspect='equal', height=1000, width=1000)
-          fig.update_xaxes(nticks=100, tickfont={'size': 10}, showgrid=False)
-          fig.update_yaxes(nticks=100, tickfont={'size': 10}, showgrid=False)
-          fig.update_layout(title=f'Top {heatmap_show_top_n} Transfers Heatmap')
-          st.plotly_chart(fig, use_container_width=True)
+          heatmap_placeholder = st.empty()
 
      if 'top pools and dexes' in types_of_plots:
           st.subheader("Top pools and dexes")
@@ -165,29 +232,7 @@ if types_of_plots:
           top_pools_metric = st.selectbox('Select a metric for the top pools', ['usd volume', 'number of swaps'])
           font_size = st.number_input('Sunburst Font size', value=14, step=1, min_value=1)
 
-          if top_pools_metric=='usd volume':
-               agg_dex_and_pools = swaps_df.groupby(['dex', 'pool_name'])['amount_in_usd'].sum().reset_index()
-          elif top_pools_metric=='number of swaps':
-               agg_dex_and_pools = swaps_df.groupby(['dex', 'pool_name'])['amount_in_usd'].count().reset_index()
-
-          fig = px.sunburst(agg_dex_and_pools[agg_dex_and_pools['amount_in_usd']!=0], path=['dex', 'pool_name'], values='amount_in_usd', height=800)
-          fig.update_layout(
-               title=f'Top Pools and DEXes by {top_pools_metric}',
-          font=dict(
-               size=font_size,
-          )
-          )
-          st.plotly_chart(fig, use_container_width=True)
-
-          weekly_dex_vol = swaps_df.set_index('swap_datetime').groupby([pd.Grouper(freq='7d'), 'dex'])['amount_in_usd'].sum().reset_index()
-
-          fig = px.bar(weekly_dex_vol, x='swap_datetime', y='amount_in_usd', title='Weekly Volume in USD per DEX', height=800, color='dex')
-          st.plotly_chart(fig, use_container_width=True)
-
-          weekly_dex_vol = swaps_df.set_index('swap_datetime').groupby([pd.Grouper(freq='7d'), 'pool_name'])['amount_in_usd'].sum().reset_index()
-
-          fig = px.bar(weekly_dex_vol, x='swap_datetime', y='amount_in_usd', title='Weekly Volume in USD per Pool', height=800, color='pool_name')
-          st.plotly_chart(fig, use_container_width=True)
+          top_pools_placeholder = st.empty()
 
      if 'net token volume' in types_of_plots:
           st.subheader("Net token volume")
@@ -195,37 +240,7 @@ if types_of_plots:
 
           net_token_volume_show_top_n = st.number_input('Show top n swap pairs for net token volume', value=15, step=1, min_value=1)
 
-          outflows = swaps_df[['swapper', 'dex', 'swap_datetime', 'token_symbol_in', 'amount_in_usd', 'pool_name']]
-          outflows['amount_in_usd'] = -outflows['amount_in_usd']
-          outflows.columns=['swapper', 'dex', 'swap_datetime', 'token_symbol', 'amount_usd', 'pool_name']
-
-          inflows = swaps_df[['swapper', 'dex', 'swap_datetime', 'token_symbol_out', 'amount_out_usd', 'pool_name']]
-          inflows.columns=['swapper', 'dex', 'swap_datetime', 'token_symbol', 'amount_usd', 'pool_name']
-
-          movements = pd.concat([outflows, inflows])
-
-          total_netted = movements.groupby(['token_symbol'])['amount_usd'].sum().reset_index()
-          total_netted = total_netted[total_netted['amount_usd']!=0]
-          total_netted = total_netted[total_netted['token_symbol']!='']
-          total_netted = total_netted.sort_values(by='amount_usd', ascending=False)
-
-          top_netted = total_netted.head(net_token_volume_show_top_n)
-          fig = px.bar(top_netted, x='token_symbol', y='amount_usd', title=f'Top {net_token_volume_show_top_n} Tokens by Netted Volume in USD', height=800, text_auto=True)
-          st.plotly_chart(fig, use_container_width=True)
-
-          bottom_netted = total_netted.tail(net_token_volume_show_top_n)
-          fig = px.bar(bottom_netted, x='token_symbol', y='amount_usd', title=f'Bottom {net_token_volume_show_top_n} Tokens by Netted Volume in USD', height=800, text_auto=True)
-          st.plotly_chart(fig, use_container_width=True)
-
-          weekly_plot_col = 'token_symbol' 
-          weekly_movement = movements.set_index('swap_datetime').groupby([pd.Grouper(freq='7d'), weekly_plot_col])['amount_usd'].sum().reset_index()
-          weekly_movement = weekly_movement[weekly_movement['amount_usd']!=0]
-          weekly_movement = weekly_movement[weekly_movement[weekly_plot_col]!='']
-          weekly_movement = weekly_movement.sort_values(by='amount_usd', ascending=False)
-
-          fig = px.bar(weekly_movement, x='swap_datetime', y='amount_usd', title='Weekly Netted Volume in USD per token', height=800, color=weekly_plot_col)
-          st.plotly_chart(fig, use_container_width=True)
-
+          net_token_volume_placeholder = st.empty()
 
      if 'absolute token volume' in types_of_plots:
           st.subheader("Absolute token volume")
@@ -233,52 +248,187 @@ if types_of_plots:
 
           abs_token_volume_show_top_n = st.number_input('Show top n swap pairs for absolute token volume', value=15, step=1, min_value=1)
 
-          outflows = swaps_df[['swapper', 'dex', 'swap_datetime', 'token_symbol_in', 'amount_in_usd', 'pool_name']]
-          outflows['amount_in_usd'] = outflows['amount_in_usd']
-          outflows.columns=['swapper', 'dex', 'swap_datetime', 'token_symbol', 'amount_usd', 'pool_name']
+          abs_token_volume_placeholder = st.empty()
 
-          inflows = swaps_df[['swapper', 'dex', 'swap_datetime', 'token_symbol_out', 'amount_out_usd', 'pool_name']]
-          inflows.columns=['swapper', 'dex', 'swap_datetime', 'token_symbol', 'amount_usd', 'pool_name']
-
-          abs_movements = pd.concat([outflows, inflows])
-
-          total_abs = abs_movements.groupby(['token_symbol', 'dex'])['amount_usd'].sum().reset_index()
-          total_abs = total_abs[total_abs['amount_usd']!=0]
-          total_abs = total_abs[total_abs['token_symbol']!='']
-          total_abs = total_abs.sort_values(by='amount_usd', ascending=False)
-
-          fig = px.bar(total_abs.head(abs_token_volume_show_top_n), x='token_symbol', y='amount_usd', title='Total Absolute Volume in USD per token', height=800, text_auto=True, color='dex')
-          fig.update_layout(barmode='stack', xaxis={'categoryorder':'total descending'})    
-          st.plotly_chart(fig, use_container_width=True)
-
-          weekly_plot_col = 'token_symbol' 
-          weekly_movement = abs_movements.set_index('swap_datetime').groupby([pd.Grouper(freq='7d'), weekly_plot_col])['amount_usd'].sum().reset_index()
-          weekly_movement = weekly_movement[weekly_movement['amount_usd']!=0]
-          weekly_movement = weekly_movement[weekly_movement[weekly_plot_col]!='']
-          weekly_movement = weekly_movement.sort_values(by='amount_usd', ascending=False)
+     if 'raw data' in types_of_plots:
+          st.subheader("Raw data")
 
-          fig = px.bar(weekly_movement, x='swap_datetime', y='amount_usd', title='Weekly Absolute Volume in USD per token', height=800, color=weekly_plot_col)
-          st.plotly_chart(fig, use_container_width=True)
+          raw_data_placeholder = st.empty()
+
+     profiler = RequestProfiler(None if profiler_mode == 'off' else profiler_mode)
+     profiler.start()
+     # stopped even when a rerun or an error cuts the run short, or the sampling thread would outlive it
+     try:
+          with st.spinner('Loading data...'):
+               for swaps, swaps_cube, failed_report in (st_iter_live_swaps(list_of_wallets, swaps_filter) if live_mode else st_iter_swaps_dfs(list_of_wallets, swaps_filter)):
+                    n_dexes = swaps.to_pandas(['dex'])['dex'].nunique()
+                    loading_status.caption(f"{len(swaps)} swaps from {n_dexes} dexes so far")
+
+                    if 'scatter' in types_of_plots:
+                         with instruments.span('render', section='scatter'):
+                              # only the plotted columns are converted to pandas, the hover ones too if every swap is drawn
+                              is_downsampled = len(swaps) > scatter_max_points
+                              scatter_cols = [col for col in dict.fromkeys([x_col, y_col, color_col, size_col, facet_row_col] + ([] if is_downsampled else scatter_hover_cols)) if col in dex_subgraphs_wrapper.CLEAN_COLUMNS]
+                              swaps_df = swaps.to_pandas(scatter_cols).assign(dummy=999)
+                              fig, n_points = scatter_figure(
+                                   swaps_df, x=x_col, y=y_col, color=color_col, size=size_col, facet_row=facet_row_col, hover_data=scatter_hover_cols,
+                                   marginal_box=show_boxplot, max_points=scatter_max_points, title=plot_title, height=plot_height, # width=plot_width,
+                                   opacity=dot_opacity, size_max=dot_max_size)
+
+                              with scatter_placeholder.container():
+                                   st.plotly_chart(fig, use_container_width=True)
+                                   if is_downsampled:
+                                        st.caption(f"{n_points} of {len(swaps)} swaps drawn: every outlier, the extremes over the x-axis and a sample of the rest (the box plots use every swap). Hover a point for its swap_id to see all its columns.")
+
+                    if 'heatmap per symbol' in types_of_plots:
+                         with instruments.span('render', section='heatmap per symbol'):
+                              agg_tokens_by_volume = swaps_cube.token_pairs(heatmap_metric).head(heatmap_show_top_n)
+
+                              pivoted_tokens_by_volumes = pd.pivot(agg_tokens_by_volume, index='token_asset_in', columns='token_asset_out', values='amount_in_usd')
+
+                              fig = px.imshow(pivoted_tokens_by_volumes, text_auto=True, title=f'Heatmap of the {heatmap_metric} by token in and out', aspect='equal', height=1000, width=1000)
+                              fig.update_xaxes(nticks=100, tickfont={'size': 10}, showgrid=False)
+                              fig.update_yaxes(nticks=100, tickfont={'size': 10}, showgrid=False)
+                              fig.update_layout(title=f'Top {heatmap_show_top_n} Transfers Heatmap')
+                              heatmap_placeholder.plotly_chart(fig, use_container_width=True)
+
+                    if 'top pools and dexes' in types_of_plots:
+                         with instruments.span('render', section='top pools and dexes'):
+                              agg_dex_and_pools = swaps_cube.dex_pools(top_pools_metric)
+
+                              with top_pools_placeholder.container():
+                                   fig = px.sunburst(agg_dex_and_pools[agg_dex_and_pools['amount_in_usd']!=0], path=['dex', 'pool_name'], values='amount_in_usd', height=800)
+                                   fig.update_layout(
+                                        title=f'Top Pools and DEXes by {top_pools_metric}',
+                                   font=dict(
+                                        size=font_size,
+                                   )
+                                   )
+                                   st.plotly_chart(fig, use_container_width=True)
+
+                                   weekly_dex_vol = cap_groups(swaps_cube.weekly_volume('dex'), 'dex', 'amount_in_usd')
+
+                                   fig = px.bar(weekly_dex_vol, x='swap_datetime', y='amount_in_usd', title='Weekly Volume in USD per DEX', height=800, color='dex')
+                                   st.plotly_chart(fig, use_container_width=True)
+
+                                   # the smaller pools are summed into one 'other' segment
+                                   weekly_dex_vol = cap_groups(swaps_cube.weekly_volume('pool_name'), 'pool_name', 'amount_in_usd')
+
+                                   fig = px.bar(weekly_dex_vol, x='swap_datetime', y='amount_in_usd', title='Weekly Volume in USD per Pool', height=800, color='pool_name')
+                                   st.plotly_chart(fig, use_container_width=True)
+
+                    if 'net token volume' in types_of_plots:
+                         with instruments.span('render', section='net token volume'):
+                              total_netted = swaps_cube.token_volume('net', ('token_asset',))
+                              total_netted = total_netted[total_netted['amount_usd']!=0]
+                              total_netted = total_netted[total_netted['token_asset']!='']
+                              total_netted = total_netted.sort_values(by='amount_usd', ascending=False)
+
+                              with net_token_volume_placeholder.container():
+                                   top_netted = total_netted.head(net_token_volume_show_top_n)
+                                   fig = px.bar(top_netted, x='token_asset', y='amount_usd', title=f'Top {net_token_volume_show_top_n} Tokens by Netted Volume in USD', height=800, text_auto=True)
+                                   st.plotly_chart(fig, use_container_width=True)
+
+                                   bottom_netted = total_netted.tail(net_token_volume_show_top_n)
+                                   fig = px.bar(bottom_netted, x='token_asset', y='amount_usd', title=f'Bottom {net_token_volume_show_top_n} Tokens by Netted Volume in USD', height=800, text_auto=True)
+                                   st.plotly_chart(fig, use_container_width=True)
+
+                                   weekly_plot_col = 'token_asset' 
+                                   weekly_movement = swaps_cube.weekly_token_volume('net')
+                                   weekly_movement = weekly_movement[weekly_movement['amount_usd']!=0]
+                                   weekly_movement = weekly_movement[weekly_movement[weekly_plot_col]!='']
+                                   weekly_movement = cap_groups(weekly_movement, weekly_plot_col, 'amount_usd')
+                                   weekly_movement = weekly_movement.sort_values(by='amount_usd', ascending=False)
+
+                                   fig = px.bar(weekly_movement, x='swap_datetime', y='amount_usd', title='Weekly Netted Volume in USD per token', height=800, color=weekly_plot_col)
+                                   st.plotly_chart(fig, use_container_width=True)
+
+
+                    if 'absolute token volume' in types_of_plots:
+                         with instruments.span('render', section='absolute token volume'):
+                              total_abs = swaps_cube.token_volume('abs', ('token_asset', 'dex'))
+                              total_abs = total_abs[total_abs['amount_usd']!=0]
+                              total_abs = total_abs[total_abs['token_asset']!='']
+                              total_abs = total_abs.sort_values(by='amount_usd', ascending=False)
+
+                              with abs_token_volume_placeholder.container():
+                                   fig = px.bar(total_abs.head(abs_token_volume_show_top_n), x='token_asset', y='amount_usd', title='Total Absolute Volume in USD per token', height=800, text_auto=True, color='dex')
+                                   fig.update_layout(barmode='stack', xaxis={'categoryorder':'total descending'})    
+                                   st.plotly_chart(fig, use_container_width=True)
+
+                                   weekly_plot_col = 'token_asset' 
+                                   weekly_movement = swaps_cube.weekly_token_volume('abs')
+                                   weekly_movement = weekly_movement[weekly_movement['amount_usd']!=0]
+                                   weekly_movement = weekly_movement[weekly_movement[weekly_plot_col]!='']
+                                   weekly_movement = cap_groups(weekly_movement, weekly_plot_col, 'amount_usd')
+                                   weekly_movement = weekly_movement.sort_values(by='amount_usd', ascending=False)
+
+                                   fig = px.bar(weekly_movement, x='swap_datetime', y='amount_usd', title='Weekly Absolute Volume in USD per token', height=800, color=weekly_plot_col)
+                                   st.plotly_chart(fig, use_container_width=True)
+
+                    if 'raw data' in types_of_plots:
+                         with instruments.span('render', section='raw data'):
+                              raw_data_df = swaps.to_pandas().assign(dummy=999)
+                              raw_data_placeholder.write(raw_data_df)
+     finally:
+          profile_report = profiler.stop()
+
+     loading_status.caption(f"{len(swaps)} swaps from {n_dexes} dexes")
+
+     if 'scatter' in types_of_plots and scatter_swap_ids.strip():
+          # the details left out of the hover, only for the swaps asked for
+          swap_ids = [int(swap_id) for swap_id in scatter_swap_ids.split(",") if swap_id.strip().isdigit()]
+          scatter_details_placeholder.write(swap_details(swaps, swap_ids))
+
+     if len(failed_report) > 0:
+          st.warning(f"{len(failed_report)} dexes couldn't be fetched, their swaps are missing: {', '.join(failed_report['project'])}")
+          with st.expander('Fetch report'):
+               st.write(failed_report)
 
      if 'raw data' in types_of_plots:
-          st.subheader("Raw data")
-          st.write(swaps_df)
-          # download button for dex_data
-          dex_data_json = swaps_df.to_json().encode('utf-8')
-
-          #
-          csv_data_json = swaps_df.to_csv().encode('utf-8')
-
-          st.download_button(
-               label = 'Download json with dex data',
-               data=dex_data_json,
-               file_name='dex_data.json',
-               mime='application/json'
-          )
-
-          st.download_button(
-               label = 'Download csv with dex data',
-               data=csv_data_json,
-               file_name='dex_data.csv',
-               mime='text/csv'
-          )
+          # the export is only built when asked for, encoded chunk by chunk, so only the compressed file is held
+          export_col1, export_col2 = st.columns(2)
+          export_format = export_col1.selectbox('Export format', list(EXPORT_FORMATS))
+          if export_col2.button('Prepare the download of the swaps'):
+               with st.spinner('Exporting...'):
+                    export_file = io.BytesIO()
+                    export_swaps(swaps, export_file, export_format)
+                    export_file.seek(0)
+
+               st.download_button(
+                    label = f'Download {export_format} with dex data',
+                    data=export_file,
+                    file_name=f'dex_data.{export_format}',
+                    mime=EXPORT_FORMATS[export_format]
+               )
+
+if show_timings:
+     st.subheader("Timings")
+     spans_df = instruments.spans_df(trace_id)
+     if 'section' not in spans_df:
+          spans_df['section'] = None
+     stages_df = spans_df.fillna({'section': ''}).groupby(['stage', 'section'], as_index=False).agg(seconds=('seconds', 'sum'), n_spans=('span_id', 'size'))
+     fig = px.bar(stages_df.sort_values('seconds', ascending=False), x='seconds', y='stage', color='section', orientation='h', title='Time per stage (summed over spans, concurrent ones overlap)')
+     st.plotly_chart(fig, use_container_width=True)
+     st.write(spans_df)
+     st.download_button(label='Download the Prometheus metrics', data=instruments.to_prometheus().encode('utf-8'), file_name='metrics.txt', mime='text/plain')
+
+if profile_report is not None:
+     with st.expander('Profile'):
+          st.text(profile_report)
+
+if types_of_plots and live_mode:
+     # one poll per run, once everything above is drawn, then a rerun redraws the charts with the new swaps
+     tail = st.session_state['tail']
+     if export_file is not None:
+          live_status.caption("Watching for new swaps is paused while the download is offered")
+     else:
+          last_poll = st.session_state.get('tail_last_poll', '')
+          # waits a second at a time, so a widget changed meanwhile can stop this run
+          while tail.next_poll_in() > 0:
+               live_status.caption(f"Watching for new swaps{last_poll}, the next poll in {tail.next_poll_in():.0f}s")
+               time.sleep(min(1.0, tail.next_poll_in()))
+          live_status.caption("Watching for new swaps, polling...")
+          n_new = tail.poll()
+          st.session_state['tail_last_poll'] = f", the last poll at {pd.Timestamp.now():%H:%M:%S} brought {n_new}"
+          st.experimental_rerun()
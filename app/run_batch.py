@@ -0,0 +1,47 @@
+"""
+Runs the analyzooor over many wallet cohorts, without the dashboard: every cohort gets its
+clean swaps, the aggregate cube and the fetch report in `<out>/<cohort>/`. Finished cohorts
+are logged in `<out>/job_log.jsonl`, so running the same command again resumes the batch.
+
+    python app/run_batch.py cohorts.json --out results --workers 8
+"""
+import argparse
+import os
+
+import pandas as pd
+
+from utils.batch_jobs import read_cohorts, run_batch
+from utils.dex_subgraphs_wrapper import DexSubgraphsWrapper
+from utils.swaps_export import EXPORT_FORMATS
+from utils.swaps_filters import SwapsFilter
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("cohorts", help="json file of {cohort: [wallets]}, or csv file with cohort and wallet columns")
+	parser.add_argument("--out", default="batch_results")
+	parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes cleaning and aggregating the cohorts")
+	parser.add_argument("--in-flight", type=int, help="cohorts fetched or waiting for a worker at once, 2 per worker by default")
+	parser.add_argument("--no-resume", action="store_true", help="runs the cohorts already in the job log again")
+	parser.add_argument("--start", help="only swaps from this date on")
+	parser.add_argument("--end", help="only swaps before this date")
+	parser.add_argument("--export", nargs="+", default=[], choices=list(EXPORT_FORMATS), help="also write the clean swaps of every cohort as swaps.<format>")
+	parser.add_argument("--cache-dir", default=os.environ.get("SWAPS_CACHE_DIR", ".swaps_cache"))
+	parser.add_argument("--base-url", default="https://api.thegraph.com/subgraphs/name/messari", help="where the subgraphs are served, for self-hosted graph nodes")
+	args = parser.parse_args()
+
+	wrapper = DexSubgraphsWrapper(base_url=args.base_url, cache_dir=args.cache_dir, schema_cache_dir=os.path.join(args.cache_dir, "schemas"))
+	swaps_filter = SwapsFilter(start=args.start, end=args.end) if args.start or args.end else None
+
+	results = run_batch(
+		read_cohorts(args.cohorts), args.out, wrapper, n_workers=args.workers,
+		max_cohorts_in_flight=args.in_flight, resume=not args.no_resume, swaps_filter=swaps_filter,
+		export_formats=args.export,
+	)
+	with pd.option_context("display.max_rows", None, "display.width", 200):
+		print(results.drop(columns=["failed_dexes", "error"], errors="ignore").to_string(index=False))
+	print(results['status'].value_counts().to_string())
+
+
+if __name__ == "__main__":
+	main()
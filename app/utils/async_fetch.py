@@ -0,0 +1,255 @@
+import asyncio
+import contextvars
+import json
+import queue
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+import aiohttp
+import pandas as pd
+
+from .fetch_scheduler import FetchScheduler, SubgraphQueryError
+from .instrumentation import instruments
+from .swaps_pagination import MAX_PAGE_SIZE, build_swaps_query, concat_pages, shard_bounds, split_at_boundary, swaps_json_to_df
+
+
+@dataclass
+class QueryMetric():
+	url: str
+	n_fields: int
+	n_rows: int
+	n_bytes: int
+	latency_s: float
+	n_attempts: int = 1
+	hedged: bool = False
+
+
+def metrics_to_df(metrics: List[QueryMetric]) -> pd.DataFrame:
+	df = pd.DataFrame([vars(metric) for metric in metrics], columns=list(QueryMetric.__dataclass_fields__))
+	# subgraph urls end with the project name
+	df['project'] = df['url'].str.rsplit('/', n=1).str[-1]
+	return df
+
+
+class AsyncSubgraphClient():
+	"""
+	One aiohttp session shared by every subgraph query, so requests to the same host
+	reuse keep-alive connections. `max_concurrency` caps in-flight requests overall and
+	`max_concurrency_per_host` per host; requests past the limits wait for a free connection.
+	With a `scheduler`, requests get its deadlines, retries and hedging.
+	"""
+
+	def __init__(self, max_concurrency: int = 32, max_concurrency_per_host: int = 16, timeout: Optional[float] = 60, keepalive_timeout: float = 30, scheduler: Optional[FetchScheduler] = None) -> None:
+		self.scheduler = scheduler
+		self.max_concurrency = max_concurrency
+		self.max_concurrency_per_host = max_concurrency_per_host
+		self.timeout = timeout
+		self.keepalive_timeout = keepalive_timeout
+		self.session = None
+		# host -> semaphore of `max_concurrency_per_host`, so the scheduler's deadlines start once a request is sent
+		self._slots: Dict[str, asyncio.Semaphore] = {}
+		# one entry per successful request, in completion order
+		self.metrics: List[QueryMetric] = []
+
+	async def __aenter__(self) -> "AsyncSubgraphClient":
+		connector = aiohttp.TCPConnector(
+			limit=self.max_concurrency,
+			limit_per_host=self.max_concurrency_per_host,
+			keepalive_timeout=self.keepalive_timeout,
+		)
+		self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+		return self
+
+	async def __aexit__(self, *exc) -> None:
+		await self.session.close()
+		self.session = None
+
+	async def _post_once(self, url: str, payload: Dict) -> Tuple[Dict, int, float]:
+		start = time.perf_counter()
+		async with self.session.post(url, json=payload) as resp:
+			resp.raise_for_status()
+			raw = await resp.read()
+		latency = time.perf_counter() - start
+
+		body = json.loads(raw)
+		if "errors" in body:
+			raise SubgraphQueryError(body["errors"])
+		return body["data"], len(raw), latency
+
+	async def post(self, url: str, query: str, variables: Optional[Dict] = None) -> Dict:
+		payload = {"query": query} if not variables else {"query": query, "variables": variables}
+		if self.scheduler is None:
+			(data, n_bytes, latency), n_attempts, hedged = await self._post_once(url, payload), 1, False
+		else:
+			host = urllib.parse.urlsplit(url).netloc
+			slot = self._slots.setdefault(host, asyncio.Semaphore(self.max_concurrency_per_host))
+			(data, n_bytes, latency), n_attempts, hedged = await self.scheduler.run(url, lambda: self._post_once(url, payload), slot)
+
+		n_rows = sum(len(v) for v in data.values() if isinstance(v, list))
+		self.metrics.append(QueryMetric(url, len(data), n_rows, n_bytes, latency, n_attempts, hedged))
+		instruments.record_request(url, latency, n_bytes, n_rows, n_attempts, hedged)
+		return data
+
+
+class AsyncSwapsPaginator():
+	"""
+	asyncio counterpart of `SwapsPaginator`: same keyset cursors and time-range shards,
+	with the shards walked as tasks on the shared client instead of threads.
+	"""
+
+	def __init__(self, client: AsyncSubgraphClient, url: str, where: Dict, page_size: int = MAX_PAGE_SIZE, max_shards: int = 4) -> None:
+		self.client = client
+		self.url = url
+		self.where = dict(where)
+		self.page_size = min(page_size, MAX_PAGE_SIZE)
+		self.max_shards = max(max_shards, 1)
+
+	async def _query(self, where: Dict, first: int, order_by: str = "timestamp", order_direction: str = "desc") -> List[Dict]:
+		query = "{ " + build_swaps_query(where, first, order_by, order_direction) + " }"
+		return (await self.client.post(self.url, query))["swaps"]
+
+	async def _query_first_page_and_oldest(self) -> Tuple[List[Dict], List[Dict]]:
+		# the oldest swap is only needed for deep histories, but asking along saves a round trip
+		query = "{ " + build_swaps_query(self.where, self.page_size, alias="page") + " " + build_swaps_query(self.where, 1, order_direction="asc", alias="oldest") + " }"
+		data = await self.client.post(self.url, query)
+		return data["page"], data["oldest"]
+
+	async def _drain_timestamp(self, timestamp: int) -> AsyncIterator[List[Dict]]:
+		where = {**self.where, "timestamp": timestamp}
+		while True:
+			swaps = await self._query(where, self.page_size, order_by="id", order_direction="asc")
+			if swaps:
+				yield swaps
+			if len(swaps) < self.page_size:
+				return
+			where["id_gt"] = swaps[-1]["id"]
+
+	async def _walk(self, where: Dict) -> AsyncIterator[List[Dict]]:
+		where = dict(where)
+		while True:
+			swaps = await self._query(where, self.page_size)
+			if len(swaps) < self.page_size:
+				if swaps:
+					yield swaps
+				return
+
+			head, boundary = split_at_boundary(swaps)
+			if head:
+				yield head
+			async for tied in self._drain_timestamp(boundary):
+				yield tied
+			where["timestamp_lt"] = boundary
+
+	async def _walk_shards(self, shards: List[Tuple[int, int]]) -> AsyncIterator[List[Dict]]:
+		pages = asyncio.Queue(maxsize=2 * len(shards))
+		done = object()
+
+		async def walk_shard(gte: int, lt: int) -> None:
+			try:
+				async for swaps in self._walk({**self.where, "timestamp_gte": gte, "timestamp_lt": lt}):
+					await pages.put(swaps)
+			except Exception as e:
+				await pages.put(e)
+			finally:
+				await pages.put(done)
+
+		tasks = [asyncio.create_task(walk_shard(gte, lt)) for gte, lt in shards]
+		remaining = len(tasks)
+		try:
+			while remaining:
+				item = await pages.get()
+				if item is done:
+					remaining -= 1
+				elif isinstance(item, Exception):
+					raise item
+				else:
+					yield item
+		finally:
+			for task in tasks:
+				task.cancel()
+			await asyncio.gather(*tasks, return_exceptions=True)
+
+	async def iter_pages(self) -> AsyncIterator[List[Dict]]:
+		first_page, oldest = await self._query_first_page_and_oldest()
+		if len(first_page) < self.page_size:
+			if first_page:
+				yield first_page
+			return
+
+		head, boundary = split_at_boundary(first_page)
+		if head:
+			yield head
+
+		lowest = int(oldest[0]["timestamp"]) if oldest else boundary
+		async for swaps in self._walk_shards(shard_bounds(lowest, boundary, self.max_shards)):
+			yield swaps
+
+	async def fetch_df(self, max_rows: Optional[int] = None) -> pd.DataFrame:
+		# shards complete out of order, so a capped fetch walks newest-first sequentially
+		pages = self.iter_pages() if max_rows is None else self._walk(self.where)
+
+		list_of_dfs = []
+		n_rows = 0
+		async for swaps in pages:
+			list_of_dfs.append(swaps_json_to_df(swaps))
+			n_rows += len(swaps)
+			if max_rows is not None and n_rows >= max_rows:
+				break
+		await pages.aclose()
+
+		return concat_pages(list_of_dfs, max_rows)
+
+
+def iter_in_background_loop(make_async_iterator: Callable[[], AsyncIterator]) -> Iterator:
+	"""
+	Runs an async iterator on its own event loop in a worker thread and hands its items to
+	a plain generator, so sync code (or code already inside an event loop) can consume it.
+	Closing the generator early cancels the async side.
+	"""
+	items = queue.Queue()
+	done = object()
+	started = threading.Event()
+	running = {}
+
+	async def drain() -> None:
+		running["loop"], running["task"] = asyncio.get_running_loop(), asyncio.current_task()
+		started.set()
+		iterator = make_async_iterator()
+		try:
+			async for item in iterator:
+				items.put(item)
+		except Exception as e:
+			items.put(e)
+		finally:
+			await iterator.aclose()
+			items.put(done)
+
+	# the spans of the background loop belong to the trace of the caller
+	context = contextvars.copy_context()
+
+	def run() -> None:
+		try:
+			context.run(asyncio.run, drain())
+		except asyncio.CancelledError:
+			pass
+
+	threading.Thread(target=run, daemon=True).start()
+	started.wait()
+	try:
+		while True:
+			item = items.get()
+			if item is done:
+				return
+			if isinstance(item, Exception):
+				raise item
+			yield item
+	finally:
+		if not running["task"].done():
+			try:
+				running["loop"].call_soon_threadsafe(running["task"].cancel)
+			except RuntimeError:
+				# the loop closed in the meantime, nothing left to cancel
+				pass
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import pandas as pd
+
+from .dex_subgraphs_wrapper import DexSubgraphsWrapper
+from .swaps_aggregates import SwapsCube
+from .swaps_export import export_swaps
+from .swaps_filters import SwapsFilter
+from .token_prices import PriceTable
+
+
+def read_cohorts(path: str) -> Dict[str, List[str]]:
+	"""
+	Wallet cohorts of a json file ({"cohort": ["0x...", ...]}) or of a csv file with `cohort`
+	and `wallet` columns, one row per wallet.
+	"""
+	if path.endswith(".json"):
+		with open(path) as f:
+			cohorts = json.load(f)
+	else:
+		df = pd.read_csv(path, dtype=str)
+		cohorts = {cohort: list(group['wallet']) for cohort, group in df.groupby('cohort', sort=False)}
+
+	for cohort in cohorts:
+		if not re.fullmatch(r"[\w.-]+", cohort) or cohort.startswith("."):
+			raise ValueError(f"cohort names are used as directory names, {cohort!r} isn't a valid one")
+	return {cohort: [wallet.strip() for wallet in wallets] for cohort, wallets in cohorts.items()}
+
+
+class JobLog():
+	"""
+	Append-only json lines log of the cohorts of a batch, one line per finished cohort
+	(ok, partial when some dexes failed, or failed). A cohort is only logged once its
+	results are on disk, so a batch that was killed resumes by skipping the ok ones.
+	"""
+
+	def __init__(self, path: str) -> None:
+		self.path = path
+
+	def entries(self) -> List[Dict]:
+		if not os.path.exists(self.path):
+			return []
+		with open(self.path) as f:
+			# a line cut short by a kill is ignored, its cohort runs again
+			return [json.loads(line) for line in f if line.endswith("\n")]
+
+	def done(self) -> set:
+		# cohorts whose last run was ok
+		last = {entry["cohort"]: entry["status"] for entry in self.entries()}
+		return {cohort for cohort, status in last.items() if status == "ok"}
+
+	def record(self, entry: Dict) -> None:
+		with open(self.path, "a") as f:
+			f.write(json.dumps(entry) + "\n")
+			f.flush()
+			os.fsync(f.fileno())
+
+
+def clean_and_aggregate(cohort_dir: str, raw_df: pd.DataFrame, fetch_report: pd.DataFrame, export_formats: Sequence[str] = (),
+		prices: Optional[PriceTable] = None) -> Dict:
+	"""
+	Runs in the worker processes: `build_clean_df` and the aggregate cube of a cohort, written
+	to `cohort_dir` as swaps.parquet, cells.parquet and fetch_report.csv, plus swaps.<format>
+	for every one of `export_formats`. The files go to a temporary directory that replaces
+	`cohort_dir` at the end, so a cohort is never half written. `prices` is the token index
+	snapshot of the fetching process, the workers don't have the index.
+	"""
+	clean_df = DexSubgraphsWrapper.build_clean_df(raw_df, prices)
+	cube = SwapsCube.from_swaps_df(clean_df)
+
+	tmp_dir = f"{cohort_dir}.{os.getpid()}.tmp"
+	shutil.rmtree(tmp_dir, ignore_errors=True)
+	os.makedirs(tmp_dir)
+	for fmt in dict.fromkeys(['parquet', *export_formats]):
+		export_swaps(clean_df, os.path.join(tmp_dir, f"swaps.{fmt}"))
+	cube.cells.to_parquet(os.path.join(tmp_dir, "cells.parquet"), index=False)
+	fetch_report.to_csv(os.path.join(tmp_dir, "fetch_report.csv"), index=False)
+	shutil.rmtree(cohort_dir, ignore_errors=True)
+	os.replace(tmp_dir, cohort_dir)
+
+	return {
+		"n_swaps": len(clean_df),
+		"n_dexes": int(clean_df['dex'].nunique()),
+		"volume_usd": float(cube.cells['amount_in_usd'].sum()),
+	}
+
+
+async def arun_batch(cohorts: Dict[str, List[str]], out_dir: str, wrapper: DexSubgraphsWrapper, pool: ProcessPoolExecutor,
+		max_cohorts_in_flight: int, resume: bool = True, swaps_filter: Optional[SwapsFilter] = None, export_formats: Sequence[str] = ()) -> pd.DataFrame:
+	"""
+	Fetches the cohorts concurrently on one client, so they share its connection pool (and the
+	swaps cache of `wrapper`), and hands each raw df to `pool` for the cpu bound stages.
+	`max_cohorts_in_flight` caps the cohorts fetched or waiting for a worker, and with them the
+	raw dfs held in memory.
+	"""
+	os.makedirs(out_dir, exist_ok=True)
+	job_log = JobLog(os.path.join(out_dir, "job_log.jsonl"))
+	done = job_log.done() if resume else set()
+
+	loop = asyncio.get_running_loop()
+	in_flight = asyncio.Semaphore(max_cohorts_in_flight)
+
+	async def run_cohort(client, cohort: str, wallets: List[str]) -> Dict:
+		if cohort in done:
+			return {"cohort": cohort, "status": "skipped"}
+
+		async with in_flight:
+			start = time.perf_counter()
+			try:
+				raw_df, fetch_report = await wrapper.aget_raw_swaps_df(client, wallets, swaps_filter)
+				fetch_s = time.perf_counter() - start
+				summary = await loop.run_in_executor(pool, clean_and_aggregate, os.path.join(out_dir, cohort), raw_df, fetch_report, export_formats, wrapper.token_index.table)
+			except Exception as e:
+				entry = {"cohort": cohort, "status": "failed", "elapsed_s": time.perf_counter() - start, "error": repr(e)}
+			else:
+				not_ok = fetch_report.loc[fetch_report['status'] != 'ok', 'project'].tolist()
+				entry = {
+					"cohort": cohort, "status": "partial" if not_ok else "ok", **summary,
+					"fetch_s": fetch_s, "elapsed_s": time.perf_counter() - start, "failed_dexes": not_ok,
+				}
+			await asyncio.to_thread(job_log.record, entry)
+			return entry
+
+	async with wrapper._make_async_client() as client:
+		entries = await asyncio.gather(*(run_cohort(client, cohort, wallets) for cohort, wallets in cohorts.items()))
+	return pd.DataFrame(entries)
+
+
+def run_batch(cohorts: Dict[str, List[str]], out_dir: str, wrapper: Optional[DexSubgraphsWrapper] = None, n_workers: Optional[int] = None,
+		max_cohorts_in_flight: Optional[int] = None, resume: bool = True, swaps_filter: Optional[SwapsFilter] = None,
+		export_formats: Sequence[str] = ()) -> pd.DataFrame:
+	"""
+	Analyses every cohort into `out_dir/<cohort>/` and returns one row per cohort: ok, partial,
+	failed, or skipped when `resume` and an earlier run already did it. Cleaning and aggregating
+	run in `n_workers` processes (one per core by default), next to the fetches of other cohorts.
+	The clean swaps are also exported in `export_formats` (see `swaps_export.EXPORT_FORMATS`).
+	"""
+	wrapper = wrapper if wrapper is not None else DexSubgraphsWrapper()
+	n_workers = n_workers if n_workers is not None else os.cpu_count()
+	# enough cohorts fetching to keep every worker busy
+	max_cohorts_in_flight = max_cohorts_in_flight if max_cohorts_in_flight is not None else 2 * n_workers + 2
+
+	# spawned, the workers don't inherit the threads and the event loop of this process
+	with ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+		return asyncio.run(arun_batch(cohorts, out_dir, wrapper, pool, max_cohorts_in_flight, resume, swaps_filter, export_formats))
@@ -0,0 +1,157 @@
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from .compact_swaps import CompactSwaps
+from .instrumentation import instruments
+
+# above this many points scatters are drawn with WebGL (plotly's own `auto` decides per trace, so many small groups stayed SVG)
+WEBGL_MIN_POINTS = 1_000
+# points sent to the browser at most, the rest is downsampled
+MAX_SCATTER_POINTS = 20_000
+# colors, facet rows and bar segments past these are summed into OTHER
+MAX_COLORS = 20
+MAX_FACETS = 6
+MAX_BAR_GROUPS = 20
+OTHER = 'other'
+# id of the row of a swap in the compact swaps, the only hover detail of downsampled scatters
+SWAP_ID = 'swap_id'
+
+
+def is_numeric(series: pd.Series) -> bool:
+	return pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_datetime64_any_dtype(series.dtype)
+
+
+def cap_categories(values: pd.Series, max_categories: int, weights: Optional[pd.Series] = None) -> Tuple[pd.Series, List]:
+	"""
+	`values` with every category but the `max_categories` - 1 largest ones (by the sum of
+	`weights`, or their number of rows) replaced by OTHER, and the categories kept, largest first.
+	"""
+	totals = (weights.abs() if weights is not None else pd.Series(1, index=values.index)).groupby(values.astype(object), sort=False).sum()
+	if len(totals) <= max_categories:
+		return values, list(totals.sort_values(ascending=False).index)
+	top = list(totals.nlargest(max_categories - 1).index)
+	return values.astype(object).where(values.isin(top), OTHER), top + [OTHER]
+
+
+def cap_groups(df: pd.DataFrame, by: str, value: str, keys: Sequence[str] = ('swap_datetime',), max_groups: int = MAX_BAR_GROUPS) -> pd.DataFrame:
+	# one bar segment per `keys` and group, with the smaller groups summed into OTHER
+	capped, _ = cap_categories(df[by], max_groups, weights=df[value])
+	if capped is df[by]:
+		return df
+	return df.assign(**{by: capped}).groupby(list(keys) + [by], sort=False, as_index=False)[value].sum()
+
+
+def box_stats(y: pd.Series, groups: Optional[pd.Series] = None) -> pd.DataFrame:
+	# quartiles and whisker ends of plotly's box plots (linear quartiles, whiskers up to 1.5 IQR), per group
+	groups = pd.Series('', index=y.index) if groups is None else groups.astype(object)
+	grouped = y.groupby(groups, sort=False)
+	stats = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+	stats.columns = ['q1', 'median', 'q3']
+	iqr = stats['q3'] - stats['q1']
+	low = (stats['q1'] - 1.5 * iqr).reindex(groups).to_numpy()
+	high = (stats['q3'] + 1.5 * iqr).reindex(groups).to_numpy()
+	stats['lowerfence'] = y[y.to_numpy() >= low].groupby(groups, sort=False).min()
+	stats['upperfence'] = y[y.to_numpy() <= high].groupby(groups, sort=False).max()
+	return stats
+
+
+@instruments.traced("downsample_points")
+def downsample_points(df: pd.DataFrame, x: str, y: str, max_points: int, groups: Optional[pd.Series] = None, seed: int = 0) -> pd.DataFrame:
+	"""
+	At most `max_points` rows of `df`, in their order, that still look like the whole: every
+	outlier of the box plot of `y` (per group, the most extreme ones first if they don't fit),
+	the lowest and highest `y` of every bin of `x`, so peaks of a time series survive, and a
+	uniform sample of the rest. Rows without `x` or `y` are dropped, plotly doesn't draw them.
+	"""
+	df = df[df[x].notna() & df[y].notna()]
+	if len(df) <= max_points:
+		return df
+	rng = np.random.default_rng(seed)
+	keep = np.zeros(len(df), dtype=bool)
+
+	if is_numeric(df[y]) and not pd.api.types.is_datetime64_any_dtype(df[y].dtype):
+		values = df[y].astype(np.float64)
+		group_values = None if groups is None else groups.loc[df.index]
+		stats = box_stats(values, group_values)
+		if group_values is None:
+			group_values = pd.Series('', index=df.index)
+		low = stats['lowerfence'].reindex(group_values.astype(object)).to_numpy()
+		high = stats['upperfence'].reindex(group_values.astype(object)).to_numpy()
+		# how far past its whisker, in interquartile ranges
+		iqr = (stats['q3'] - stats['q1']).reindex(group_values.astype(object)).to_numpy()
+		distance = np.maximum(low - values.to_numpy(), values.to_numpy() - high) / np.where(iqr > 0, iqr, 1)
+		outliers = np.flatnonzero(distance > 0)
+		keep[outliers[np.argsort(-distance[outliers], kind='stable')[:max_points // 2]]] = True
+
+		if is_numeric(df[x]):
+			# the extremes of `max_points // 8` bins of x
+			x_values = df[x].to_numpy().astype(np.float64)
+			span = x_values.max() - x_values.min()
+			bins = ((x_values - x_values.min()) / (span if span > 0 else 1) * (max_points // 8 - 1)).astype(np.int64)
+			positions = pd.Series(values.to_numpy()).groupby(bins)
+			keep[positions.idxmin().to_numpy()] = True
+			keep[positions.idxmax().to_numpy()] = True
+
+	n_sampled = max_points - keep.sum()
+	if n_sampled > 0:
+		rest = np.flatnonzero(~keep)
+		keep[rng.choice(rest, size=min(n_sampled, len(rest)), replace=False)] = True
+	return df[keep]
+
+
+def scatter_figure(
+	df: pd.DataFrame, x: str, y: str, color: Optional[str] = None, size: Optional[str] = None, facet_row: Optional[str] = None,
+	hover_data: Optional[List[str]] = None, marginal_box: bool = False, max_points: int = MAX_SCATTER_POINTS, **kwargs,
+) -> Tuple[go.Figure, int]:
+	"""
+	`px.scatter` of `df` that stays light in the browser however many swaps it has: WebGL above
+	WEBGL_MIN_POINTS, at most `max_points` points (see `downsample_points`), categorical colors
+	and facet rows capped with an OTHER category, and the marginal box plots computed from every
+	row rather than the points drawn. `df` must be indexed by SWAP_ID; when it is downsampled,
+	the hover only shows the plotted columns and the swap id, to look up the rest on demand.
+	Returns the figure and the number of points drawn.
+	"""
+	df = df.rename_axis(SWAP_ID).reset_index()
+	category_orders, color_map = {}, {OTHER: 'lightgray'}
+	if facet_row is not None:
+		df[facet_row], category_orders[facet_row] = cap_categories(df[facet_row], MAX_FACETS)
+	if color is not None and not is_numeric(df[color]):
+		df[color], category_orders[color] = cap_categories(df[color], MAX_COLORS)
+	groups = df[color].astype(object) if color in category_orders else None
+
+	plotted = df
+	if len(df) > max_points:
+		plotted = downsample_points(df, x, y, max_points, groups=groups)
+		hover_data = [x, y, color]
+	hover_data = [col for col in dict.fromkeys((hover_data or []) + [SWAP_ID]) if col is not None]
+	# the same size for every point is just `size_max`, not a column to send
+	constant_size = size is not None and plotted[size].nunique() <= 1
+	if constant_size:
+		size = None
+		size_max = kwargs.pop('size_max', 20)
+
+	fig = px.scatter(
+		plotted, x=x, y=y, color=color, size=size, facet_row=facet_row, hover_data=hover_data,
+		marginal_y='box' if marginal_box else None, category_orders=category_orders, color_discrete_map=color_map,
+		render_mode='webgl' if len(plotted) > WEBGL_MIN_POINTS else 'svg', **kwargs,
+	)
+	if constant_size:
+		fig.update_traces(marker_size=size_max, selector=lambda trace: trace.type in ('scatter', 'scattergl'))
+	if marginal_box and plotted is not df and facet_row is None and is_numeric(df[y]):
+		# boxes of the whole data, not of the sample (which keeps every outlier); with facets they stay approximate
+		stats = box_stats(df[y].astype(np.float64), groups)
+		for trace in fig.data:
+			if trace.type == 'box' and trace.legendgroup in stats.index:
+				group_stats = stats.loc[trace.legendgroup]
+				trace.update(y=None, x=None, boxpoints=False, **{stat: [group_stats[stat]] for stat in stats.columns})
+	return fig, len(plotted)
+
+
+def swap_details(swaps: CompactSwaps, swap_ids: Sequence[int]) -> pd.DataFrame:
+	# every column of the swaps picked from the hover of a downsampled scatter
+	swap_ids = [swap_id for swap_id in dict.fromkeys(swap_ids) if 0 <= swap_id < len(swaps)]
+	return CompactSwaps(swaps.table.take(swap_ids)).to_pandas().set_axis(pd.Index(swap_ids, name=SWAP_ID))
@@ -0,0 +1,148 @@
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from .instrumentation import instruments
+from .swaps_normalization import CLEAN_COLUMNS, masked_divide, scale_raw_amounts
+from .swaps_pagination import RAW_COLUMNS
+from .token_prices import PriceTable, price_columns
+
+# "0x" and 32 bytes in hex
+_HASH_LENGTH = 66
+_HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+_HEX_VALUES = np.full(256, 255, dtype=np.uint8)
+_HEX_VALUES[np.frombuffer(b"0123456789abcdef", dtype=np.uint8)] = np.arange(16)
+_HEX_VALUES[np.frombuffer(b"ABCDEF", dtype=np.uint8)] = np.arange(10, 16)
+
+
+def dictionary_encode(values: np.ndarray) -> pa.DictionaryArray:
+	# every distinct string stored once, rows hold int32 codes into them
+	codes, uniques = pd.factorize(values)
+	indices = pa.array(codes.astype(np.int32), mask=codes < 0)
+	return pa.DictionaryArray.from_arrays(indices, pa.array(np.asarray(uniques, dtype=object), type=pa.string()))
+
+
+def encode_hashes(hashes: np.ndarray) -> pa.Array:
+	"""
+	Tx hashes as 32 byte fixed width binary, instead of a 66 char python string per row.
+	Anything that isn't a "0x" prefixed 64 digit hex string (a null, another length) keeps
+	the whole column dictionary encoded instead.
+	"""
+	n_rows = len(hashes)
+	try:
+		lengths = np.fromiter(map(len, hashes), dtype=np.int64, count=n_rows)
+		if not (lengths == _HASH_LENGTH).all():
+			return dictionary_encode(hashes)
+		chars = np.frombuffer("".join(hashes).encode("ascii"), dtype=np.uint8).reshape(n_rows, _HASH_LENGTH)
+	except (TypeError, UnicodeEncodeError):
+		return dictionary_encode(hashes)
+
+	nibbles = _HEX_VALUES[chars[:, 2:]]
+	if not ((chars[:, 0] == ord("0")) & (chars[:, 1] == ord("x"))).all() or (nibbles == 255).any():
+		return dictionary_encode(hashes)
+	packed = np.ascontiguousarray((nibbles[:, 0::2] << 4) | nibbles[:, 1::2])
+	return pa.FixedSizeBinaryArray.from_buffers(pa.binary(32), n_rows, [None, pa.py_buffer(packed)])
+
+
+def decode_hashes(hashes: pa.ChunkedArray) -> np.ndarray:
+	# lowercase "0x..." strings of `encode_hashes` output
+	if not pa.types.is_fixed_size_binary(hashes.type):
+		return hashes.to_pandas().astype(object).to_numpy()
+
+	decoded = []
+	for chunk in hashes.chunks:
+		packed = np.frombuffer(chunk.buffers()[1], dtype=np.uint8)[chunk.offset * 32:(chunk.offset + len(chunk)) * 32].reshape(len(chunk), 32)
+		chars = np.empty((len(chunk), _HASH_LENGTH), dtype=np.uint8)
+		chars[:, 0], chars[:, 1] = ord("0"), ord("x")
+		chars[:, 2::2] = _HEX_DIGITS[packed >> 4]
+		chars[:, 3::2] = _HEX_DIGITS[packed & 15]
+		decoded.append(chars.view(f"S{_HASH_LENGTH}").ravel().astype(str).astype(object))
+	return np.concatenate(decoded) if decoded else np.array([], dtype=object)
+
+
+class CompactSwaps():
+	"""
+	The clean swaps in an Arrow table, for cohorts too big for object string columns: addresses,
+	symbols, pool names and dexes are dictionary encoded, tx hashes are 32 byte binaries and the
+	rest are plain numeric columns. Built straight from the raw df of a dex, without a clean df
+	in between, with missing usd values filled from `prices` when given.
+
+	`to_pandas` converts only the requested columns, to the frame of `build_clean_df`, except
+	that the address columns are categoricals too.
+	"""
+
+	def __init__(self, table: pa.Table) -> None:
+		self.table = table
+
+	@classmethod
+	@instruments.traced("compact_swaps")
+	def from_raw_df(cls, raw_df: pd.DataFrame, prices: Optional[PriceTable] = None) -> "CompactSwaps":
+		amount_in = scale_raw_amounts(raw_df['swaps_amountIn'], raw_df['swaps_tokenIn_decimals'])
+		amount_out = scale_raw_amounts(raw_df['swaps_amountOut'], raw_df['swaps_tokenOut_decimals'])
+		amount_in_usd, amount_out_usd, asset_in, asset_out = price_columns(raw_df, amount_in, amount_out, prices)
+
+		columns = {
+			'swapper': dictionary_encode(raw_df['swaps_to'].to_numpy()),
+			# nanoseconds like pandas, so converting back doesn't go through python datetimes
+			'swap_datetime': pa.array(raw_df['swaps_timestamp'].to_numpy(dtype=np.int64) * 10**9, type=pa.timestamp('ns')),
+			'dex': dictionary_encode(raw_df['project'].to_numpy()),
+
+			'token_address_in': dictionary_encode(raw_df['swaps_tokenIn_id'].to_numpy()),
+			'token_symbol_in': dictionary_encode(raw_df['swaps_tokenIn_symbol'].to_numpy()),
+			'token_asset_in': dictionary_encode(asset_in),
+			'amount_in': pa.array(amount_in),
+			'amount_in_usd': pa.array(amount_in_usd),
+			'token_in_approx_price_usd': pa.array(masked_divide(amount_in_usd, amount_in)),
+
+			'token_address_out': dictionary_encode(raw_df['swaps_tokenOut_id'].to_numpy()),
+			'token_symbol_out': dictionary_encode(raw_df['swaps_tokenOut_symbol'].to_numpy()),
+			'token_asset_out': dictionary_encode(asset_out),
+			'amount_out': pa.array(amount_out),
+			'amount_out_usd': pa.array(amount_out_usd),
+			'token_out_approx_price_usd': pa.array(masked_divide(amount_out_usd, amount_out)),
+
+			'conversion_rate_in_to_out': pa.array(masked_divide(amount_in, amount_out)),
+
+			'pool_address': dictionary_encode(raw_df['swaps_pool_id'].to_numpy()),
+			'pool_name': dictionary_encode(raw_df['swaps_pool_name'].to_numpy()),
+
+			'tx_hash': encode_hashes(raw_df['swaps_hash'].to_numpy()),
+			'log_index': pa.array(pd.to_numeric(raw_df['swaps_logIndex']).to_numpy(dtype=np.int64)),
+		}
+		return cls(pa.table(columns))
+
+	@classmethod
+	def empty(cls) -> "CompactSwaps":
+		return cls.from_raw_df(pd.DataFrame(columns=RAW_COLUMNS + ['project']))
+
+	@classmethod
+	def concat(cls, list_of_swaps: List["CompactSwaps"]) -> "CompactSwaps":
+		# chunks keep their own dictionaries, they are only unified when converted to pandas
+		if not list_of_swaps:
+			return cls.empty()
+		tables = [swaps.table for swaps in list_of_swaps]
+		if len({table.schema.field('tx_hash').type for table in tables}) > 1:
+			# some chunk had hashes that don't fit 32 bytes
+			tables = [table.set_column(table.schema.get_field_index('tx_hash'), 'tx_hash', dictionary_encode(decode_hashes(table.column('tx_hash')))) for table in tables]
+		return cls(pa.concat_tables(tables))
+
+	def __len__(self) -> int:
+		return self.table.num_rows
+
+	@property
+	def nbytes(self) -> int:
+		return self.table.nbytes
+
+	def to_pandas(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+		columns = CLEAN_COLUMNS if columns is None else columns
+		data = {}
+		for col in columns:
+			if col == 'tx_hash':
+				data[col] = decode_hashes(self.table.column(col))
+			else:
+				# dictionaries become categoricals, timestamps datetime64[ns]
+				data[col] = self.table.column(col).to_pandas()
+		# without `columns=`, which would box every value into an object array first
+		return pd.DataFrame(data) if data else pd.DataFrame(columns=columns)
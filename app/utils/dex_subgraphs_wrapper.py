@@ -1,12 +1,27 @@
-from typing import Tuple, Dict
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
 from subgrounds.subgrounds import Subgrounds
-from subgrounds.subgraph.subgraph import Subgraph
+import numpy as np
 import pandas as pd
-from concurrent.futures import ThreadPoolExecutor
-import concurrent.futures
+from .async_fetch import AsyncSubgraphClient, AsyncSwapsPaginator, iter_in_background_loop, metrics_to_df
+from .compact_swaps import CompactSwaps
+from .fetch_scheduler import FetchScheduler, ProjectStatus, report_to_df
+from .instrumentation import instruments
+from .query_planner import QueryPlanner, fetch_planned_swaps_df
+from .swaps_cache import SwapsCache
+from .swaps_filters import SwapsFilter, filter_raw_df
+from .swaps_normalization import CATEGORICAL_COLUMNS, CLEAN_COLUMNS, concat_clean_dfs, masked_divide, scale_raw_amounts
+from .swaps_pagination import MAX_PAGE_SIZE, RAW_COLUMNS, SwapsPaginator, make_session
+from .subgraph_schemas import LazySubgraphs, SchemaCache
+from .token_prices import PriceTable, TokenIndex, price_columns
 
 pd.options.mode.chained_assignment = None
 
+logger = logging.getLogger(__name__)
+
 class DexSubgraphsWrapper():
 	projects = [
 		"apeswap-bsc", "apeswap-polygon",
@@ -33,167 +48,434 @@ class DexSubgraphsWrapper():
 		"uniswap-v3-polygon", "uniswap-v3-optimism", 
 	]
 
-	def __init__(self, threaded=True) -> None:
-		self._load_subgraphs(threaded)
-		self.row_limit_per_dex = 10_000
+	def __init__(self, threaded=True, row_limit_per_dex=None, page_size=MAX_PAGE_SIZE, max_shards_per_dex=4, cache_dir=None,
+			max_concurrency=32, max_concurrency_per_host=16, base_url="https://api.thegraph.com/subgraphs/name/messari",
+			lazy=True, schema_cache_dir=None, schema_ttl=24 * 60 * 60, wallet_chunk_size=100, max_chunks_per_document=2,
+			scheduler=None, project_timeout=180) -> None:
+		self.base_url = base_url
+		# limits of the asyncio connection pool shared by all subgraph queries
+		self.max_concurrency = max_concurrency
+		self.max_concurrency_per_host = max_concurrency_per_host
+		# deadlines, retries, hedging and circuit breakers of the subgraph requests
+		self.scheduler = scheduler if scheduler is not None else FetchScheduler()
+		# a dex still fetching after `project_timeout` seconds is given up on
+		self.project_timeout = project_timeout
+		# one row per dex of the last fetch: ok, failed, timeout or circuit_open, and why
+		self.fetch_report = report_to_df([])
+
+		self.sg = Subgrounds()
+		schema_cache = SchemaCache(schema_cache_dir, schema_ttl) if schema_cache_dir is not None else None
+		# project -> subgrounds Subgraph, for callers that need a schema; each one is loaded on first
+		# access, or all up front with lazy=False. Fetching swaps only needs the url, not the schema
+		self.subgraphs = LazySubgraphs(self.sg, self.projects, self._subgraph_url, schema_cache)
+		if not lazy:
+			self._load_subgraphs(threaded)
+
+		# None walks the whole history of every dex
+		self.row_limit_per_dex = row_limit_per_dex
+		self.page_size = page_size
+		self.max_shards_per_dex = max_shards_per_dex
+		self.session = make_session()
+		# with a cache_dir, wallets seen before only fetch swaps newer than their last sync
+		self.cache = SwapsCache(cache_dir) if cache_dir is not None else None
+		# tokens and hourly prices of every swap fetched, to fill missing usd values and group tokens by asset
+		self.token_index = TokenIndex(os.path.join(cache_dir, "tokens") if cache_dir is not None else None)
 		self.threaded = threaded
-		
 
-	def _load_subgraphs(self, threaded=True) -> Tuple[Subgrounds, Dict[str, Subgraph]]:
-		
-		sg = Subgrounds()
+		# how the wallets are split into `to_in` chunks and packed into aliased documents, per dex
+		self.query_planner = QueryPlanner(wallet_chunk_size=wallet_chunk_size, max_chunks_per_document=max_chunks_per_document, page_size=self.page_size)
+		# rows, bytes and latency of every request of the last concurrent fetch
+		self.query_metrics = metrics_to_df([])
+
+	def _subgraph_url(self, project: str) -> str:
+		return f"{self.base_url}/{project}"
+
+	def _make_async_client(self) -> AsyncSubgraphClient:
+		return AsyncSubgraphClient(max_concurrency=self.max_concurrency, max_concurrency_per_host=self.max_concurrency_per_host, scheduler=self.scheduler)
+
+	async def _aload_subgraphs(self) -> None:
+		async with self._make_async_client() as client:
+			results = await asyncio.gather(*(self.subgraphs.aget(project, client) for project in self.projects), return_exceptions=True)
 
-		subgraphs = {}
+		for project, result in zip(self.projects, results):
+			if isinstance(result, Exception):
+				logger.warning("Error loading %s subgraph: %s", project, result, extra={"fields": {"project": project, "error": repr(result)}})
+
+	@instruments.traced("load_subgraphs")
+	def _load_subgraphs(self, threaded=True) -> None:
+		# loads every schema up front instead of on first use
 
 		if not threaded:
 			for project in self.projects:
 				try: 
-					subgraphs[project] = sg.load_subgraph(f"https://api.thegraph.com/subgraphs/name/messari/{project}")
+					self.subgraphs[project]
 				except Exception as e:
-					print(f"Error loading subgraph for {project}: {e}")
+					logger.warning("Error loading subgraph for %s: %s", project, e, extra={"fields": {"project": project, "error": repr(e)}})
 					continue
 		
-		else:		
-			with ThreadPoolExecutor() as executor:
-				futures = {
-					executor.submit(sg.load_subgraph, f"https://api.thegraph.com/subgraphs/name/messari/{project}"): 
-					project for project in self.projects
-				}
-				for future in concurrent.futures.as_completed(futures):
-					project = futures[future]
-					try:
-						subgraphs[project] = future.result()
-					except Exception as e:
-						print(f"Error loading {project} subgraph: {e}")
-						continue
-
-		self.sg = sg
-		self.subgraphs = subgraphs
-
-	def _get_swaps_df_from_specific_dex(self, dex_subgraph: Subgraph, where: str) -> pd.DataFrame:
-
-		swaps = dex_subgraph.Query.swaps(first=self.row_limit_per_dex, orderBy=dex_subgraph.Swap.timestamp, orderDirection="desc", where=where)
-
-		data = [
-			swaps.timestamp,
-			swaps.to,
-			swaps.__getattribute__("from"),
-			swaps.tokenIn.id,
-			swaps.tokenIn.symbol,
-			swaps.tokenIn.decimals,
-			swaps.amountIn,
-			swaps.amountInUSD,
-			swaps.tokenOut.id,
-			swaps.tokenOut.symbol,
-			swaps.tokenOut.decimals,
-			swaps.amountOut,
-			swaps.amountOutUSD,
-			swaps.pool.id,
-			swaps.pool.name,
-			swaps.pool.symbol,
-			swaps.hash,
-			swaps.logIndex
-		]
-
-		df = self.sg.query_df(data)
+		else:
+			asyncio.run(self._aload_subgraphs())
+
+	def _get_swaps_df_from_specific_dex(self, project: str, where: dict) -> pd.DataFrame:
+
+		paginator = SwapsPaginator(self._subgraph_url(project), where, page_size=self.page_size, max_shards=self.max_shards_per_dex, session=self.session)
+
+		df = paginator.fetch_df(max_rows=self.row_limit_per_dex)
 
 		# df['swaps_datetime'] = pd.to_datetime(df['swaps_timestamp'], unit='s')
 
 		return df
 
 
-	def _get_swaps_df_from_all_dexes_singlethreaded(self, where: str) -> pd.DataFrame:
-		list_of_dfs = []
-		
-		for project, subgraph in self.subgraphs.items():
-			print(project)
+	def _cache_syncs(self, project: str, where: dict) -> Tuple[List[dict], List[str]]:
+		"""
+		`where` of the queries that bring the cached histories of the wallets up to date, and
+		the wallets to fetch without the cache. The cache only keeps whole histories, so with
+		filters pushed down, wallets it never synced are fetched filtered and not stored.
+		"""
+		filtered = len(where) > 1
+		syncs, uncached = [], []
+		for high_water_mark, group in self.cache.group_by_high_water_mark(project, where["to_in"]).items():
+			if high_water_mark is None:
+				if filtered:
+					uncached += group
+				else:
+					syncs.append({"to_in": group})
+			# a time range that ends before the last sync needs nothing newer
+			elif where.get("timestamp_lt", float("inf")) > high_water_mark:
+				syncs.append({"to_in": group, "timestamp_gte": high_water_mark})
+		return syncs, uncached
+
+	def _load_cached_swaps_df(self, project: str, where: dict, uncached: List[str]) -> pd.DataFrame:
+		# cached swaps of the synced wallets, with the filters of `where` applied locally
+		wallets = [wallet for wallet in where["to_in"] if wallet not in set(uncached)]
+		return filter_raw_df(self.cache.load(project, wallets), where)
+
+	def _is_complete(self, df: pd.DataFrame) -> bool:
+		# a fetch that reached the row limit may have stopped before the oldest swaps
+		return self.row_limit_per_dex is None or len(df) < self.row_limit_per_dex
+
+	@staticmethod
+	def _concat_raw_dfs(list_of_dfs) -> pd.DataFrame:
+		list_of_dfs = [df for df in list_of_dfs if len(df) > 0]
+		if not list_of_dfs:
+			return pd.DataFrame(columns=RAW_COLUMNS)
+		return pd.concat(list_of_dfs, ignore_index=True)
+
+	def _get_cached_swaps_df_from_specific_dex(self, project: str, where: dict) -> pd.DataFrame:
+
+		if self.cache is None:
+			return self._get_swaps_df_from_specific_dex(project, where)
+
+		syncs, uncached = self._cache_syncs(project, where)
+		for sync_where in syncs:
+			fetched_at = int(time.time())
+			df = self._get_swaps_df_from_specific_dex(project, sync_where)
+			self.cache.append(project, sync_where["to_in"], df, fetched_at, complete=self._is_complete(df))
+
+		list_of_dfs = [self._load_cached_swaps_df(project, where, uncached)]
+		if uncached:
+			list_of_dfs.append(self._get_swaps_df_from_specific_dex(project, {**where, "to_in": uncached}))
+		return self._concat_raw_dfs(list_of_dfs)
+
+
+	async def _aget_swaps_df_from_specific_dex(self, client: AsyncSubgraphClient, project: str, where: dict) -> pd.DataFrame:
 
+		url = self._subgraph_url(project)
+		wallets = where["to_in"]
+		plan = self.query_planner.plan(project, wallets)
+
+		# a capped fetch walks newest-first, so it can't be split by wallet
+		if len(plan.chunks) == 1 or self.row_limit_per_dex is not None:
+			paginator = AsyncSwapsPaginator(client, url, where, page_size=self.page_size, max_shards=self.max_shards_per_dex)
+			df = await paginator.fetch_df(max_rows=self.row_limit_per_dex)
+		else:
+			df = await fetch_planned_swaps_df(client, url, where, plan, page_size=self.page_size)
+
+		# only full, unfiltered histories say how many swaps a wallet has on this dex
+		if self.row_limit_per_dex is None and list(where) == ["to_in"]:
+			self.query_planner.observe(project, len(wallets), len(df))
+
+		return df
+
+
+	async def _aget_cached_swaps_df_from_specific_dex(self, client: AsyncSubgraphClient, project: str, where: dict) -> pd.DataFrame:
+
+		if self.cache is None:
+			return await self._aget_swaps_df_from_specific_dex(client, project, where)
+
+		syncs, uncached = await asyncio.to_thread(self._cache_syncs, project, where)
+		for sync_where in syncs:
+			fetched_at = int(time.time())
+			df = await self._aget_swaps_df_from_specific_dex(client, project, sync_where)
+			await asyncio.to_thread(self.cache.append, project, sync_where["to_in"], df, fetched_at, self._is_complete(df))
+
+		list_of_dfs = [await asyncio.to_thread(self._load_cached_swaps_df, project, where, uncached)]
+		if uncached:
+			list_of_dfs.append(await self._aget_swaps_df_from_specific_dex(client, project, {**where, "to_in": uncached}))
+		return self._concat_raw_dfs(list_of_dfs)
+
+
+	async def _aget_swaps_df_from_project(self, client: AsyncSubgraphClient, project: str, where: dict) -> pd.DataFrame:
+
+		return await self._aget_cached_swaps_df_from_specific_dex(client, project, where)
+
+
+	def _iter_swaps_dfs_singlethreaded(self, where: dict, projects: List[str], reports: Optional[list] = None) -> Iterator[pd.DataFrame]:
+		statuses = []
+
+		def fetch(project):
+			breaker = self.scheduler.breaker(project)
+			if not breaker.allow():
+				return ProjectStatus(project, "circuit_open", error=f"skipped after {breaker.n_failures} failed fetches in a row"), None
+
+			start = time.perf_counter()
 			try:
-				df = self.get_swaps_df_from_specific_dex(subgraph, where)
+				df = self._get_cached_swaps_df_from_specific_dex(project, where)
 
 			except Exception as e:
-				print(f"Error processing {project}: {e}")
-				continue
+				breaker.record_failure()
+				return ProjectStatus(project, "failed", elapsed_s=time.perf_counter() - start, error=repr(e)), None
 
-			if len(df) > 0:
-				df['project'] = project
-				list_of_dfs.append(df)
+			breaker.record_success()
+			return ProjectStatus(project, "ok", n_rows=len(df), elapsed_s=time.perf_counter() - start), df
 
-		return pd.concat(list_of_dfs, ignore_index=True)
+		# the token index is updated once with every swap of the fetch, when it's over
+		list_of_dfs = []
+		try:
+			for project in projects:
+				logger.debug("Fetching %s", project, extra={"fields": {"project": project}})
+
+				with instruments.span("fetch_project", project=project) as span:
+					status, df = fetch(project)
+					self._record_status(span, status)
+				statuses.append(status)
+				if df is not None and len(df) > 0:
+					df['project'] = project
+					list_of_dfs.append(df)
+					yield df
+		finally:
+			self.token_index.update_in_background(list_of_dfs)
+			self.fetch_report = report_to_df(statuses)
+			if reports is not None:
+				reports.append(self.fetch_report)
 
 
-	def _get_swaps_df_from_all_dexes_multithreaded(self, where: str) -> pd.DataFrame:
+	def _get_swaps_df_from_all_dexes_singlethreaded(self, where: str, projects: List[str]) -> pd.DataFrame:
+		list_of_dfs = list(self._iter_swaps_dfs_singlethreaded(where, projects))
+
+		if len(list_of_dfs)>0:
+			return pd.concat(list_of_dfs, ignore_index=True)
+		else:
+			return pd.DataFrame(columns=RAW_COLUMNS+['project'])
+
+
+	async def _aiter_project_dfs(self, client: AsyncSubgraphClient, where: dict, projects: List[str], statuses: List[ProjectStatus]) -> AsyncIterator[pd.DataFrame]:
+		# raw df of each project with swaps, in the order the projects finish, with the status of every project appended to `statuses`
+
+		async def fetch_status(project):
+			breaker = self.scheduler.breaker(project)
+			if not breaker.allow():
+				return ProjectStatus(project, "circuit_open", error=f"skipped after {breaker.n_failures} failed fetches in a row"), None
+
+			start = time.perf_counter()
+			try:
+				df = await asyncio.wait_for(self._aget_swaps_df_from_project(client, project, where), timeout=self.project_timeout)
+			except Exception as e:
+				breaker.record_failure()
+				status = "timeout" if isinstance(e, asyncio.TimeoutError) else "failed"
+				return ProjectStatus(project, status, elapsed_s=time.perf_counter() - start, error=repr(e)), None
+
+			breaker.record_success()
+			return ProjectStatus(project, "ok", n_rows=len(df), elapsed_s=time.perf_counter() - start), df
+
+		async def fetch(project):
+			with instruments.span("fetch_project", project=project) as span:
+				status, df = await fetch_status(project)
+				self._record_status(span, status)
+			return status, df
+
+		tasks = [asyncio.create_task(fetch(project)) for project in projects]
+		# the token index is updated once with every swap of the fetch, when it's over
 		list_of_dfs = []
-		with ThreadPoolExecutor(max_workers=4) as executor:
-			futures = {executor.submit(self._get_swaps_df_from_specific_dex, subgraph, where): project for project, subgraph in self.subgraphs.items()}
-			for future in concurrent.futures.as_completed(futures):
-				project = futures[future]
-				try:
-					df = future.result()
-				except Exception as e:
-					# print(f"Error processing {project}: {e}")
-					print(f"Error processing {project}")
+		try:
+			for next_done in asyncio.as_completed(tasks):
+				status, df = await next_done
+				statuses.append(status)
+				if df is None:
 					continue
 
 				if len(df) > 0:
-					df['project'] = project
+					df['project'] = status.project
 					list_of_dfs.append(df)
+					yield df
+		finally:
+			for task in tasks:
+				task.cancel()
+			await asyncio.gather(*tasks, return_exceptions=True)
+			self.token_index.update_in_background(list_of_dfs)
+
+
+	async def _aiter_swaps_dfs(self, where: dict, projects: List[str], reports: Optional[list] = None) -> AsyncIterator[pd.DataFrame]:
+		# with `reports`, the fetch report is also appended to it, as another fetch may replace `fetch_report` right after
+		statuses = []
+		async with self._make_async_client() as client:
+			try:
+				async for df in self._aiter_project_dfs(client, where, projects, statuses):
+					yield df
+			finally:
+				self.query_metrics = metrics_to_df(client.metrics)
+				self.fetch_report = self._fetch_report(statuses, self.query_metrics)
+				if reports is not None:
+					reports.append(self.fetch_report)
+
+
+	@staticmethod
+	def _record_status(span, status: ProjectStatus) -> None:
+		span.set(status=status.status, rows=status.n_rows)
+		if status.error is not None:
+			span.set(error=status.error)
+			logger.warning("Error processing %s: %s", status.project, status.error, extra={"fields": {"project": status.project, "status": status.status, "error": status.error}})
+
+
+	def _fetch_report(self, statuses, query_metrics: pd.DataFrame) -> pd.DataFrame:
+		# statuses in the order of `projects`, with the request counts of each project
+		statuses = sorted(statuses, key=lambda status: self.projects.index(status.project))
+		requests = query_metrics.groupby('project').agg(n_requests=('url', 'size'), n_attempts=('n_attempts', 'sum'), n_hedges=('hedged', 'sum'))
+		for status in statuses:
+			if status.project in requests.index:
+				status.n_requests = int(requests.at[status.project, 'n_requests'])
+				status.n_retries = int(requests.at[status.project, 'n_attempts']) - status.n_requests
+				status.n_hedges = int(requests.at[status.project, 'n_hedges'])
+		return report_to_df(statuses)
+
+
+	async def _aget_swaps_df_from_all_dexes(self, where: dict, projects: List[str]) -> pd.DataFrame:
+		list_of_dfs = [df async for df in self._aiter_swaps_dfs(where, projects)]
+		# same row order as fetching the projects one after the other
+		list_of_dfs.sort(key=lambda df: self.projects.index(df['project'].iat[0]))
 
 		if len(list_of_dfs)>0:
 			return pd.concat(list_of_dfs, ignore_index=True)
 		else:
-			return pd.DataFrame(columns=[
-				'swaps_timestamp', 'swaps_to', 'swaps_from', 'swaps_tokenIn_id',
-				'swaps_tokenIn_symbol', 'swaps_tokenIn_decimals', 'swaps_amountIn',
-				'swaps_amountInUSD', 'swaps_tokenOut_id', 'swaps_tokenOut_symbol',
-				'swaps_tokenOut_decimals', 'swaps_amountOut', 'swaps_amountOutUSD',
-				'swaps_pool_id', 'swaps_pool_name', 'swaps_pool_symbol', 'swaps_hash',
-				'swaps_logIndex', 'project'
-			])
+			return pd.DataFrame(columns=RAW_COLUMNS+['project'])
 
 
 	@staticmethod
-	def build_clean_df(raw_df: pd.DataFrame) -> pd.DataFrame:
-		clean_df = raw_df[['swaps_to']]
-		clean_df = clean_df.rename(columns={'swaps_to': 'swapper'})
-
-		clean_df['swap_datetime'] = pd.to_datetime(raw_df['swaps_timestamp'], unit='s')
+	@instruments.traced("build_clean_df")
+	def build_clean_df(raw_df: pd.DataFrame, prices: Optional[PriceTable] = None) -> pd.DataFrame:
+		# with `prices` (the `table` of a `TokenIndex`), missing usd values are filled and tokens get the asset of the index
+		amount_in = scale_raw_amounts(raw_df['swaps_amountIn'], raw_df['swaps_tokenIn_decimals'])
+		amount_out = scale_raw_amounts(raw_df['swaps_amountOut'], raw_df['swaps_tokenOut_decimals'])
+		amount_in_usd, amount_out_usd, asset_in, asset_out = price_columns(raw_df, amount_in, amount_out, prices)
+
+		clean_df = pd.DataFrame({
+			'swapper': raw_df['swaps_to'].to_numpy(),
+			'swap_datetime': pd.to_datetime(raw_df['swaps_timestamp'].to_numpy(dtype=np.int64), unit='s'),
+			'dex': raw_df['project'].to_numpy(),
+
+			'token_address_in': raw_df['swaps_tokenIn_id'].to_numpy(),
+			'token_symbol_in': raw_df['swaps_tokenIn_symbol'].to_numpy(),
+			'token_asset_in': asset_in,
+			'amount_in': amount_in,
+			'amount_in_usd': amount_in_usd,
+			'token_in_approx_price_usd': masked_divide(amount_in_usd, amount_in),
+
+			'token_address_out': raw_df['swaps_tokenOut_id'].to_numpy(),
+			'token_symbol_out': raw_df['swaps_tokenOut_symbol'].to_numpy(),
+			'token_asset_out': asset_out,
+			'amount_out': amount_out,
+			'amount_out_usd': amount_out_usd,
+			'token_out_approx_price_usd': masked_divide(amount_out_usd, amount_out),
+
+			'conversion_rate_in_to_out': masked_divide(amount_in, amount_out),
+
+			'pool_address': raw_df['swaps_pool_id'].to_numpy(),
+			'pool_name': raw_df['swaps_pool_name'].to_numpy(),
+
+			'tx_hash': raw_df['swaps_hash'].to_numpy(),
+			'log_index': raw_df['swaps_logIndex'].to_numpy(),
+		}, index=raw_df.index)
+
+		for col in CATEGORICAL_COLUMNS:
+			clean_df[col] = clean_df[col].astype('category')
 
-		clean_df['dex'] = raw_df['project']
+		return clean_df
 
-		clean_df['token_address_in'] = raw_df['swaps_tokenIn_id']
-		clean_df['token_symbol_in'] = raw_df['swaps_tokenIn_symbol']
-		clean_df['amount_in'] = raw_df['swaps_amountIn']/10**raw_df['swaps_tokenIn_decimals']
-		clean_df['amount_in_usd'] = raw_df['swaps_amountInUSD']
-		clean_df['token_in_approx_price_usd'] = clean_df.apply(lambda x: x['amount_in_usd']/x['amount_in'] if x['amount_in']!=0 else 0, axis=1)
-		
+	def _where_and_projects(self, wallet_addresses, swaps_filter: Optional[SwapsFilter]) -> Tuple[dict, List[str]]:
+		# filter by who is swapping, plus what the filter pushes down, and the subgraphs worth querying
+		where = {"to_in": [wallet_address.lower() for wallet_address in wallet_addresses]}
+		if swaps_filter is None:
+			return where, list(self.projects)
+		return {**where, **swaps_filter.where()}, swaps_filter.select_projects(self.projects)
 
-		clean_df['token_address_out'] = raw_df['swaps_tokenOut_id']
-		clean_df['token_symbol_out'] = raw_df['swaps_tokenOut_symbol']
-		clean_df['amount_out'] = raw_df['swaps_amountOut']/10**raw_df['swaps_tokenOut_decimals']
-		clean_df['amount_out_usd'] = raw_df['swaps_amountOutUSD']
-		clean_df['token_out_approx_price_usd'] = clean_df.apply(lambda x: x['amount_out_usd']/x['amount_out'] if x['amount_out']!=0 else 0, axis=1)
+	async def aget_swaps_df(self, wallet_addresses, swaps_filter: Optional[SwapsFilter] = None) -> pd.DataFrame:
 
-		clean_df['conversion_rate_in_to_out'] = clean_df.apply(lambda x: x['amount_in']/x['amount_out'] if x['amount_out']!=0 else 0, axis=1)
+		where, projects = self._where_and_projects(wallet_addresses, swaps_filter)
 
-		clean_df['pool_address'] = raw_df['swaps_pool_id']
-		clean_df['pool_name'] = raw_df['swaps_pool_name']
+		raw_df = await self._aget_swaps_df_from_all_dexes(where, projects)
 
-		clean_df['tx_hash'] = raw_df['swaps_hash']
-		clean_df['log_index'] = raw_df['swaps_logIndex']
+		clean_df = self.build_clean_df(raw_df, self.token_index.table)
 
 		return clean_df
 
-	def get_swaps_df(self, wallet_addresses) -> pd.DataFrame:
-
-		# filter by who is swapping
-		where = {"to_in": [wallet_address.lower() for wallet_address in wallet_addresses]}
+	def get_swaps_df(self, wallet_addresses, swaps_filter: Optional[SwapsFilter] = None) -> pd.DataFrame:
 
+		# the concurrent path runs on its own event loop, so this can't be called from inside a running one
 		if self.threaded:
-			raw_df = self._get_swaps_df_from_all_dexes_multithreaded(where)
-		else:
-			raw_df = self._get_swaps_df_from_all_dexes_singlethreaded(where)
+			return asyncio.run(self.aget_swaps_df(wallet_addresses, swaps_filter))
+
+		where, projects = self._where_and_projects(wallet_addresses, swaps_filter)
+
+		raw_df = self._get_swaps_df_from_all_dexes_singlethreaded(where, projects)
 		
-		clean_df = self.build_clean_df(raw_df)
+		clean_df = self.build_clean_df(raw_df, self.token_index.table)
 		
-		return clean_df
\ No newline at end of file
+		return clean_df
+
+	async def aiter_swaps(self, wallet_addresses, compact=False, swaps_filter: Optional[SwapsFilter] = None, reports: Optional[list] = None) -> AsyncIterator[pd.DataFrame]:
+
+		where, projects = self._where_and_projects(wallet_addresses, swaps_filter)
+
+		# one clean df (or `CompactSwaps`) per dex with swaps, as soon as that dex answers
+		build = CompactSwaps.from_raw_df if compact else self.build_clean_df
+		async for raw_df in self._aiter_swaps_dfs(where, projects, reports):
+			yield await asyncio.to_thread(build, raw_df, self.token_index.table)
+
+	def iter_swaps(self, wallet_addresses, compact=False, swaps_filter: Optional[SwapsFilter] = None, reports: Optional[list] = None) -> Iterator[pd.DataFrame]:
+
+		if self.threaded:
+			yield from iter_in_background_loop(lambda: self.aiter_swaps(wallet_addresses, compact, swaps_filter, reports))
+			return
+
+		where, projects = self._where_and_projects(wallet_addresses, swaps_filter)
+
+		build = CompactSwaps.from_raw_df if compact else self.build_clean_df
+		for raw_df in self._iter_swaps_dfs_singlethreaded(where, projects, reports):
+			yield build(raw_df, self.token_index.table)
+
+	def get_compact_swaps(self, wallet_addresses, swaps_filter: Optional[SwapsFilter] = None) -> CompactSwaps:
+		# the swaps of `get_swaps_df` as `CompactSwaps`, each raw df is dropped once its dex is encoded
+		return CompactSwaps.concat(list(self.iter_swaps(wallet_addresses, compact=True, swaps_filter=swaps_filter)))
+
+	async def aget_raw_swaps_df(self, client: AsyncSubgraphClient, wallet_addresses, swaps_filter: Optional[SwapsFilter] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+		"""
+		Raw swaps of every dex and the fetch report, on a client shared with other fetches running
+		at the same time (the batch jobs). `fetch_report` and `query_metrics` are left alone, and the
+		report has no request counts, as the metrics of the client mix every fetch.
+		"""
+		where, projects = self._where_and_projects(wallet_addresses, swaps_filter)
+
+		statuses = []
+		list_of_dfs = [df async for df in self._aiter_project_dfs(client, where, projects, statuses)]
+		list_of_dfs.sort(key=lambda df: self.projects.index(df['project'].iat[0]))
+
+		raw_df = pd.concat(list_of_dfs, ignore_index=True) if list_of_dfs else pd.DataFrame(columns=RAW_COLUMNS+['project'])
+		return raw_df, self._fetch_report(statuses, metrics_to_df([]))
+
+	@staticmethod
+	def concat_swaps_dfs(list_of_dfs) -> pd.DataFrame:
+		# joins the chunks of `iter_swaps` / `aiter_swaps`, keeping the categorical columns
+		if not list_of_dfs:
+			return DexSubgraphsWrapper.build_clean_df(pd.DataFrame(columns=RAW_COLUMNS+['project']))
+		return concat_clean_dfs(list_of_dfs)
@@ -0,0 +1,224 @@
+import asyncio
+import contextlib
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+import pandas as pd
+
+
+class SubgraphQueryError(Exception):
+	# the subgraph answered, with GraphQL errors instead of data
+	pass
+
+
+# GraphQL errors of the hosted service that go away by asking again, the others (a bad field,
+# a bad filter, a schema one dex doesn't have) fail the same way every time
+TRANSIENT_QUERY_ERRORS = ("indexing", "indexers", "timeout", "timed out", "too many requests", "rate limit")
+
+
+def _query_error_messages(error: SubgraphQueryError) -> str:
+	errors = error.args[0] if error.args and isinstance(error.args[0], list) else list(error.args)
+	return " ".join(str(e.get("message", "")) if isinstance(e, dict) else str(e) for e in errors).lower()
+
+
+@dataclass(frozen=True)
+class RetryPolicy():
+	# deadline of every single request, hedges included, counted from when it's sent
+	request_timeout: Optional[float] = 30
+	max_attempts: int = 4
+	backoff_base: float = 0.5
+	backoff_max: float = 8.0
+
+	def backoff(self, attempt: int) -> float:
+		# "full jitter": uniform in [0, base * 2**attempt], so retries of many projects spread out
+		return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+@dataclass(frozen=True)
+class HedgePolicy():
+	# a duplicate request is sent when the first one is slower than this percentile of its subgraph
+	percentile: float = 0.95
+	# latencies needed before hedging, and how many of them are kept per subgraph
+	min_samples: int = 20
+	window: int = 200
+
+
+def is_retryable(error: BaseException) -> bool:
+	if isinstance(error, aiohttp.ClientResponseError):
+		# client errors won't go away by asking again, except timeouts and rate limits
+		return error.status >= 500 or error.status in (408, 429)
+	if isinstance(error, SubgraphQueryError):
+		messages = _query_error_messages(error)
+		return any(marker in messages for marker in TRANSIENT_QUERY_ERRORS)
+	return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError))
+
+
+class CircuitBreaker():
+	"""
+	Skips a project after `failure_threshold` failed fetches in a row. After `reset_timeout`
+	seconds one trial fetch goes through (half open) while the others are still skipped:
+	success closes the breaker, failure opens it again. A trial that never reports back
+	(cancelled) gives way to another one after `reset_timeout` seconds.
+
+	Fetches of the same project may run on different threads, so every read-modify-write of
+	the breaker holds its lock.
+	"""
+
+	def __init__(self, failure_threshold: int = 3, reset_timeout: float = 300) -> None:
+		self.failure_threshold = failure_threshold
+		self.reset_timeout = reset_timeout
+		self._lock = threading.Lock()
+		self.n_failures = 0
+		self.opened_at = None
+		# when the trial fetch of the half open breaker was let through, None without one in flight
+		self.trial_at = None
+
+	@property
+	def state(self) -> str:
+		if self.opened_at is None:
+			return "closed"
+		if time.monotonic() - self.opened_at >= self.reset_timeout:
+			return "half_open"
+		return "open"
+
+	def allow(self) -> bool:
+		with self._lock:
+			state = self.state
+			if state == "closed":
+				return True
+			if state == "open":
+				return False
+			now = time.monotonic()
+			if self.trial_at is not None and now - self.trial_at < self.reset_timeout:
+				return False
+			self.trial_at = now
+			return True
+
+	def record_success(self) -> None:
+		with self._lock:
+			self.n_failures = 0
+			self.opened_at = None
+			self.trial_at = None
+
+	def record_failure(self) -> None:
+		with self._lock:
+			self.trial_at = None
+			self.n_failures += 1
+			if self.n_failures >= self.failure_threshold or self.opened_at is not None:
+				self.opened_at = time.monotonic()
+
+
+@dataclass
+class ProjectStatus():
+	project: str
+	# "ok", "failed", "timeout" or "circuit_open"
+	status: str
+	n_rows: int = 0
+	n_requests: int = 0
+	n_retries: int = 0
+	n_hedges: int = 0
+	elapsed_s: float = 0.0
+	error: Optional[str] = None
+
+
+def report_to_df(statuses: List[ProjectStatus]) -> pd.DataFrame:
+	return pd.DataFrame([vars(status) for status in statuses], columns=list(ProjectStatus.__dataclass_fields__))
+
+
+class FetchScheduler():
+	"""
+	Runs the subgraph requests of `AsyncSubgraphClient` with a deadline per request, retries
+	with exponential backoff and jitter, and hedged duplicates for requests slower than the
+	usual latency of their subgraph (one url per dex, since a busy dex is slower than a quiet
+	one on the same host). Also keeps one circuit breaker per project.
+
+	Latencies and breakers live as long as the scheduler, so a wrapper keeps one across fetches.
+	"""
+
+	def __init__(self, retry: RetryPolicy = RetryPolicy(), hedge: Optional[HedgePolicy] = HedgePolicy(), failure_threshold: int = 3, reset_timeout: float = 300) -> None:
+		self.retry = retry
+		self.hedge = hedge
+		self.failure_threshold = failure_threshold
+		self.reset_timeout = reset_timeout
+		# the sync fetches and the event loops of concurrent fetches share the scheduler
+		self._lock = threading.Lock()
+		self._latencies: Dict[str, deque] = {}
+		self._breakers: Dict[str, CircuitBreaker] = {}
+
+	def breaker(self, project: str) -> CircuitBreaker:
+		with self._lock:
+			if project not in self._breakers:
+				self._breakers[project] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+			return self._breakers[project]
+
+	def _record_latency(self, url: str, latency: float) -> None:
+		window = self.hedge.window if self.hedge is not None else 1
+		with self._lock:
+			self._latencies.setdefault(url, deque(maxlen=window)).append(latency)
+
+	def hedge_delay(self, url: str) -> Optional[float]:
+		if self.hedge is None:
+			return None
+		with self._lock:
+			latencies = list(self._latencies.get(url, ()))
+		if len(latencies) < self.hedge.min_samples:
+			return None
+		ordered = sorted(latencies)
+		return ordered[min(int(self.hedge.percentile * len(ordered)), len(ordered) - 1)]
+
+	async def _timed(self, url: str, send: Callable[[], Awaitable], slot, sent: Optional[asyncio.Event] = None) -> object:
+		# waiting for a free connection doesn't count against the deadline, nor the hedge delay
+		async with slot:
+			if sent is not None:
+				sent.set()
+			start = time.perf_counter()
+			result = await asyncio.wait_for(send(), timeout=self.retry.request_timeout)
+			self._record_latency(url, time.perf_counter() - start)
+			return result
+
+	async def _hedged(self, url: str, send: Callable[[], Awaitable], slot) -> Tuple[object, bool]:
+		# first successful answer of the request and, if it's late, of one duplicate
+		sent = asyncio.Event()
+		tasks = [asyncio.create_task(self._timed(url, send, slot, sent))]
+		hedged = False
+		try:
+			delay = self.hedge_delay(url)
+			if delay is not None:
+				waiting = asyncio.create_task(sent.wait())
+				await asyncio.wait([tasks[0], waiting], return_when=asyncio.FIRST_COMPLETED)
+				waiting.cancel()
+				done, _ = await asyncio.wait(tasks, timeout=delay)
+				if not done:
+					tasks.append(asyncio.create_task(self._timed(url, send, slot)))
+					hedged = True
+
+			pending, error = set(tasks), None
+			while pending:
+				done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+				for task in done:
+					if task.exception() is None:
+						return task.result(), hedged
+					error = task.exception()
+			raise error
+		finally:
+			for task in tasks:
+				task.cancel()
+			await asyncio.gather(*tasks, return_exceptions=True)
+
+	async def run(self, url: str, send: Callable[[], Awaitable], slot=None) -> Tuple[object, int, bool]:
+		# result of `send()`, the attempts it took and whether a hedge was sent for the last one;
+		# `slot` is an async context manager held while a request is in flight
+		slot = slot if slot is not None else contextlib.nullcontext()
+		for attempt in range(self.retry.max_attempts):
+			try:
+				result, hedged = await self._hedged(url, send, slot)
+				return result, attempt + 1, hedged
+			except Exception as e:
+				if attempt + 1 >= self.retry.max_attempts or not is_retryable(e):
+					raise
+			await asyncio.sleep(self.retry.backoff(attempt))
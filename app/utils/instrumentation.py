@@ -0,0 +1,340 @@
+import contextlib
+import contextvars
+import cProfile
+import functools
+import io
+import itertools
+import json
+import logging
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the latency histograms, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+_trace_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_id", default=None)
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+@dataclass
+class Span():
+	name: str
+	labels: Dict[str, str]
+	trace_id: Optional[str] = None
+	span_id: int = 0
+	parent_id: Optional[int] = None
+	start: float = 0.0
+	seconds: float = 0.0
+	# rows, bytes, memory_bytes, status, error...
+	attributes: Dict = field(default_factory=dict)
+
+	def set(self, **attributes) -> None:
+		self.attributes.update(attributes)
+
+
+class _Histogram():
+	def __init__(self) -> None:
+		self.counts = [0] * len(LATENCY_BUCKETS)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value: float) -> None:
+		for i, bound in enumerate(LATENCY_BUCKETS):
+			if value <= bound:
+				self.counts[i] += 1
+				break
+		self.sum += value
+		self.count += 1
+
+
+def _labels_key(labels: Dict) -> Tuple:
+	return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Tuple, extra: Tuple = ()) -> str:
+	labels = labels + extra
+	if not labels:
+		return ""
+	escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+	return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def memory_bytes(result) -> Optional[int]:
+	# memory of what a stage returned: a DataFrame (shallow, strings aren't walked), or anything with `nbytes`
+	if isinstance(result, pd.DataFrame):
+		return int(result.memory_usage(index=False).sum())
+	nbytes = getattr(result, "nbytes", None)
+	return int(nbytes) if isinstance(nbytes, int) else None
+
+
+class Instruments():
+	"""
+	Spans and metrics of the fetch and render pipeline, shared by the whole process.
+
+	A span times one stage (schema load, the fetch of a project, `build_clean_df`, a chart...)
+	with its labels and attributes (rows, bytes, memory); spans opened inside another one are
+	its children, and all the spans of a dashboard run share the trace id of `start_trace`.
+	Every span also feeds the `stage_seconds` histogram, and requests feed per project counters,
+	exported as Prometheus text by `to_prometheus`. Finished spans are logged as structured
+	records on the `utils.instrumentation` logger, and the last `max_spans` are kept in memory.
+	"""
+
+	def __init__(self, max_spans: int = 10_000, prefix: str = "analyzooor") -> None:
+		self.prefix = prefix
+		self.spans = deque(maxlen=max_spans)
+		self._lock = threading.Lock()
+		# (metric, labels) -> value
+		self._counters: Dict[Tuple[str, Tuple], float] = {}
+		self._gauges: Dict[Tuple[str, Tuple], float] = {}
+		self._histograms: Dict[Tuple[str, Tuple], _Histogram] = {}
+
+	def start_trace(self) -> str:
+		# spans from here on (and from the tasks and threads started from here) belong to a new trace
+		trace_id = uuid.uuid4().hex[:16]
+		_trace_id.set(trace_id)
+		_current_span.set(None)
+		return trace_id
+
+	@contextlib.contextmanager
+	def span(self, name: str, **labels) -> Iterator[Span]:
+		parent = _current_span.get()
+		span = Span(name, {k: str(v) for k, v in labels.items()}, _trace_id.get(), next(_span_ids), parent.span_id if parent is not None else None, time.time())
+		token = _current_span.set(span)
+		start = time.perf_counter()
+		try:
+			yield span
+		except BaseException as e:
+			span.set(status="error", error=repr(e))
+			raise
+		finally:
+			span.seconds = time.perf_counter() - start
+			_current_span.reset(token)
+			self._finish(span)
+
+	def _finish(self, span: Span) -> None:
+		labels = {"stage": span.name, **span.labels}
+		with self._lock:
+			self.spans.append(span)
+			self._observe("stage_seconds", span.seconds, labels)
+			if "rows" in span.attributes:
+				self._inc("stage_rows_total", span.attributes["rows"], labels)
+			if span.attributes.get("memory_bytes") is not None:
+				self._gauges[("stage_memory_bytes", _labels_key(labels))] = span.attributes["memory_bytes"]
+			if span.attributes.get("status") == "error":
+				self._inc("stage_errors_total", 1, labels)
+		if logger.isEnabledFor(logging.DEBUG):
+			logger.debug("span %s", span.name, extra={"fields": {
+				"trace_id": span.trace_id, "span_id": span.span_id, "parent_id": span.parent_id, "stage": span.name,
+				**span.labels, "seconds": round(span.seconds, 6), **span.attributes,
+			}})
+
+	def traced(self, name: str):
+		"""
+		Decorator: a span per call, with the rows and memory of the returned DataFrame (or
+		`CompactSwaps`, or anything with `nbytes`).
+		"""
+		def decorator(f):
+			@functools.wraps(f)
+			def wrapper(*args, **kwargs):
+				with self.span(name) as span:
+					result = f(*args, **kwargs)
+					if isinstance(result, pd.DataFrame) or hasattr(result, "nbytes"):
+						span.set(rows=len(result), memory_bytes=memory_bytes(result))
+					return result
+			return wrapper
+		return decorator
+
+	def _inc(self, metric: str, value: float, labels: Dict) -> None:
+		key = (metric, _labels_key(labels))
+		self._counters[key] = self._counters.get(key, 0) + value
+
+	def _observe(self, metric: str, value: float, labels: Dict) -> None:
+		self._histograms.setdefault((metric, _labels_key(labels)), _Histogram()).observe(value)
+
+	def record_request(self, url: str, latency_s: float, n_bytes: int, n_rows: int, n_attempts: int = 1, hedged: bool = False) -> None:
+		# subgraph urls end with the project name
+		labels = {"project": url.rsplit("/", 1)[-1]}
+		with self._lock:
+			self._observe("request_seconds", latency_s, labels)
+			self._inc("requests_total", 1, labels)
+			self._inc("request_bytes_total", n_bytes, labels)
+			self._inc("request_rows_total", n_rows, labels)
+			self._inc("request_retries_total", n_attempts - 1, labels)
+			self._inc("request_hedges_total", int(hedged), labels)
+
+	def spans_df(self, trace_id: Optional[str] = None) -> pd.DataFrame:
+		# one row per finished span (of one trace), oldest first
+		with self._lock:
+			spans = [span for span in self.spans if trace_id is None or span.trace_id == trace_id]
+		return pd.DataFrame([
+			{"trace_id": span.trace_id, "span_id": span.span_id, "parent_id": span.parent_id, "stage": span.name, **span.labels,
+				"start": pd.Timestamp(span.start, unit="s"), "seconds": span.seconds, **span.attributes}
+			for span in spans
+		], columns=None if spans else ["trace_id", "span_id", "parent_id", "stage", "start", "seconds"])
+
+	def to_prometheus(self) -> str:
+		# Prometheus text exposition format
+		with self._lock:
+			counters, gauges = dict(self._counters), dict(self._gauges)
+			histograms = {key: (list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+
+		lines = []
+		for kind, metrics in (("counter", counters), ("gauge", gauges)):
+			for name in sorted({name for name, _ in metrics}):
+				lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+				lines += [f"{self.prefix}_{name}{_format_labels(labels)} {value:g}" for (metric, labels), value in sorted(metrics.items()) if metric == name]
+		for name in sorted({name for name, _ in histograms}):
+			lines.append(f"# TYPE {self.prefix}_{name} histogram")
+			for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+				if metric != name:
+					continue
+				cumulative = itertools.accumulate(counts)
+				for bound, n in zip(LATENCY_BUCKETS, cumulative):
+					lines.append(f"{self.prefix}_{name}_bucket{_format_labels(labels, (('le', '+Inf' if bound == float('inf') else f'{bound:g}'),))} {n}")
+				lines.append(f"{self.prefix}_{name}_sum{_format_labels(labels)} {total:g}")
+				lines.append(f"{self.prefix}_{name}_count{_format_labels(labels)} {count}")
+		return "\n".join(lines) + "\n"
+
+	def serve_prometheus(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+		# `/metrics` for a Prometheus scraper, from a daemon thread
+		instruments = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				body = instruments.to_prometheus().encode()
+				self.send_response(200)
+				self.send_header("Content-Type", "text/plain; version=0.0.4")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				pass
+
+		server = ThreadingHTTPServer((host, port), Handler)
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		return server
+
+
+# the instruments of the process, every module records to these
+instruments = Instruments()
+
+
+class JsonFormatter(logging.Formatter):
+	# one json object per record, with the `fields` passed as `extra`
+	def format(self, record: logging.LogRecord) -> str:
+		entry = {
+			"time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+			"level": record.levelname,
+			"logger": record.name,
+			"message": record.getMessage(),
+			**getattr(record, "fields", {}),
+		}
+		if record.exc_info:
+			entry["exception"] = self.formatException(record.exc_info)
+		return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = "WARNING", stream=None) -> None:
+	# structured logs of the `utils` package (DEBUG includes every span) on stderr
+	package_logger = logging.getLogger(__name__.rsplit(".", 1)[0])
+	if not any(isinstance(handler.formatter, JsonFormatter) for handler in package_logger.handlers):
+		handler = logging.StreamHandler(stream)
+		handler.setFormatter(JsonFormatter())
+		package_logger.addHandler(handler)
+		package_logger.propagate = False
+	package_logger.setLevel(level.upper())
+
+
+class SamplingProfiler():
+	"""
+	Samples the stacks of the thread that starts it and of the threads started after it (the
+	fetches run on background ones) every `interval` seconds. Unlike cProfile, it doesn't slow
+	the code down, at the cost of missing short calls.
+	"""
+
+	def __init__(self, interval: float = 0.005) -> None:
+		self.interval = interval
+		self.n_samples = 0
+		# "file:line function" -> samples it was running in (total) or on top of the stack (self)
+		self.total = Counter()
+		self.self = Counter()
+		self._stop = threading.Event()
+		self._thread = None
+		# threads already running that aren't the caller: other sessions, the server, idle pools
+		self._ignored = set()
+
+	def _sample(self) -> None:
+		own = threading.get_ident()
+		while not self._stop.wait(self.interval):
+			for thread_id, frame in sys._current_frames().items():
+				if thread_id == own or thread_id in self._ignored:
+					continue
+				self.self[self._location(frame)] += 1
+				seen = set()
+				while frame is not None:
+					seen.add(self._location(frame))
+					frame = frame.f_back
+				self.total.update(seen)
+			self.n_samples += 1
+
+	@staticmethod
+	def _location(frame) -> str:
+		return f"{frame.f_code.co_filename}:{frame.f_code.co_firstlineno} {frame.f_code.co_name}"
+
+	def start(self) -> None:
+		self._ignored = set(sys._current_frames()) - {threading.get_ident()}
+		self._thread = threading.Thread(target=self._sample, daemon=True)
+		self._thread.start()
+
+	def stop(self) -> None:
+		self._stop.set()
+		self._thread.join()
+
+	def report(self, top: int = 40) -> str:
+		lines = [f"{self.n_samples} samples every {self.interval * 1000:g}ms, {'total':>7} {'self':>7}"]
+		for location, n in self.total.most_common(top):
+			lines.append(f"{n:>7} {self.self[location]:>7}  {location}")
+		return "\n".join(lines)
+
+
+class RequestProfiler():
+	"""
+	Profiles a single request, with "cprofile" (deterministic, only the calling thread) or
+	"sampling" (`SamplingProfiler`, every thread). `stop` returns the report as text.
+	"""
+
+	def __init__(self, mode: Optional[str]) -> None:
+		if mode not in (None, "cprofile", "sampling"):
+			raise ValueError(f"unknown profiler {mode!r}")
+		self.mode = mode
+		self._profiler = cProfile.Profile() if mode == "cprofile" else SamplingProfiler() if mode == "sampling" else None
+
+	def start(self) -> None:
+		if self.mode == "cprofile":
+			self._profiler.enable()
+		elif self.mode == "sampling":
+			self._profiler.start()
+
+	def stop(self, top: int = 40) -> Optional[str]:
+		if self.mode == "cprofile":
+			self._profiler.disable()
+			out = io.StringIO()
+			pstats.Stats(self._profiler, stream=out).sort_stats("cumulative").print_stats(top)
+			return out.getvalue()
+		if self.mode == "sampling":
+			self._profiler.stop()
+			return self._profiler.report(top)
+		return None
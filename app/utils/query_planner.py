@@ -0,0 +1,125 @@
+import asyncio
+import math
+import threading
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional
+
+import pandas as pd
+
+from .async_fetch import AsyncSubgraphClient
+from .swaps_pagination import MAX_PAGE_SIZE, build_swaps_query, concat_pages, split_at_boundary, swaps_json_to_df
+
+
+@dataclass
+class QueryPlan():
+	project: str
+	# wallet chunks, each one filtered with its own `to_in`
+	chunks: List[List[str]]
+	# indexes into `chunks`, one list per aliased document
+	documents: List[List[int]]
+
+
+class QueryPlanner():
+	"""
+	Splits the wallets of a request into `to_in` chunks and groups the chunks into aliased
+	GraphQL documents, per subgraph.
+
+	Without history a subgraph gets `wallet_chunk_size` wallets per chunk. Once swaps were
+	fetched from it, the chunk size follows the observed swaps per wallet, so that a chunk
+	fits in about one page: busy subgraphs get small chunks, quiet ones get large chunks.
+	"""
+
+	def __init__(self, wallet_chunk_size: int = 100, max_chunks_per_document: int = 2, min_chunk_size: int = 10, max_chunk_size: int = 500, page_size: int = MAX_PAGE_SIZE, adaptive: bool = True) -> None:
+		self.wallet_chunk_size = wallet_chunk_size
+		self.max_chunks_per_document = max(max_chunks_per_document, 1)
+		self.min_chunk_size = min_chunk_size
+		self.max_chunk_size = max_chunk_size
+		self.page_size = page_size
+		self.adaptive = adaptive
+		# project -> moving average of swaps per wallet
+		self._swaps_per_wallet: Dict[str, float] = {}
+		self._lock = threading.Lock()
+
+	def chunk_size_for(self, project: str) -> int:
+		swaps_per_wallet = self._swaps_per_wallet.get(project) if self.adaptive else None
+		if swaps_per_wallet is None:
+			return self.wallet_chunk_size
+		chunk_size = int(self.page_size / max(swaps_per_wallet, 1e-3))
+		return min(max(chunk_size, self.min_chunk_size), self.max_chunk_size)
+
+	def observe(self, project: str, n_wallets: int, n_rows: int) -> None:
+		if n_wallets == 0:
+			return
+		with self._lock:
+			previous = self._swaps_per_wallet.get(project)
+			current = n_rows / n_wallets
+			self._swaps_per_wallet[project] = current if previous is None else 0.5 * previous + 0.5 * current
+
+	def plan(self, project: str, wallets: List[str]) -> QueryPlan:
+		chunk_size = self.chunk_size_for(project)
+		n_chunks = max(math.ceil(len(wallets) / chunk_size), 1)
+		# even chunks, rather than full ones plus a small remainder
+		size = math.ceil(len(wallets) / n_chunks)
+		chunks = [wallets[i:i + size] for i in range(0, len(wallets), size)] or [[]]
+		indexes = list(range(len(chunks)))
+		documents = [indexes[i:i + self.max_chunks_per_document] for i in range(0, len(indexes), self.max_chunks_per_document)]
+		return QueryPlan(project, chunks, documents)
+
+
+class BatchedSwapsWalker():
+	"""
+	Walks the keyset cursors of several `where` filters at once: every round sends one
+	document with an aliased `swaps` field per open cursor. Ties at a page boundary are
+	drained by an extra aliased field in the following rounds, next to the continued walk.
+	"""
+
+	def __init__(self, client: AsyncSubgraphClient, url: str, wheres: List[Dict], page_size: int = MAX_PAGE_SIZE) -> None:
+		self.client = client
+		self.url = url
+		self.wheres = [dict(where) for where in wheres]
+		self.page_size = min(page_size, MAX_PAGE_SIZE)
+
+	async def iter_pages(self) -> AsyncIterator[List[Dict]]:
+		# (base where, cursor where, order by) of every open cursor
+		cursors = [(where, dict(where), "timestamp") for where in self.wheres]
+
+		while cursors:
+			fields = []
+			for i, (_, where, order_by) in enumerate(cursors):
+				order_direction = "desc" if order_by == "timestamp" else "asc"
+				fields.append(build_swaps_query(where, self.page_size, order_by, order_direction, alias=f"c{i}"))
+			data = await self.client.post(self.url, "{ " + " ".join(fields) + " }")
+
+			next_cursors = []
+			for i, (base, where, order_by) in enumerate(cursors):
+				swaps = data[f"c{i}"]
+				full = len(swaps) == self.page_size
+
+				if order_by == "id":
+					if swaps:
+						yield swaps
+					if full:
+						next_cursors.append((base, {**where, "id_gt": swaps[-1]["id"]}, "id"))
+				elif not full:
+					if swaps:
+						yield swaps
+				else:
+					head, boundary = split_at_boundary(swaps)
+					if head:
+						yield head
+					next_cursors.append((base, {**base, "timestamp": boundary}, "id"))
+					next_cursors.append((base, {**where, "timestamp_lt": boundary}, "timestamp"))
+			cursors = next_cursors
+
+	async def fetch_df(self) -> pd.DataFrame:
+		return concat_pages([swaps_json_to_df(swaps) async for swaps in self.iter_pages()])
+
+
+async def fetch_planned_swaps_df(client: AsyncSubgraphClient, url: str, where: Dict, plan: QueryPlan, page_size: int = MAX_PAGE_SIZE, max_rows: Optional[int] = None) -> pd.DataFrame:
+	# documents of the plan are independent, so they are walked concurrently
+	walkers = [
+		BatchedSwapsWalker(client, url, [{**where, "to_in": plan.chunks[i]} for i in document], page_size)
+		for document in plan.documents
+	]
+	dfs = await asyncio.gather(*(walker.fetch_df() for walker in walkers))
+	return concat_pages([df for df in dfs if len(df) > 0], max_rows)
@@ -0,0 +1,235 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .compact_swaps import CompactSwaps
+from .dex_subgraphs_wrapper import DexSubgraphsWrapper
+from .fetch_scheduler import report_to_df
+from .instrumentation import instruments
+from .swaps_aggregates import SWAPS_COLUMNS, SwapsCube, build_cells, merge_cells
+from .swaps_filters import SwapsFilter
+
+
+@dataclass(frozen=True)
+class WalletResult():
+	# swaps of one wallet and their cube cells, never modified once built
+	swaps: CompactSwaps
+	cells: pd.DataFrame
+	# non-ok rows of the fetch report of the fetch the wallet came from
+	failed_report: pd.DataFrame
+	# `time.monotonic()` when that fetch started, swaps newer than it may be missing
+	fetched_at: float = 0.0
+
+	@property
+	def nbytes(self) -> int:
+		return self.swaps.nbytes + int(self.cells.memory_usage(deep=True).sum())
+
+
+def _split_cells_by_swapper(list_of_cells: List[pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+	# cells built with `by=('swapper',)`, summed and split per swapper
+	if not list_of_cells:
+		return {}
+	cells = pd.concat(list_of_cells, ignore_index=True)
+	cells['swapper'] = cells['swapper'].astype(object)
+	return {swapper: merge_cells([group.drop(columns='swapper')]) for swapper, group in cells.groupby('swapper', sort=False)}
+
+
+@functools.lru_cache(maxsize=None)
+def _empty_result() -> WalletResult:
+	empty = CompactSwaps.empty()
+	return WalletResult(empty, build_cells(empty.to_pandas(SWAPS_COLUMNS)), report_to_df([]))
+
+
+class FetchCancelled(Exception):
+	# the session fetching a wallet stopped before it finished, whoever waited for it fetches it again
+	pass
+
+
+class SwapsResultCache():
+	"""
+	Fetched swaps of single wallets, shared by every session of the dashboard, so a request for
+	several wallets is assembled from the wallets fetched by earlier requests and only fetches the
+	missing ones. Wallets past `max_wallets` or `max_bytes` are evicted, least recently used first.
+
+	Fetches are coalesced (singleflight): a wallet another session is already fetching is waited
+	for instead of being fetched twice. Results are read-only and never copied: the Arrow tables of
+	the wallets are concatenated without copying their buffers, and the last `max_results`
+	assembled results are kept, so reruns of a session reuse the same cube and its memoized rollups.
+
+	Wallets fetched more than `ttl` seconds ago are fetched again, so their new swaps show up, and
+	so are the results assembled from them; None keeps them until they're evicted.
+	"""
+
+	def __init__(self, wrapper: DexSubgraphsWrapper, max_bytes: int = 2 * 2**30, max_wallets: int = 10_000, max_results: int = 32, ttl: Optional[float] = 10 * 60) -> None:
+		self.wrapper = wrapper
+		self.max_bytes = max_bytes
+		self.max_wallets = max_wallets
+		self.max_results = max_results
+		self.ttl = ttl
+		self._lock = threading.Lock()
+		# (wallet, filter) -> WalletResult, least recently used first
+		self._wallets: "OrderedDict[Tuple[str, Optional[SwapsFilter]], WalletResult]" = OrderedDict()
+		self._nbytes = 0
+		# (wallet, filter) -> future of the fetch bringing it
+		self._in_flight: Dict[Tuple[str, Optional[SwapsFilter]], Future] = {}
+		# (wallets, filter) -> (when its oldest wallet was fetched, (compact swaps, cube, failed report))
+		self._results: "OrderedDict[Tuple[frozenset, Optional[SwapsFilter]], Tuple]" = OrderedDict()
+		self.n_hits = 0
+		self.n_waits = 0
+		self.n_fetched = 0
+
+	@property
+	def nbytes(self) -> int:
+		return self._nbytes
+
+	def _expired(self, fetched_at: float) -> bool:
+		return self.ttl is not None and time.monotonic() - fetched_at >= self.ttl
+
+	def _claim(self, wallets: List[str], swaps_filter: Optional[SwapsFilter]) -> Tuple[Dict[str, WalletResult], Dict[str, Future], List[str]]:
+		# under the lock: the cached wallets, the ones other fetches bring, and the ones this caller fetches
+		hits, waiting, claimed = {}, {}, []
+		for wallet in wallets:
+			key = (wallet, swaps_filter)
+			if key in self._wallets and self._expired(self._wallets[key].fetched_at):
+				self._nbytes -= self._wallets.pop(key).nbytes
+			if key in self._wallets:
+				self._wallets.move_to_end(key)
+				hits[wallet] = self._wallets[key]
+			elif key in self._in_flight:
+				waiting[wallet] = self._in_flight[key]
+			else:
+				self._in_flight[key] = Future()
+				claimed.append(wallet)
+		self.n_hits += len(hits)
+		self.n_waits += len(waiting)
+		return hits, waiting, claimed
+
+	def _complete(self, results: Dict[str, WalletResult], swaps_filter: Optional[SwapsFilter], store: bool) -> None:
+		with self._lock:
+			for wallet, result in results.items():
+				key = (wallet, swaps_filter)
+				if store:
+					self._wallets[key] = result
+					self._nbytes += result.nbytes
+				self._in_flight.pop(key).set_result(result)
+			self.n_fetched += len(results)
+			self._evict()
+
+	def _fail(self, wallets: List[str], swaps_filter: Optional[SwapsFilter], error: Exception) -> None:
+		with self._lock:
+			for wallet in wallets:
+				self._in_flight.pop((wallet, swaps_filter)).set_exception(error)
+
+	def _evict(self) -> None:
+		while self._wallets and (self._nbytes > self.max_bytes or len(self._wallets) > self.max_wallets):
+			_, result = self._wallets.popitem(last=False)
+			self._nbytes -= result.nbytes
+
+	@staticmethod
+	def _split_by_wallet(wallets: List[str], chunks: List[CompactSwaps], chunk_cells: List[pd.DataFrame], failed_report: pd.DataFrame, fetched_at: float) -> Dict[str, WalletResult]:
+		# one `take` of the rows of each wallet, so evicting a wallet frees its memory
+		swaps = CompactSwaps.concat(chunks)
+		swappers = swaps.to_pandas(['swapper'])['swapper'].astype(object).to_numpy()
+		codes, uniques = pd.factorize(swappers)
+		order = np.argsort(codes, kind='stable')
+		bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+		rows = {wallet: order[bounds[i]:bounds[i + 1]] for i, wallet in enumerate(uniques)}
+
+		cells = _split_cells_by_swapper(chunk_cells)
+		empty = _empty_result()
+		return {
+			wallet: WalletResult(
+				CompactSwaps(swaps.table.take(rows[wallet])) if wallet in rows else empty.swaps,
+				cells.get(wallet, empty.cells),
+				failed_report,
+				fetched_at,
+			)
+			for wallet in wallets
+		}
+
+	@staticmethod
+	def _assemble(results: List[WalletResult], chunks: List[CompactSwaps] = (), chunk_cells: List[pd.DataFrame] = ()) -> Tuple[CompactSwaps, SwapsCube, pd.DataFrame]:
+		# swaps, cube and failed dexes of the wallets, plus the chunks of a fetch still running
+		with instruments.span("assemble_swaps") as span:
+			results = [_empty_result()] + results
+			swaps = CompactSwaps.concat([result.swaps for result in results] + list(chunks))
+			cube = SwapsCube(merge_cells([result.cells for result in results] + [cells.drop(columns='swapper') for cells in chunk_cells]))
+			failed_report = pd.concat([result.failed_report for result in results], ignore_index=True).drop_duplicates('project', ignore_index=True)
+			span.set(n_wallets=len(results) - 1, rows=len(swaps), memory_bytes=swaps.nbytes)
+		return swaps, cube, failed_report
+
+	def iter_swaps(self, wallet_addresses, swaps_filter: Optional[SwapsFilter] = None, min_seconds_between_updates: float = 1.0) -> Iterator[Tuple[CompactSwaps, SwapsCube, pd.DataFrame]]:
+		"""
+		Yields the compact swaps, cube and failed dexes of `wallet_addresses` whenever more dexes
+		answered, the last ones are complete (the same ones aren't yielded twice). Only the wallets this call fetches itself show up
+		progressively; wallets fetched by another session appear at the end.
+		"""
+		wallets = list(dict.fromkeys(wallet.lower() for wallet in wallet_addresses))
+		result_key = (frozenset(wallets), swaps_filter)
+		with self._lock:
+			fetched_at, result = self._results.get(result_key, (None, None))
+			if result is not None and self._expired(fetched_at):
+				del self._results[result_key]
+				result = None
+			if result is not None:
+				self._results.move_to_end(result_key)
+		if result is not None:
+			yield result
+			return
+
+		results = {}
+		pending = wallets
+		# whether the last partial result yielded already had every swap, not to yield it twice
+		up_to_date = False
+		while pending:
+			with self._lock:
+				hits, waiting, claimed = self._claim(pending, swaps_filter)
+			results.update(hits)
+
+			if claimed:
+				chunks, chunk_cells, reports = [], [], []
+				last_update = 0
+				fetched_at = time.monotonic()
+				try:
+					for chunk in self.wrapper.iter_swaps(claimed, compact=True, swaps_filter=swaps_filter, reports=reports):
+						chunks.append(chunk)
+						up_to_date = False
+						chunk_cells.append(build_cells(chunk.to_pandas(['swapper'] + SWAPS_COLUMNS), by=('swapper',)))
+						if time.monotonic() - last_update >= min_seconds_between_updates:
+							last_update = time.monotonic()
+							yield self._assemble(list(results.values()), chunks, chunk_cells)
+							up_to_date = True
+					failed_report = reports[-1][reports[-1]['status'] != 'ok']
+					fetched = self._split_by_wallet(claimed, chunks, chunk_cells, failed_report, fetched_at)
+				except BaseException as e:
+					# including the GeneratorExit of a session that stopped, so nobody waits forever
+					self._fail(claimed, swaps_filter, e if isinstance(e, Exception) else FetchCancelled(repr(e)))
+					raise
+				# swaps missing dexes are handed to whoever waited, but not kept
+				self._complete(fetched, swaps_filter, store=len(failed_report) == 0)
+				results.update(fetched)
+
+			pending = []
+			for wallet, future in waiting.items():
+				up_to_date = False
+				try:
+					results[wallet] = future.result()
+				except FetchCancelled:
+					pending.append(wallet)
+
+		results = [results[wallet] for wallet in wallets]
+		result = self._assemble(results)
+		if all(len(wallet_result.failed_report) == 0 for wallet_result in results):
+			with self._lock:
+				self._results[result_key] = (min((wallet_result.fetched_at for wallet_result in results), default=time.monotonic()), result)
+				while len(self._results) > self.max_results:
+					self._results.popitem(last=False)
+		if not up_to_date:
+			yield result
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import weakref
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterator, List, Optional
+
+import subgrounds.client
+from subgrounds.client import INTROSPECTION_QUERY
+from subgrounds.schema import mk_schema
+from subgrounds.subgrounds import Subgrounds
+from subgrounds.subgraph.subgraph import Subgraph
+from subgrounds.transform import DEFAULT_SUBGRAPH_TRANSFORMS
+
+from .async_fetch import AsyncSubgraphClient
+from .instrumentation import instruments
+
+
+class SchemaCache():
+	"""
+	Introspected subgraph schemas saved as `<cache_dir>/<project>.json`. A schema older
+	than `ttl` seconds is introspected again, but is still used if that request fails.
+	"""
+
+	def __init__(self, cache_dir: str, ttl: float = 24 * 60 * 60) -> None:
+		self.cache_dir = cache_dir
+		self.ttl = ttl
+		os.makedirs(cache_dir, exist_ok=True)
+
+	def _path(self, project: str) -> str:
+		return os.path.join(self.cache_dir, f"{project}.json")
+
+	def load(self, project: str, allow_stale: bool = False) -> Optional[Dict]:
+		path = self._path(project)
+		try:
+			age = time.time() - os.path.getmtime(path)
+			if age > self.ttl and not allow_stale:
+				return None
+			with open(path) as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return None
+
+	def save(self, project: str, schema: Dict) -> None:
+		path = self._path(project)
+		tmp_path = f"{path}.{threading.get_ident()}.tmp"
+		with open(tmp_path, "w") as f:
+			json.dump(schema, f)
+		os.replace(tmp_path, path)
+
+
+class LazySubgraphs(Mapping):
+	"""
+	project -> `Subgraph`, built on first access from the schema cache or, failing that,
+	from an introspection request. Every project is listed from the start, so iterating
+	over the keys is free; reading a value loads that one project only.
+	"""
+
+	def __init__(self, sg: Subgrounds, projects: List[str], url_of: Callable[[str], str], schema_cache: Optional[SchemaCache] = None) -> None:
+		self.sg = sg
+		self.projects = list(projects)
+		self.url_of = url_of
+		self.schema_cache = schema_cache
+		self._subgraphs = {}
+		self._locks = {project: threading.Lock() for project in self.projects}
+		self._async_locks = weakref.WeakKeyDictionary()
+
+	def __iter__(self) -> Iterator[str]:
+		return iter(self.projects)
+
+	def __len__(self) -> int:
+		return len(self.projects)
+
+	def __contains__(self, project) -> bool:
+		return project in self._locks
+
+	def loaded(self) -> Dict[str, Subgraph]:
+		return dict(self._subgraphs)
+
+	def _cached_schema(self, project: str) -> Optional[Dict]:
+		return self.schema_cache.load(project) if self.schema_cache is not None else None
+
+	def _register(self, project: str, schema: Dict) -> Subgraph:
+		# same as `Subgrounds.load_subgraph`, with the schema coming from wherever we found it
+		url = self.url_of(project)
+		subgraph = Subgraph(url, mk_schema(schema), DEFAULT_SUBGRAPH_TRANSFORMS)
+		self.sg.subgraphs[url] = subgraph
+		self._subgraphs[project] = subgraph
+		return subgraph
+
+	def _stale_schema(self, project: str) -> Optional[Dict]:
+		return self.schema_cache.load(project, allow_stale=True) if self.schema_cache is not None else None
+
+	def _save_schema(self, project: str, schema: Dict) -> None:
+		if self.schema_cache is not None:
+			self.schema_cache.save(project, schema)
+
+	def __getitem__(self, project: str) -> Subgraph:
+		if project in self._subgraphs:
+			return self._subgraphs[project]
+		if project not in self._locks:
+			raise KeyError(project)
+
+		with self._locks[project]:
+			if project in self._subgraphs:
+				return self._subgraphs[project]
+			with instruments.span("load_schema", project=project) as span:
+				schema, source = self._cached_schema(project), "cache"
+				if schema is None:
+					try:
+						schema, source = subgrounds.client.get_schema(self.url_of(project)), "introspection"
+					except Exception:
+						schema, source = self._stale_schema(project), "stale cache"
+						if schema is None:
+							raise
+					else:
+						self._save_schema(project, schema)
+				span.set(source=source)
+				return self._register(project, schema)
+
+	async def aget(self, project: str, client: AsyncSubgraphClient) -> Subgraph:
+		if project in self._subgraphs:
+			return self._subgraphs[project]
+		if project not in self._locks:
+			raise KeyError(project)
+
+		# concurrent tasks asking for the same project wait for a single introspection;
+		# asyncio locks belong to one event loop, and every `asyncio.run` makes a new one
+		locks = self._async_locks.setdefault(asyncio.get_running_loop(), {})
+		async with locks.setdefault(project, asyncio.Lock()):
+			if project in self._subgraphs:
+				return self._subgraphs[project]
+			with instruments.span("load_schema", project=project) as span:
+				schema, source = await asyncio.to_thread(self._cached_schema, project), "cache"
+				if schema is None:
+					try:
+						schema, source = await client.post(self.url_of(project), INTROSPECTION_QUERY), "introspection"
+					except Exception:
+						schema, source = await asyncio.to_thread(self._stale_schema, project), "stale cache"
+						if schema is None:
+							raise
+					else:
+						await asyncio.to_thread(self._save_schema, project, schema)
+				span.set(source=source)
+				return self._register(project, schema)
@@ -0,0 +1,144 @@
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .instrumentation import instruments
+
+# dimensions of a cube cell, besides its day, and the sums it holds
+CELL_KEYS = ['dex', 'pool_name', 'token_asset_in', 'token_asset_out']
+CELL_VALUES = ['amount_in_usd', 'amount_out_usd', 'n_swaps']
+# columns of the clean swaps that the cells are built from
+SWAPS_COLUMNS = ['swap_datetime'] + CELL_KEYS + ['amount_in_usd', 'amount_out_usd']
+
+_NS_PER_DAY = 24 * 60 * 60 * 10**9
+
+
+def _sum_by(df: pd.DataFrame, keys: List[str], values: List[str]) -> pd.DataFrame:
+	"""
+	`df.groupby(keys)[values].sum()`, keeping rows with NaN keys as their own groups: the
+	cube must not drop a swap because of a missing pool name, only the rollups that group
+	by the pool name should. Categorical keys are grouped by their codes (NaN is -1), as
+	`dropna=False` doesn't work with categoricals in pandas 1.5.
+	"""
+	categories = {key: df[key].cat.categories for key in keys if isinstance(df[key].dtype, pd.CategoricalDtype)}
+	grouped = pd.DataFrame({
+		**{key: df[key].cat.codes.to_numpy() if key in categories else df[key].to_numpy() for key in keys},
+		**{value: df[value].to_numpy() for value in values},
+	}).groupby(keys, sort=False)[values].sum().reset_index()
+
+	for key, key_categories in categories.items():
+		grouped[key] = pd.Categorical.from_codes(grouped[key].to_numpy(), categories=key_categories)
+	return grouped
+
+
+@instruments.traced("build_cells")
+def build_cells(swaps_df: pd.DataFrame, by: Tuple[str, ...] = ()) -> pd.DataFrame:
+	"""
+	Swaps summed per (day, dex, pool, asset in, asset out). Every chart of the dashboard
+	is a rollup of these cells, and cells of different chunks can be summed together.
+	`by` are extra keys in front, to split the cells later (per swapper, for example).
+	"""
+	amount_in_usd = swaps_df['amount_in_usd'].to_numpy(dtype=np.float64)
+	swaps = pd.DataFrame({
+		**{col: swaps_df[col].astype('category').array for col in by},
+		'day': swaps_df['swap_datetime'].to_numpy(dtype='datetime64[ns]').astype(np.int64) // _NS_PER_DAY,
+		**{col: swaps_df[col].astype('category').array for col in CELL_KEYS},
+		'amount_in_usd': amount_in_usd,
+		'amount_out_usd': swaps_df['amount_out_usd'].to_numpy(dtype=np.float64),
+		# `count` of the old groupbys, which skips NaN amounts
+		'n_swaps': (~np.isnan(amount_in_usd)).astype(np.int64),
+	})
+	return _sum_by(swaps, list(by) + ['day'] + CELL_KEYS, CELL_VALUES)
+
+
+def merge_cells(list_of_cells: List[pd.DataFrame]) -> pd.DataFrame:
+	cells = pd.concat(list_of_cells, ignore_index=True)
+	for col in CELL_KEYS:
+		cells[col] = cells[col].astype('category')
+	return _sum_by(cells, ['day'] + CELL_KEYS, CELL_VALUES)
+
+
+class SwapsCube():
+	"""
+	Aggregates behind every chart of `Home.py`, built once per dataset.
+
+	`cells` holds the swaps summed per day, dex, pool and asset pair (`token_asset_in` and
+	`token_asset_out`, so the copies of a token on every chain are one asset); `movements` holds
+	the token inflows (bought) and outflows (sold) per asset, dex, pool and week. Weeks
+	are 7 day bins starting on the day of the oldest swap, the bins of `pd.Grouper(freq='7d')`.
+	Rollups are computed from these small frames on first use and then memoized, so a
+	widget change doesn't touch the swaps again.
+	"""
+
+	def __init__(self, cells: pd.DataFrame) -> None:
+		first_day = cells['day'].min() if len(cells) > 0 else 0
+		# on a copy, the cells passed in may be shared with other cubes and sessions
+		self.cells = cells.assign(week=pd.to_datetime((first_day + (cells['day'] - first_day) // 7 * 7) * _NS_PER_DAY))
+		self.movements = self._build_movements()
+		self._rollups = {}
+
+	@classmethod
+	def from_swaps_df(cls, swaps_df: pd.DataFrame) -> "SwapsCube":
+		return cls(build_cells(swaps_df))
+
+	@classmethod
+	def from_cubes(cls, cubes: List["SwapsCube"]) -> "SwapsCube":
+		# cube of the concatenated datasets, without going back to their swaps
+		return cls(merge_cells([cube.cells[['day'] + CELL_KEYS + CELL_VALUES] for cube in cubes]))
+
+	def _build_movements(self) -> pd.DataFrame:
+		keys = ['week', 'dex', 'pool_name']
+		outflows = self.cells[keys + ['token_asset_in', 'amount_in_usd']].rename(columns={'token_asset_in': 'token_asset', 'amount_in_usd': 'abs_amount_usd'})
+		outflows['net_amount_usd'] = -outflows['abs_amount_usd']
+		inflows = self.cells[keys + ['token_asset_out', 'amount_out_usd']].rename(columns={'token_asset_out': 'token_asset', 'amount_out_usd': 'abs_amount_usd'})
+		inflows['net_amount_usd'] = inflows['abs_amount_usd']
+
+		movements = pd.concat([outflows, inflows], ignore_index=True)
+		movements['token_asset'] = movements['token_asset'].astype('category')
+		return _sum_by(movements, ['token_asset'] + keys, ['net_amount_usd', 'abs_amount_usd'])
+
+	def _rollup(self, key: Tuple, compute) -> pd.DataFrame:
+		if key not in self._rollups:
+			self._rollups[key] = compute()
+		return self._rollups[key]
+
+	def _sum_cells(self, by: List[str], value: str) -> pd.DataFrame:
+		return self.cells.groupby(by, observed=True)[value].sum().reset_index()
+
+	def token_pairs(self, metric: str = 'usd volume') -> pd.DataFrame:
+		# token_asset_in, token_asset_out, amount_in_usd (usd volume or number of swaps), largest first
+		value = 'amount_in_usd' if metric == 'usd volume' else 'n_swaps'
+		return self._rollup(('token_pairs', metric), lambda: (
+			self._sum_cells(['token_asset_in', 'token_asset_out'], value)
+			.rename(columns={value: 'amount_in_usd'})
+			.sort_values('amount_in_usd', ascending=False, ignore_index=True)
+		))
+
+	def dex_pools(self, metric: str = 'usd volume') -> pd.DataFrame:
+		# dex, pool_name, amount_in_usd (usd volume or number of swaps)
+		value = 'amount_in_usd' if metric == 'usd volume' else 'n_swaps'
+		return self._rollup(('dex_pools', metric), lambda: (
+			self._sum_cells(['dex', 'pool_name'], value).rename(columns={value: 'amount_in_usd'})
+		))
+
+	def weekly_volume(self, by: str) -> pd.DataFrame:
+		# swap_datetime (week), `by`, amount_in_usd
+		return self._rollup(('weekly_volume', by), lambda: (
+			self._sum_cells(['week', by], 'amount_in_usd').rename(columns={'week': 'swap_datetime'})
+		))
+
+	def token_volume(self, kind: str = 'net', by: Tuple[str, ...] = ('token_asset',)) -> pd.DataFrame:
+		# `by` columns and amount_usd, netted (bought - sold) or absolute (bought + sold)
+		value = f'{kind}_amount_usd'
+		return self._rollup(('token_volume', kind, by), lambda: (
+			self.movements.groupby(list(by), observed=True)[value].sum().reset_index().rename(columns={value: 'amount_usd'})
+		))
+
+	def weekly_token_volume(self, kind: str = 'net') -> pd.DataFrame:
+		# swap_datetime (week), token_asset, amount_usd
+		value = f'{kind}_amount_usd'
+		return self._rollup(('weekly_token_volume', kind), lambda: (
+			self.movements.groupby(['week', 'token_asset'], observed=True)[value].sum().reset_index()
+			.rename(columns={'week': 'swap_datetime', value: 'amount_usd'})
+		))
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from .swaps_pagination import RAW_COLUMNS
+
+# swaps this much older than a fetch are assumed indexed by the subgraph when it ran
+INDEXING_LAG = 60 * 60
+
+# BigInt amounts can overflow int64, so they are stored and loaded as strings (`scale_raw_amounts` parses them)
+_BIGINT_COLUMNS = ['swaps_amountIn', 'swaps_amountOut']
+
+
+class SwapsCache():
+	"""
+	On-disk store of raw swaps, one parquet file per (project, wallet), plus the
+	high-water-mark timestamp of the last sync of every (project, wallet) pair.
+
+	A later sync only needs swaps with `timestamp_gte` the mark. `gte` rather than `gt`
+	because some chains put several blocks on the same timestamp; the overlap is
+	dropped by swap id when appending. The mark of a wallet is the time of the fetch less
+	`INDEXING_LAG`, or its newest swap if that is later, so wallets without swaps on a dex
+	aren't fetched from the start again either.
+	"""
+
+	def __init__(self, cache_dir: str) -> None:
+		self.cache_dir = cache_dir
+		os.makedirs(os.path.join(cache_dir, "swaps"), exist_ok=True)
+		self.db_path = os.path.join(cache_dir, "sync_state.sqlite")
+		self._lock = threading.Lock()
+		with self._connect() as conn:
+			conn.execute("""
+				CREATE TABLE IF NOT EXISTS high_water_marks (
+					project TEXT NOT NULL,
+					wallet TEXT NOT NULL,
+					timestamp INTEGER NOT NULL,
+					PRIMARY KEY (project, wallet)
+				)
+			""")
+
+	def _connect(self) -> sqlite3.Connection:
+		return sqlite3.connect(self.db_path, timeout=30)
+
+	def _path(self, project: str, wallet: str) -> str:
+		return os.path.join(self.cache_dir, "swaps", f"project={project}", f"wallet={wallet}.parquet")
+
+	def high_water_marks(self, project: str, wallets: List[str]) -> Dict[str, Optional[int]]:
+		with self._connect() as conn:
+			rows = conn.execute("SELECT wallet, timestamp FROM high_water_marks WHERE project = ?", (project,)).fetchall()
+		known = dict(rows)
+		return {wallet: known.get(wallet) for wallet in wallets}
+
+	def group_by_high_water_mark(self, project: str, wallets: List[str]) -> Dict[Optional[int], List[str]]:
+		# wallets synced together share a mark, so they can still be fetched with one query
+		groups = {}
+		for wallet, mark in self.high_water_marks(project, wallets).items():
+			groups.setdefault(mark, []).append(wallet)
+		return groups
+
+	def _read(self, path: str) -> pd.DataFrame:
+		return pd.read_parquet(path)
+
+	def _write(self, path: str, df: pd.DataFrame) -> None:
+		df = df[RAW_COLUMNS].copy()
+		for col in _BIGINT_COLUMNS:
+			df[col] = df[col].astype(str)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		tmp_path = f"{path}.{threading.get_ident()}.tmp"
+		df.to_parquet(tmp_path, index=False)
+		os.replace(tmp_path, path)
+
+	def append(self, project: str, wallets: List[str], raw_df: pd.DataFrame, fetched_at: int, complete: bool = True) -> None:
+		"""
+		Stores freshly fetched swaps of `wallets`, fetched from `fetched_at` (unix seconds) on, and
+		moves their high-water marks. An incomplete fetch (cut by a row limit) is stored without
+		moving the marks, as the swaps it missed would never be fetched.
+		"""
+		with self._lock:
+			for wallet, wallet_df in raw_df.groupby('swaps_to'):
+				path = self._path(project, wallet)
+				if os.path.exists(path):
+					wallet_df = pd.concat([self._read(path), wallet_df[RAW_COLUMNS]], ignore_index=True)
+					wallet_df = wallet_df.drop_duplicates(subset='swaps_id', keep='last')
+				self._write(path, wallet_df)
+
+		if not complete:
+			return
+
+		# every swap of each wallet up to its mark is now on disk
+		newest = pd.to_numeric(raw_df['swaps_timestamp']).groupby(raw_df['swaps_to']).max().to_dict() if len(raw_df) > 0 else {}
+		marks = [(project, wallet, max(int(newest.get(wallet, 0)), fetched_at - INDEXING_LAG)) for wallet in wallets]
+		with self._connect() as conn:
+			conn.executemany(
+				"""
+				INSERT INTO high_water_marks (project, wallet, timestamp) VALUES (?, ?, ?)
+				ON CONFLICT (project, wallet) DO UPDATE SET timestamp = MAX(timestamp, excluded.timestamp)
+				""",
+				marks
+			)
+
+	def load(self, project: str, wallets: List[str]) -> pd.DataFrame:
+		list_of_dfs = [self._read(path) for path in (self._path(project, wallet) for wallet in wallets) if os.path.exists(path)]
+		if not list_of_dfs:
+			return pd.DataFrame(columns=RAW_COLUMNS)
+		df = pd.concat(list_of_dfs, ignore_index=True)
+		return df.sort_values(['swaps_timestamp', 'swaps_id'], ascending=False, ignore_index=True)
@@ -0,0 +1,148 @@
+import os
+import zlib
+from typing import BinaryIO, Iterator, List, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .compact_swaps import CompactSwaps, decode_hashes
+from .instrumentation import instruments
+from .swaps_normalization import CLEAN_COLUMNS
+
+# format -> mime type; the format is also the file extension
+EXPORT_FORMATS = {
+	'csv.gz': 'application/gzip',
+	'ndjson.gz': 'application/gzip',
+	'parquet': 'application/vnd.apache.parquet',
+	# the Arrow IPC stream format: the chunks of the swaps have their own dictionaries, which the file format doesn't allow
+	'arrows': 'application/vnd.apache.arrow.stream',
+}
+# rows converted and written at once, what an export holds in memory besides the swaps
+CHUNK_ROWS = 10_000
+
+Swaps = Union[CompactSwaps, pd.DataFrame]
+
+
+class _Sink():
+	# file the arrow writers write to, emptied after every chunk
+	def __init__(self) -> None:
+		self._parts = []
+		self._position = 0
+		self.closed = False
+
+	def write(self, data) -> int:
+		self._parts.append(bytes(data))
+		self._position += len(data)
+		return len(data)
+
+	def tell(self) -> int:
+		return self._position
+
+	def flush(self) -> None:
+		pass
+
+	def close(self) -> None:
+		self.closed = True
+
+	def drain(self) -> bytes:
+		data = b"".join(self._parts)
+		self._parts = []
+		return data
+
+
+def format_of(path: str) -> str:
+	for fmt in EXPORT_FORMATS:
+		if path.endswith(f".{fmt}"):
+			return fmt
+	raise ValueError(f"can't tell the export format of {path!r}, it should end with one of {', '.join(EXPORT_FORMATS)}")
+
+
+def _iter_frames(swaps: Swaps, columns: List[str], chunk_rows: int) -> Iterator[pd.DataFrame]:
+	# at least one chunk, empty when there are no swaps, for the header or the schema
+	for offset in range(0, max(len(swaps), 1), chunk_rows):
+		if isinstance(swaps, CompactSwaps):
+			yield CompactSwaps(swaps.table.slice(offset, chunk_rows)).to_pandas(columns)
+		else:
+			yield swaps[columns].iloc[offset:offset + chunk_rows]
+
+
+def _iter_tables(swaps: Swaps, columns: List[str], chunk_rows: int) -> Iterator[pa.Table]:
+	# tables of one schema, as the parquet writer wants: tx hashes as strings, as in the clean df
+	if isinstance(swaps, CompactSwaps):
+		table = swaps.table.select(columns)
+		for offset in range(0, max(len(swaps), 1), chunk_rows):
+			chunk = table.slice(offset, chunk_rows)
+			if 'tx_hash' in columns:
+				index = columns.index('tx_hash')
+				chunk = chunk.set_column(index, 'tx_hash', pa.array(decode_hashes(chunk.column(index)), type=pa.string()))
+			yield chunk
+	else:
+		# slices of a categorical keep every category, so the chunks get the same dictionary types
+		schema = pa.Schema.from_pandas(swaps[columns], preserve_index=False)
+		for frame in _iter_frames(swaps, columns, chunk_rows):
+			yield pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+
+
+def iter_export(swaps: Swaps, fmt: str, columns: Optional[List[str]] = None, chunk_rows: int = CHUNK_ROWS) -> Iterator[bytes]:
+	"""
+	The swaps (compact, or a clean df) encoded in `fmt` (one of EXPORT_FORMATS), in pieces of
+	about `chunk_rows` rows: only one chunk is ever converted and held in memory, so exporting
+	doesn't cost a copy of the whole result like `to_csv()` or `to_json()` did.
+	"""
+	columns = list(CLEAN_COLUMNS if columns is None else columns)
+	if fmt in ('csv.gz', 'ndjson.gz'):
+		# one gzip member over the whole stream
+		compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+		for i, frame in enumerate(_iter_frames(swaps, columns, chunk_rows)):
+			if fmt == 'csv.gz':
+				text = frame.to_csv(index=False, header=i == 0)
+			else:
+				text = frame.to_json(orient='records', lines=True, date_format='iso', date_unit='s')
+			yield compressor.compress(text.encode('utf-8'))
+		yield compressor.flush()
+
+	elif fmt in ('parquet', 'arrows'):
+		sink = _Sink()
+		writer = None
+		for table in _iter_tables(swaps, columns, chunk_rows):
+			if writer is None:
+				if fmt == 'parquet':
+					writer = pq.ParquetWriter(sink, table.schema)
+				else:
+					writer = pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+			writer.write_table(table)
+			yield sink.drain()
+		writer.close()
+		yield sink.drain()
+
+	else:
+		raise ValueError(f"unknown export format {fmt!r}, it should be one of {', '.join(EXPORT_FORMATS)}")
+
+
+def export_swaps(swaps: Swaps, path_or_file: Union[str, BinaryIO], fmt: Optional[str] = None, columns: Optional[List[str]] = None,
+		chunk_rows: int = CHUNK_ROWS) -> int:
+	"""
+	Writes the export of the swaps to a path (its extension tells the format, unless `fmt` is
+	given), or to an open binary file, and returns its size in bytes. A path is written to a
+	temporary file next to it first, so it never holds half an export.
+	"""
+	if isinstance(path_or_file, str):
+		fmt = fmt if fmt is not None else format_of(path_or_file)
+		tmp_path = f"{path_or_file}.{os.getpid()}.tmp"
+		try:
+			with open(tmp_path, "wb") as f:
+				n_bytes = export_swaps(swaps, f, fmt, columns, chunk_rows)
+			os.replace(tmp_path, path_or_file)
+		finally:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+		return n_bytes
+
+	with instruments.span("export", format=fmt) as span:
+		n_bytes = 0
+		for data in iter_export(swaps, fmt, columns, chunk_rows):
+			path_or_file.write(data)
+			n_bytes += len(data)
+		span.set(rows=len(swaps), n_bytes=n_bytes)
+	return n_bytes
@@ -0,0 +1,81 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# `where` keys a `SwapsFilter` pushes down, with the raw df column and test that evaluate
+# them locally, on swaps that were already fetched (the swaps cache)
+_LOCAL_FILTERS = {
+	"timestamp_gte": ('swaps_timestamp', lambda column, value: pd.to_numeric(column) >= int(value)),
+	"timestamp_lt": ('swaps_timestamp', lambda column, value: pd.to_numeric(column) < int(value)),
+	"amountInUSD_gt": ('swaps_amountInUSD', lambda column, value: pd.to_numeric(column) > float(value)),
+	"tokenIn_in": ('swaps_tokenIn_id', lambda column, value: column.isin(value)),
+	"tokenOut_in": ('swaps_tokenOut_id', lambda column, value: column.isin(value)),
+}
+
+
+def split_project(project: str) -> Tuple[str, str]:
+	# "uniswap-v3-arbitrum" -> ("uniswap-v3", "arbitrum")
+	protocol, chain = project.rsplit("-", 1)
+	return protocol, chain
+
+
+def _to_unix(value) -> int:
+	# unix seconds, or anything `pd.Timestamp` understands (naive ones are UTC)
+	if isinstance(value, (int, np.integer)):
+		return int(value)
+	return int(pd.Timestamp(value).timestamp())
+
+
+@dataclass(frozen=True)
+class SwapsFilter():
+	"""
+	What a fetch is narrowed to. The time range (start inclusive, end exclusive), the
+	minimum usd amount sold and the tokens are pushed down to the `where` of the subgraph
+	queries; chains and protocols decide which subgraphs are queried at all.
+
+	`min_amount_usd` is compared on the subgraph with the usd value the dex gave the swap, not the
+	one the token index fills in later: swaps the dex left unvalued (0) never pass it, whatever
+	they were worth.
+	"""
+	start: Optional[object] = None
+	end: Optional[object] = None
+	chains: Tuple[str, ...] = ()
+	protocols: Tuple[str, ...] = ()
+	min_amount_usd: Optional[float] = None
+	# token addresses
+	tokens_in: Tuple[str, ...] = ()
+	tokens_out: Tuple[str, ...] = ()
+
+	def where(self) -> Dict:
+		where = {}
+		if self.start is not None:
+			where["timestamp_gte"] = _to_unix(self.start)
+		if self.end is not None:
+			where["timestamp_lt"] = _to_unix(self.end)
+		if self.min_amount_usd is not None:
+			# BigDecimal filters take strings; the dex's own value, the filled ones don't exist yet
+			where["amountInUSD_gt"] = str(self.min_amount_usd)
+		if self.tokens_in:
+			where["tokenIn_in"] = [token.lower() for token in self.tokens_in]
+		if self.tokens_out:
+			where["tokenOut_in"] = [token.lower() for token in self.tokens_out]
+		return where
+
+	def select_projects(self, projects: List[str]) -> List[str]:
+		chains, protocols = set(self.chains), set(self.protocols)
+		return [
+			project for project in projects
+			if (not chains or split_project(project)[1] in chains) and (not protocols or split_project(project)[0] in protocols)
+		]
+
+
+def filter_raw_df(raw_df: pd.DataFrame, where: Dict) -> pd.DataFrame:
+	# rows of `raw_df` the subgraphs would have returned for the pushed down keys of `where`
+	mask = np.ones(len(raw_df), dtype=bool)
+	for key, value in where.items():
+		if key in _LOCAL_FILTERS:
+			column, test = _LOCAL_FILTERS[key]
+			mask &= test(raw_df[column], value).to_numpy(dtype=bool)
+	return raw_df[mask].reset_index(drop=True)
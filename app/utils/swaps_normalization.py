@@ -0,0 +1,87 @@
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# largest power of ten that still fits in int64
+_MAX_INT64_DECIMALS = 18
+
+# columns of `DexSubgraphsWrapper.build_clean_df`, in order
+CLEAN_COLUMNS = [
+	'swapper', 'swap_datetime', 'dex',
+	'token_address_in', 'token_symbol_in', 'token_asset_in', 'amount_in', 'amount_in_usd', 'token_in_approx_price_usd',
+	'token_address_out', 'token_symbol_out', 'token_asset_out', 'amount_out', 'amount_out_usd', 'token_out_approx_price_usd',
+	'conversion_rate_in_to_out', 'pool_address', 'pool_name', 'tx_hash', 'log_index',
+]
+
+# repeated strings of the clean df, stored once per distinct value
+CATEGORICAL_COLUMNS = ['dex', 'token_symbol_in', 'token_asset_in', 'token_symbol_out', 'token_asset_out', 'pool_name']
+
+
+def masked_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+	# numerator/denominator, 0 where the denominator is 0
+	numerator = np.asarray(numerator, dtype=np.float64)
+	denominator = np.asarray(denominator, dtype=np.float64)
+	return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator != 0)
+
+
+def _scale_int64(amounts: np.ndarray, decimals: np.ndarray) -> np.ndarray:
+	# integer division first, so only the remainder goes through a float division
+	pow10 = 10 ** np.minimum(decimals, _MAX_INT64_DECIMALS)
+	quotient, remainder = np.divmod(amounts, pow10)
+	scaled = quotient + remainder / pow10
+	return scaled / np.power(10.0, np.maximum(decimals - _MAX_INT64_DECIMALS, 0))
+
+
+def _split_digit_strings(amounts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+	"""
+	Decimal strings (or a mix of strings and python ints) as a float64 high part and an int64
+	low part of 18 decimal digits. The digits are right aligned into a byte matrix, one block copy
+	per string length, so every column is one power of ten and both parts are a dot product.
+	"""
+	chars = amounts.astype(np.bytes_)
+	n_rows, width = len(amounts), chars.dtype.itemsize
+	chars = chars.view(np.uint8).reshape(n_rows, width)
+	lengths = (chars != 0).sum(axis=1)
+
+	n_columns = max(width, _MAX_INT64_DECIMALS)
+	digits = np.zeros((n_rows, n_columns), dtype=np.uint8)
+	for length in np.unique(lengths):
+		rows = np.flatnonzero(lengths == length)
+		digits[rows, n_columns - length:] = chars[rows, :length] - ord("0")
+
+	low = digits[:, -_MAX_INT64_DECIMALS:].astype(np.int64) @ 10 ** np.arange(_MAX_INT64_DECIMALS - 1, -1, -1, dtype=np.int64)
+	high = digits[:, :-_MAX_INT64_DECIMALS].astype(np.float64) @ np.power(10.0, np.arange(n_columns - _MAX_INT64_DECIMALS - 1, -1, -1))
+	return high, low
+
+
+def scale_raw_amounts(amounts: pd.Series, decimals: pd.Series) -> np.ndarray:
+	"""
+	`amounts / 10**decimals` as float64, without first rounding the raw integer amounts to
+	float64. BigInt amounts past int64 come as python ints, or as decimal strings from the swaps
+	cache; they are split into a high part and an int64 low part of 18 decimal digits.
+	"""
+	decimals = pd.to_numeric(decimals).fillna(0).to_numpy(dtype=np.int64)
+
+	if pd.api.types.is_integer_dtype(amounts.dtype):
+		return _scale_int64(amounts.to_numpy(dtype=np.int64), decimals)
+
+	if pd.api.types.is_float_dtype(amounts.dtype):
+		return amounts.to_numpy(dtype=np.float64) / np.power(10.0, decimals)
+
+	amounts = amounts.to_numpy(dtype=object)
+	if pd.api.types.infer_dtype(amounts, skipna=False) == 'integer':
+		high = (amounts // 10**_MAX_INT64_DECIMALS).astype(np.float64)
+		low = (amounts % 10**_MAX_INT64_DECIMALS).astype(np.int64)
+	else:
+		high, low = _split_digit_strings(amounts)
+	return high * np.power(10.0, _MAX_INT64_DECIMALS - decimals) + _scale_int64(low, decimals)
+
+
+def concat_clean_dfs(list_of_dfs: List[pd.DataFrame]) -> pd.DataFrame:
+	# pd.concat turns categoricals with different categories into object columns
+	df = pd.concat(list_of_dfs, ignore_index=True)
+	for col in CATEGORICAL_COLUMNS:
+		df[col] = union_categoricals([chunk[col] for chunk in list_of_dfs], ignore_order=True)
+	return df
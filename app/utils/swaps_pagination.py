@@ -0,0 +1,256 @@
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from .instrumentation import instruments
+
+# The Graph refuses `first` values above 1000
+MAX_PAGE_SIZE = 1_000
+
+# selection of the swaps query, in the same order as the columns of the raw df
+SWAP_SELECTION = [
+	"id",
+	"timestamp",
+	"to",
+	"from",
+	"tokenIn { id symbol decimals }",
+	"amountIn",
+	"amountInUSD",
+	"tokenOut { id symbol decimals }",
+	"amountOut",
+	"amountOutUSD",
+	"pool { id name symbol }",
+	"hash",
+	"logIndex",
+]
+
+RAW_COLUMNS = [
+	'swaps_timestamp', 'swaps_to', 'swaps_from', 'swaps_tokenIn_id',
+	'swaps_tokenIn_symbol', 'swaps_tokenIn_decimals', 'swaps_amountIn',
+	'swaps_amountInUSD', 'swaps_tokenOut_id', 'swaps_tokenOut_symbol',
+	'swaps_tokenOut_decimals', 'swaps_amountOut', 'swaps_amountOutUSD',
+	'swaps_pool_id', 'swaps_pool_name', 'swaps_pool_symbol', 'swaps_hash',
+	'swaps_logIndex', 'swaps_id',
+]
+
+
+def make_session(pool_size: int = 32) -> requests.Session:
+	# keep-alive connections shared by every page request to the same host
+	session = requests.Session()
+	adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+	session.mount("https://", adapter)
+	session.mount("http://", adapter)
+	return session
+
+
+def _graphql_value(value) -> str:
+	if isinstance(value, bool):
+		return "true" if value else "false"
+	if isinstance(value, (int, float)):
+		return str(value)
+	if isinstance(value, str):
+		return json.dumps(value)
+	if isinstance(value, (list, tuple, set)):
+		return "[" + ", ".join(_graphql_value(v) for v in value) + "]"
+	if isinstance(value, dict):
+		return "{" + ", ".join(f"{k}: {_graphql_value(v)}" for k, v in value.items()) + "}"
+	raise TypeError(f"Can't render {value!r} as a GraphQL value")
+
+
+def build_swaps_query(where: Dict, first: int, order_by: str = "timestamp", order_direction: str = "desc", alias: Optional[str] = None) -> str:
+	field = f"{alias}: swaps" if alias else "swaps"
+	return (
+		f"{field}(first: {first}, orderBy: {order_by}, orderDirection: {order_direction}, where: {_graphql_value(where)}) "
+		f"{{ {' '.join(SWAP_SELECTION)} }}"
+	)
+
+
+def post_query(session: requests.Session, url: str, query: str, timeout: Optional[float] = None) -> Dict:
+	start = time.perf_counter()
+	resp = session.post(url, json={"query": query}, timeout=timeout)
+	resp.raise_for_status()
+	payload = resp.json()
+	if "errors" in payload:
+		raise Exception(payload["errors"])
+	data = payload["data"]
+	instruments.record_request(url, time.perf_counter() - start, len(resp.content), sum(len(v) for v in data.values() if isinstance(v, list)))
+	return data
+
+
+@instruments.traced("flatten_swaps")
+def swaps_json_to_df(swaps: List[Dict]) -> pd.DataFrame:
+	# same columns and types as `Subgrounds.query_df` (BigInt -> int, BigDecimal -> float)
+	if not swaps:
+		return pd.DataFrame(columns=RAW_COLUMNS)
+
+	return pd.DataFrame({
+		'swaps_timestamp': [int(s['timestamp']) for s in swaps],
+		'swaps_to': [s['to'] for s in swaps],
+		'swaps_from': [s['from'] for s in swaps],
+		'swaps_tokenIn_id': [s['tokenIn']['id'] for s in swaps],
+		'swaps_tokenIn_symbol': [s['tokenIn']['symbol'] for s in swaps],
+		'swaps_tokenIn_decimals': [s['tokenIn']['decimals'] for s in swaps],
+		'swaps_amountIn': [int(s['amountIn']) for s in swaps],
+		'swaps_amountInUSD': [float(s['amountInUSD']) for s in swaps],
+		'swaps_tokenOut_id': [s['tokenOut']['id'] for s in swaps],
+		'swaps_tokenOut_symbol': [s['tokenOut']['symbol'] for s in swaps],
+		'swaps_tokenOut_decimals': [s['tokenOut']['decimals'] for s in swaps],
+		'swaps_amountOut': [int(s['amountOut']) for s in swaps],
+		'swaps_amountOutUSD': [float(s['amountOutUSD']) for s in swaps],
+		'swaps_pool_id': [s['pool']['id'] for s in swaps],
+		'swaps_pool_name': [s['pool']['name'] for s in swaps],
+		'swaps_pool_symbol': [s['pool']['symbol'] for s in swaps],
+		'swaps_hash': [s['hash'] for s in swaps],
+		'swaps_logIndex': [s['logIndex'] for s in swaps],
+		'swaps_id': [s['id'] for s in swaps],
+	}, columns=RAW_COLUMNS)
+
+
+def split_at_boundary(swaps: List[Dict]) -> Tuple[List[Dict], int]:
+	# a full page may cut the swaps of its last timestamp in two, those are drained separately
+	boundary = int(swaps[-1]["timestamp"])
+	return [s for s in swaps if int(s["timestamp"]) != boundary], boundary
+
+
+def shard_bounds(lowest: int, highest: int, max_shards: int) -> List[Tuple[int, int]]:
+	# [gte, lt) ranges covering [lowest, highest], newest first
+	n_shards = min(max_shards, highest - lowest + 1)
+	step = (highest + 1 - lowest) / n_shards
+	edges = sorted({lowest + round(i * step) for i in range(n_shards)} | {highest + 1})
+	return list(zip(edges[:-1], edges[1:]))[::-1]
+
+
+class SwapsPaginator():
+	"""
+	Walks the whole swap history of one subgraph with keyset cursors instead of `skip`.
+
+	Pages are ordered by timestamp desc and the next page starts at `timestamp_lt` the
+	last timestamp seen. Swaps sharing the timestamp at a page boundary are drained
+	separately, ordered by id. When the history is deeper than one page, the remaining
+	time range is split into shards that are walked concurrently.
+	"""
+
+	def __init__(self, url: str, where: Dict, page_size: int = MAX_PAGE_SIZE, max_shards: int = 4, session: requests.Session = None, timeout: Optional[float] = 60) -> None:
+		self.url = url
+		self.where = dict(where)
+		self.page_size = min(page_size, MAX_PAGE_SIZE)
+		self.max_shards = max(max_shards, 1)
+		self.session = session if session is not None else make_session()
+		self.timeout = timeout
+
+	def _query(self, where: Dict, first: int, order_by: str = "timestamp", order_direction: str = "desc") -> List[Dict]:
+		query = "{ " + build_swaps_query(where, first, order_by, order_direction) + " }"
+		return post_query(self.session, self.url, query, self.timeout)["swaps"]
+
+	def _drain_timestamp(self, timestamp: int) -> Iterator[List[Dict]]:
+		where = {**self.where, "timestamp": timestamp}
+		while True:
+			swaps = self._query(where, self.page_size, order_by="id", order_direction="asc")
+			if swaps:
+				yield swaps
+			if len(swaps) < self.page_size:
+				return
+			where["id_gt"] = swaps[-1]["id"]
+
+	def _walk(self, where: Dict) -> Iterator[List[Dict]]:
+		where = dict(where)
+		while True:
+			swaps = self._query(where, self.page_size)
+			if len(swaps) < self.page_size:
+				if swaps:
+					yield swaps
+				return
+
+			head, boundary = split_at_boundary(swaps)
+			if head:
+				yield head
+			yield from self._drain_timestamp(boundary)
+			where["timestamp_lt"] = boundary
+
+	def _walk_shards(self, shards: List[Tuple[int, int]]) -> Iterator[List[Dict]]:
+		pages = queue.Queue(maxsize=2 * len(shards))
+		done = object()
+		stop = threading.Event()
+
+		def walk_shard(gte: int, lt: int) -> None:
+			try:
+				for swaps in self._walk({**self.where, "timestamp_gte": gte, "timestamp_lt": lt}):
+					if stop.is_set():
+						return
+					pages.put(swaps)
+			except Exception as e:
+				pages.put(e)
+			finally:
+				pages.put(done)
+
+		with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+			for gte, lt in shards:
+				executor.submit(walk_shard, gte, lt)
+
+			remaining = len(shards)
+			try:
+				while remaining:
+					item = pages.get()
+					if item is done:
+						remaining -= 1
+					elif isinstance(item, Exception):
+						raise item
+					else:
+						yield item
+			finally:
+				stop.set()
+				# unblock shards waiting on a full queue so the executor can shut down
+				while remaining:
+					if pages.get() is done:
+						remaining -= 1
+
+	def iter_pages(self) -> Iterator[List[Dict]]:
+		first_page = self._query(self.where, self.page_size)
+		if len(first_page) < self.page_size:
+			if first_page:
+				yield first_page
+			return
+
+		head, boundary = split_at_boundary(first_page)
+		if head:
+			yield head
+
+		oldest = self._query(self.where, 1, order_direction="asc")
+		lowest = int(oldest[0]["timestamp"]) if oldest else boundary
+		yield from self._walk_shards(shard_bounds(lowest, boundary, self.max_shards))
+
+	def iter_dfs(self) -> Iterator[pd.DataFrame]:
+		for swaps in self.iter_pages():
+			yield swaps_json_to_df(swaps)
+
+	def fetch_df(self, max_rows: Optional[int] = None) -> pd.DataFrame:
+		# shards complete out of order, so a capped fetch walks newest-first sequentially
+		pages = self.iter_pages() if max_rows is None else self._walk(self.where)
+
+		list_of_dfs = []
+		n_rows = 0
+		for df in map(swaps_json_to_df, pages):
+			list_of_dfs.append(df)
+			n_rows += len(df)
+			if max_rows is not None and n_rows >= max_rows:
+				break
+
+		return concat_pages(list_of_dfs, max_rows)
+
+
+def concat_pages(list_of_dfs: List[pd.DataFrame], max_rows: Optional[int] = None) -> pd.DataFrame:
+	if not list_of_dfs:
+		return pd.DataFrame(columns=RAW_COLUMNS)
+
+	df = pd.concat(list_of_dfs, ignore_index=True)
+	df = df.sort_values(['swaps_timestamp', 'swaps_id'], ascending=False, ignore_index=True)
+	if max_rows is not None:
+		df = df.head(max_rows)
+	return df
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .async_fetch import AsyncSubgraphClient, iter_in_background_loop
+from .compact_swaps import CompactSwaps
+from .dex_subgraphs_wrapper import DexSubgraphsWrapper
+from .fetch_scheduler import ProjectStatus, report_to_df
+from .instrumentation import instruments
+from .swaps_aggregates import CELL_KEYS, CELL_VALUES, SWAPS_COLUMNS, SwapsCube, build_cells, merge_cells
+from .swaps_filters import SwapsFilter
+
+logger = logging.getLogger(__name__)
+
+_NS_PER_DAY = 24 * 60 * 60 * 10**9
+
+
+@dataclass
+class TailCursor():
+	# newest swap seen on a project, and every swap at its timestamp, which the next poll (`timestamp_gte`) returns again
+	timestamp: int
+	hash: str
+	log_index: int
+	seen: Set[Tuple[str, int]] = field(default_factory=set)
+
+
+class SwapsTail():
+	"""
+	Live view of the swaps of some wallets. Each dex is polled only for swaps at or after its
+	cursor, the newest swap seen on it, so a poll costs a request per dex plus the new swaps.
+	A dex that brought new swaps is polled again after `min_interval` seconds, and every empty
+	poll (or failure) doubles its interval, up to `max_interval`.
+
+	New swaps are deduplicated against the cursors, encoded and aggregated on their own, and
+	appended to a ring of at most `max_rows` swaps (whole days are dropped, oldest first) whose
+	cube cells are updated in place, so charts never go back to the old swaps.
+	"""
+
+	def __init__(self, wrapper: DexSubgraphsWrapper, wallet_addresses, swaps_filter: Optional[SwapsFilter] = None,
+			min_interval: float = 15.0, max_interval: float = 300.0, max_rows: Optional[int] = 2_000_000) -> None:
+		self.wrapper = wrapper
+		self.where, self.projects = wrapper._where_and_projects(wallet_addresses, swaps_filter)
+		self.min_interval = min_interval
+		self.max_interval = max_interval
+		self.max_rows = max_rows
+
+		self.cursors: Dict[str, TailCursor] = {}
+		self._intervals = {project: min_interval for project in self.projects}
+		# monotonic time of the next poll of each project
+		self._due = {project: 0.0 for project in self.projects}
+		# status of the last poll of each project
+		self._statuses: Dict[str, ProjectStatus] = {}
+		self.n_polls = 0
+
+		self._lock = threading.Lock()
+		self._chunks: List[CompactSwaps] = []
+		# first day of each chunk, the ones before the eviction day get filtered
+		self._chunk_first_days: List[int] = []
+		self._cells = build_cells(CompactSwaps.empty().to_pandas(SWAPS_COLUMNS))
+		# swaps per day, to know which days to drop from the ring
+		self._day_counts = pd.Series(dtype=np.int64)
+		self._swaps = None
+		self._cube = None
+
+	@classmethod
+	def from_swaps(cls, wrapper: DexSubgraphsWrapper, wallet_addresses, swaps: CompactSwaps, cells: pd.DataFrame,
+			swaps_filter: Optional[SwapsFilter] = None, **kwargs) -> "SwapsTail":
+		# a tail that starts from swaps already fetched (and their cube cells), polling from their newest swap on
+		tail = cls(wrapper, wallet_addresses, swaps_filter, **kwargs)
+		with tail._lock:
+			tail._advance_cursors(tail._keys_of_compact(swaps))
+			tail._append(swaps, cells[['day'] + CELL_KEYS + CELL_VALUES])
+		return tail
+
+	@property
+	def poll_report(self) -> pd.DataFrame:
+		return report_to_df([self._statuses[project] for project in self.projects if project in self._statuses])
+
+	@property
+	def swaps(self) -> CompactSwaps:
+		with self._lock:
+			if self._swaps is None:
+				self._swaps = CompactSwaps.concat(self._chunks)
+			return self._swaps
+
+	@property
+	def cube(self) -> SwapsCube:
+		with self._lock:
+			if self._cube is None:
+				self._cube = SwapsCube(self._cells.copy())
+			return self._cube
+
+	@staticmethod
+	def _keys_of_compact(swaps: CompactSwaps) -> pd.DataFrame:
+		keys = swaps.to_pandas(['dex', 'swap_datetime', 'tx_hash', 'log_index'])
+		return pd.DataFrame({
+			'project': keys['dex'].astype(object).to_numpy(),
+			'timestamp': keys['swap_datetime'].to_numpy(dtype='datetime64[ns]').astype(np.int64) // 10**9,
+			'hash': keys['tx_hash'].to_numpy(),
+			'log_index': keys['log_index'].to_numpy(dtype=np.int64),
+		})
+
+	@staticmethod
+	def _keys_of_raw(raw_df: pd.DataFrame) -> pd.DataFrame:
+		return pd.DataFrame({
+			'project': raw_df['project'].to_numpy(),
+			'timestamp': pd.to_numeric(raw_df['swaps_timestamp']).to_numpy(dtype=np.int64),
+			'hash': raw_df['swaps_hash'].to_numpy(),
+			'log_index': pd.to_numeric(raw_df['swaps_logIndex']).to_numpy(dtype=np.int64),
+		})
+
+	def _advance_cursors(self, keys: pd.DataFrame) -> None:
+		newest = keys[keys['timestamp'] == keys.groupby('project')['timestamp'].transform('max')]
+		for project, group in newest.groupby('project', sort=False):
+			timestamp = int(group['timestamp'].iat[0])
+			seen = set(zip(group['hash'], group['log_index']))
+			cursor = self.cursors.get(project)
+			if cursor is not None and cursor.timestamp == timestamp:
+				cursor.seen |= seen
+			elif cursor is None or cursor.timestamp < timestamp:
+				self.cursors[project] = TailCursor(timestamp, group['hash'].iat[-1], int(group['log_index'].iat[-1]), seen)
+
+	def _new_rows(self, raw_df: pd.DataFrame) -> pd.DataFrame:
+		# rows of a poll that are newer than the cursors, without the ones seen at the cursor timestamps
+		raw_df = raw_df.drop_duplicates(['project', 'swaps_hash', 'swaps_logIndex'], ignore_index=True)
+		keys = self._keys_of_raw(raw_df)
+		timestamps = keys['timestamp'].to_numpy()
+		# -1 for projects without a cursor yet, everything is new there
+		cursor_timestamps = keys['project'].map({project: cursor.timestamp for project, cursor in self.cursors.items()}).fillna(-1).to_numpy(dtype=np.int64)
+		at_cursor = timestamps == cursor_timestamps
+		seen = np.zeros(len(keys), dtype=bool)
+		for i in np.flatnonzero(at_cursor):
+			seen[i] = (keys['hash'].iat[i], keys['log_index'].iat[i]) in self.cursors[keys['project'].iat[i]].seen
+		is_new = (timestamps > cursor_timestamps) | (at_cursor & ~seen)
+		self._advance_cursors(keys[is_new])
+		return raw_df[is_new]
+
+	def _append(self, chunk: CompactSwaps, cells: pd.DataFrame) -> None:
+		days = self._days(chunk)
+		self._day_counts = self._day_counts.add(pd.Series(days).value_counts(), fill_value=0).astype(np.int64)
+		self._chunks.append(chunk)
+		self._chunk_first_days.append(int(days.min()) if len(days) > 0 else np.iinfo(np.int64).max)
+		self._cells = merge_cells([self._cells, cells])
+		self._evict()
+		self._swaps, self._cube = None, None
+
+	@staticmethod
+	def _days(chunk: CompactSwaps) -> np.ndarray:
+		return chunk.table.column('swap_datetime').cast(pa.int64()).to_numpy() // _NS_PER_DAY
+
+	def _evict(self) -> None:
+		if self.max_rows is None or self._day_counts.sum() <= self.max_rows:
+			return
+		# the oldest days, until what is left fits (the newest day always stays)
+		kept = self._day_counts.sort_index(ascending=False).cumsum() <= self.max_rows
+		kept.iloc[0] = True
+		first_day = kept[kept].index.min()
+
+		chunks, chunk_first_days = [], []
+		for chunk, chunk_first_day in zip(self._chunks, self._chunk_first_days):
+			if chunk_first_day < first_day:
+				chunk = CompactSwaps(chunk.table.filter(pc.greater_equal(self._days(chunk), first_day)))
+				chunk_first_day = first_day
+			if len(chunk) > 0:
+				chunks.append(chunk)
+				chunk_first_days.append(chunk_first_day)
+		self._chunks, self._chunk_first_days = chunks, chunk_first_days
+		self._cells = self._cells[self._cells['day'] >= first_day].reset_index(drop=True)
+		self._day_counts = self._day_counts[self._day_counts.index >= first_day]
+
+	def _ingest(self, raw_dfs: List[pd.DataFrame]) -> Dict[str, int]:
+		# runs in a worker thread: new rows of the polled projects, cleaned and aggregated on their own, and their number per project
+		with self._lock:
+			raw_df = self._new_rows(pd.concat(raw_dfs, ignore_index=True))
+			if len(raw_df) == 0:
+				return {}
+			chunk = CompactSwaps.from_raw_df(raw_df, self.wrapper.token_index.table)
+			self.wrapper.token_index.update_in_background([raw_df])
+			self._append(chunk, build_cells(chunk.to_pandas(SWAPS_COLUMNS)))
+			return raw_df['project'].value_counts().to_dict()
+
+	def _project_where(self, project: str) -> Optional[dict]:
+		where = dict(self.where)
+		cursor = self.cursors.get(project)
+		if cursor is not None:
+			where["timestamp_gte"] = max(where.get("timestamp_gte", 0), cursor.timestamp)
+		# a time range that is over has nothing newer to bring
+		if where.get("timestamp_gte", 0) >= where.get("timestamp_lt", float("inf")):
+			return None
+		return where
+
+	async def _apoll_project(self, client: AsyncSubgraphClient, project: str, where: dict) -> Tuple[ProjectStatus, Optional[pd.DataFrame]]:
+		breaker = self.wrapper.scheduler.breaker(project)
+		if not breaker.allow():
+			return ProjectStatus(project, "circuit_open", error=f"skipped after {breaker.n_failures} failed fetches in a row"), None
+
+		start = time.perf_counter()
+		with instruments.span("tail_poll", project=project) as span:
+			try:
+				df = await asyncio.wait_for(self.wrapper._aget_swaps_df_from_specific_dex(client, project, where), timeout=self.wrapper.project_timeout)
+			except Exception as e:
+				breaker.record_failure()
+				span.set(error=repr(e))
+				logger.warning("Error polling %s: %s", project, e, extra={"fields": {"project": project, "error": repr(e)}})
+				return ProjectStatus(project, "timeout" if isinstance(e, asyncio.TimeoutError) else "failed", elapsed_s=time.perf_counter() - start, error=repr(e)), None
+			span.set(rows=len(df))
+		breaker.record_success()
+		df['project'] = project
+		return ProjectStatus(project, "ok", n_rows=len(df), elapsed_s=time.perf_counter() - start), df
+
+	async def apoll(self, client: AsyncSubgraphClient) -> int:
+		"""
+		Polls the projects that are due and returns how many new swaps they brought.
+		"""
+		now = time.monotonic()
+		wheres = {project: self._project_where(project) for project in self.projects if self._due[project] <= now}
+		wheres = {project: where for project, where in wheres.items() if where is not None}
+		results = await asyncio.gather(*(self._apoll_project(client, project, where) for project, where in wheres.items()))
+
+		new_dfs = [df for _, df in results if df is not None and len(df) > 0]
+		n_new = await asyncio.to_thread(self._ingest, new_dfs) if new_dfs else {}
+
+		now = time.monotonic()
+		for status, _ in results:
+			project = status.project
+			# the swaps at the cursor come back every poll, only new ones make a dex active
+			status.n_rows = n_new.get(project, 0)
+			self._intervals[project] = self.min_interval if status.n_rows > 0 else min(2 * self._intervals[project], self.max_interval)
+			self._due[project] = now + self._intervals[project]
+			self._statuses[project] = status
+		for project in self.projects:
+			if project not in wheres and self._project_where(project) is None:
+				self._due[project] = float("inf")
+		self.n_polls += 1
+		return sum(n_new.values())
+
+	def poll(self) -> int:
+		# one poll on a client of its own
+		async def apoll_once() -> int:
+			async with self.wrapper._make_async_client() as client:
+				return await self.apoll(client)
+		return asyncio.run(apoll_once())
+
+	def next_poll_in(self) -> float:
+		# seconds until a project is due, at most `min_interval`
+		next_due = min(self._due.values(), default=float("inf"))
+		return max(0.0, min(next_due - time.monotonic(), self.min_interval))
+
+	async def aiter_polls(self) -> AsyncIterator[int]:
+		"""
+		Polls forever on one client and yields the number of new swaps after every poll. It
+		wakes up at least every `min_interval` seconds, even with nothing due, so a consumer
+		waiting for it gets the chance to stop.
+		"""
+		async with self.wrapper._make_async_client() as client:
+			while True:
+				yield await self.apoll(client)
+				await asyncio.sleep(self.next_poll_in())
+
+	def iter_polls(self) -> Iterator[int]:
+		yield from iter_in_background_loop(self.aiter_polls)
@@ -0,0 +1,368 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .instrumentation import instruments
+from .swaps_filters import split_project
+from .swaps_normalization import masked_divide, scale_raw_amounts
+
+logger = logging.getLogger(__name__)
+
+# prices are volume weighted averages over buckets of this many seconds
+BUCKET_SECONDS = 60 * 60
+# a missing usd value is only filled from a price at most this far from the swap
+MAX_PRICE_AGE = 7 * 24 * 60 * 60
+# the two sides of a swap valued further apart than this don't price either token
+MAX_SIDES_RATIO = 2.0
+# a token priced further than this from the main token of its symbol is an asset of its own
+MAX_ASSET_RATIO = 10.0
+
+# wrapped natives and bridged copies, under the asset they stand for (".e" bridged suffixes are dropped first)
+ASSET_ALIASES = {
+	'WETH': 'ETH', 'WBTC': 'BTC', 'BTC.B': 'BTC', 'USDBC': 'USDC',
+	'WMATIC': 'MATIC', 'WAVAX': 'AVAX', 'WBNB': 'BNB', 'WFTM': 'FTM', 'WXDAI': 'XDAI',
+	'WCELO': 'CELO', 'WGLMR': 'GLMR', 'WMOVR': 'MOVR', 'WFUSE': 'FUSE',
+}
+
+
+def _canonical_symbol(symbol: str) -> str:
+	asset = str(symbol).strip().upper()
+	if asset.endswith('.E'):
+		asset = asset[:-2]
+	return ASSET_ALIASES.get(asset, asset)
+
+
+def canonical_symbols(symbols: np.ndarray) -> np.ndarray:
+	# asset of every symbol ("WETH.e" -> "ETH"), worked out once per distinct symbol
+	codes, uniques = pd.factorize(np.asarray(symbols, dtype=object))
+	assets = np.empty(len(uniques) + 1, dtype=object)
+	assets[:-1] = [_canonical_symbol(symbol) for symbol in uniques]
+	# a missing symbol (code -1) picks the None at the end
+	return assets[codes]
+
+
+def _distinct_tokens(projects: np.ndarray, addresses: np.ndarray) -> Tuple[np.ndarray, List[Optional[Tuple[str, str]]]]:
+	"""
+	Code of every row into the distinct (chain, address) pairs of the rows, and those pairs
+	(None for rows without an address). Only the distinct pairs go through python, the rows
+	are factorized.
+	"""
+	project_codes, project_uniques = pd.factorize(np.asarray(projects, dtype=object))
+	address_codes, address_uniques = pd.factorize(np.asarray(addresses, dtype=object))
+	n_addresses = len(address_uniques) + 1
+	codes, pairs = pd.factorize(project_codes.astype(np.int64) * n_addresses + (address_codes + 1))
+	chains = [split_project(project)[1] for project in project_uniques]
+	keys = [
+		(chains[pair // n_addresses], str(address_uniques[pair % n_addresses - 1]).lower()) if pair % n_addresses > 0 else None
+		for pair in pairs
+	]
+	return codes, keys
+
+
+class PriceTable():
+	"""
+	Read-only snapshot of a `TokenIndex`: its tokens, numbered in the order they were first seen,
+	the asset of each, and the price buckets of every token sorted by (token, bucket) into one
+	int64 key, so the as-of lookup of millions of swaps is one `searchsorted`. Small enough to be
+	handed to the worker processes of the batch jobs.
+	"""
+
+	def __init__(self, tokens: pd.DataFrame, keys: np.ndarray, prices: np.ndarray, assets: np.ndarray) -> None:
+		self.tokens = tokens
+		self.assets = assets
+		self._ids = {key: i for i, key in enumerate(zip(tokens['chain'], tokens['address']))}
+		# token_id << 32 | bucket, sorted, and the price of each
+		self._keys = keys
+		self._prices = prices
+
+	def __len__(self) -> int:
+		return len(self._keys)
+
+	def token_ids(self, projects: np.ndarray, addresses: np.ndarray) -> np.ndarray:
+		# id of the token of every row, -1 for the tokens the index never saw
+		codes, keys = _distinct_tokens(projects, addresses)
+		ids = np.array([self._ids.get(key, -1) for key in keys], dtype=np.int64)
+		return ids[codes]
+
+	def price_usd(self, token_ids: np.ndarray, timestamps: np.ndarray) -> np.ndarray:
+		"""
+		Price of every (token, unix timestamp) at the nearest bucket of that token, before or
+		after it, NaN when the token has no bucket within `MAX_PRICE_AGE`.
+		"""
+		token_ids = np.asarray(token_ids, dtype=np.int64)
+		buckets = np.asarray(timestamps, dtype=np.int64) // BUCKET_SECONDS
+		prices = np.full(len(token_ids), np.nan)
+		if len(self._keys) == 0 or len(token_ids) == 0:
+			return prices
+
+		after = np.searchsorted(self._keys, (token_ids << 32) | buckets)
+		best = np.zeros(len(token_ids), dtype=np.int64)
+		best_age = np.full(len(token_ids), np.iinfo(np.int64).max)
+		for candidate in (np.maximum(after - 1, 0), np.minimum(after, len(self._keys) - 1)):
+			keys = self._keys[candidate]
+			age = np.abs((keys & 0xFFFFFFFF) - buckets)
+			closer = (token_ids >= 0) & ((keys >> 32) == token_ids) & (age < best_age)
+			best = np.where(closer, candidate, best)
+			best_age = np.where(closer, age, best_age)
+
+		found = best_age <= MAX_PRICE_AGE // BUCKET_SECONDS
+		prices[found] = self._prices[best[found]]
+		return prices
+
+	def fill_usd(self, raw_df: pd.DataFrame, amount_in: np.ndarray, amount_out: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+		"""
+		`swaps_amountInUSD` and `swaps_amountOutUSD` with the missing ones (0 or NaN while the
+		amount isn't) filled: from the other side of the swap when that one is valued, as a swap
+		trades equal values, else from the amount times the price of the token. Values that can't
+		be filled are left as they were.
+		"""
+		usd_in = raw_df['swaps_amountInUSD'].to_numpy(dtype=np.float64)
+		usd_out = raw_df['swaps_amountOutUSD'].to_numpy(dtype=np.float64)
+		missing_in = ~(usd_in > 0) & (amount_in > 0)
+		missing_out = ~(usd_out > 0) & (amount_out > 0)
+		filled_in = np.where(missing_in & (usd_out > 0), usd_out, usd_in)
+		filled_out = np.where(missing_out & (usd_in > 0), usd_in, usd_out)
+
+		projects = raw_df['project'].to_numpy()
+		timestamps = raw_df['swaps_timestamp'].to_numpy(dtype=np.int64)
+		for filled, missing, side, amount in [(filled_in, missing_in & ~(usd_out > 0), 'In', amount_in), (filled_out, missing_out & ~(usd_in > 0), 'Out', amount_out)]:
+			rows = np.flatnonzero(missing)
+			if len(rows) == 0:
+				continue
+			token_ids = self.token_ids(projects[rows], raw_df[f'swaps_token{side}_id'].to_numpy()[rows])
+			usd = amount[rows] * self.price_usd(token_ids, timestamps[rows])
+			priced = ~np.isnan(usd)
+			filled[rows[priced]] = usd[priced]
+		return filled_in, filled_out
+
+	def assets_of(self, projects: np.ndarray, addresses: np.ndarray, symbols: np.ndarray) -> np.ndarray:
+		# asset of the token of every row, the canonical symbol for tokens the index never saw
+		token_ids = self.token_ids(projects, addresses)
+		assets = canonical_symbols(symbols)
+		known = token_ids >= 0
+		assets[known] = self.assets[token_ids[known]]
+		return assets
+
+
+def price_columns(raw_df: pd.DataFrame, amount_in: np.ndarray, amount_out: np.ndarray, prices: Optional[PriceTable] = None) -> Tuple[np.ndarray, ...]:
+	"""
+	amount_in_usd, amount_out_usd, token_asset_in and token_asset_out of the clean swaps. Without
+	`prices` the usd values are the ones of the subgraph and the assets the canonical symbols.
+	"""
+	if prices is None:
+		return (
+			raw_df['swaps_amountInUSD'].to_numpy(dtype=np.float64),
+			raw_df['swaps_amountOutUSD'].to_numpy(dtype=np.float64),
+			canonical_symbols(raw_df['swaps_tokenIn_symbol'].to_numpy()),
+			canonical_symbols(raw_df['swaps_tokenOut_symbol'].to_numpy()),
+		)
+
+	amount_in_usd, amount_out_usd = prices.fill_usd(raw_df, amount_in, amount_out)
+	projects = raw_df['project'].to_numpy()
+	return (
+		amount_in_usd,
+		amount_out_usd,
+		prices.assets_of(projects, raw_df['swaps_tokenIn_id'].to_numpy(), raw_df['swaps_tokenIn_symbol'].to_numpy()),
+		prices.assets_of(projects, raw_df['swaps_tokenOut_id'].to_numpy(), raw_df['swaps_tokenOut_symbol'].to_numpy()),
+	)
+
+
+class TokenIndex():
+	"""
+	Every token of the fetched swaps, keyed by (chain, address), with its usd price per hour: the
+	volume weighted average of the swaps that valued it, summed per bucket so that later swaps
+	are merged into their buckets without going back to the earlier ones. Swaps already counted
+	(cached swaps loaded again, the overlap of a sync) are recognized by a hash of their id, so
+	updating twice with the same swaps changes nothing. At most `max_seen` hashes are kept: past
+	that the ones of the oldest swaps are dropped, and swaps older than those are ignored.
+
+	Tokens get the asset of their symbol (`canonical_symbols`), unless their price is more than
+	`MAX_ASSET_RATIO` away from the token with most volume of that symbol: then they are an asset
+	of their own, named after their chain and address.
+
+	With a `cache_dir`, the index is kept there as parquet files and grows across runs. Readers
+	use `table`, a snapshot replaced after every update. Fetches hand their swaps to
+	`update_in_background`, so the index is updated (and saved) once per fetch on a thread of its own.
+	"""
+
+	def __init__(self, cache_dir: Optional[str] = None, max_seen: int = 5_000_000) -> None:
+		self.cache_dir = cache_dir
+		self.max_seen = max_seen
+		self._lock = threading.Lock()
+		# a single worker, so background updates run one at a time, in order
+		self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="token_index")
+		self._tokens = pd.DataFrame({
+			'chain': pd.Series(dtype=object), 'address': pd.Series(dtype=object), 'symbol': pd.Series(dtype=object),
+			'n_swaps': pd.Series(dtype=np.int64), 'amount': pd.Series(dtype=np.float64), 'amount_usd': pd.Series(dtype=np.float64),
+		})
+		# price buckets sorted by token_id << 32 | bucket, with the amounts summed in each
+		self._keys = np.array([], dtype=np.int64)
+		self._amounts = np.array([], dtype=np.float64)
+		self._amounts_usd = np.array([], dtype=np.float64)
+		# sorted hashes of the swaps already counted, the bucket of each, and the bucket before which swaps are ignored
+		self._seen = np.array([], dtype=np.uint64)
+		self._seen_buckets = np.array([], dtype=np.int64)
+		self._horizon = 0
+		if cache_dir is not None:
+			os.makedirs(cache_dir, exist_ok=True)
+			if all(os.path.exists(self._path(name)) for name in ("tokens.parquet", "prices.parquet", "seen.npz")):
+				self._tokens = pd.read_parquet(self._path("tokens.parquet"))
+				prices = pd.read_parquet(self._path("prices.parquet"))
+				self._keys = (prices['token_id'].to_numpy(dtype=np.int64) << 32) | prices['bucket'].to_numpy(dtype=np.int64)
+				self._amounts = prices['amount'].to_numpy(dtype=np.float64)
+				self._amounts_usd = prices['amount_usd'].to_numpy(dtype=np.float64)
+				with np.load(self._path("seen.npz")) as seen:
+					self._seen, self._seen_buckets, self._horizon = seen['hashes'], seen['buckets'], int(seen['horizon'])
+		self._ids: Dict[Tuple[str, str], int] = {key: i for i, key in enumerate(zip(self._tokens['chain'], self._tokens['address']))}
+		self.table = self._build_table()
+
+	def _path(self, name: str) -> str:
+		return os.path.join(self.cache_dir, name)
+
+	def _save(self) -> None:
+		# the seen hashes last: a kill in between counts some swaps twice, it never loses one
+		prices = pd.DataFrame({'token_id': self._keys >> 32, 'bucket': self._keys & 0xFFFFFFFF, 'amount': self._amounts, 'amount_usd': self._amounts_usd})
+		for name, write in [
+			("tokens.parquet", lambda path: self._tokens.to_parquet(path, index=False)),
+			("prices.parquet", lambda path: prices.to_parquet(path, index=False)),
+			("seen.npz", lambda path: np.savez(path, hashes=self._seen, buckets=self._seen_buckets, horizon=self._horizon)),
+		]:
+			tmp_path = f"{self._path(name)}.{threading.get_ident()}.tmp"
+			with open(tmp_path, "wb") as f:
+				write(f)
+			os.replace(tmp_path, self._path(name))
+
+	def _build_table(self) -> PriceTable:
+		tokens = self._tokens
+		assets = canonical_symbols(tokens['symbol'].to_numpy())
+		price = masked_divide(tokens['amount_usd'].to_numpy(), tokens['amount'].to_numpy())
+
+		# price of the token with most volume of each asset, the others should be about the same
+		priced = tokens['amount_usd'].to_numpy() > 0
+		main = pd.DataFrame({'asset': assets[priced], 'amount_usd': tokens['amount_usd'].to_numpy()[priced], 'price': price[priced]})
+		reference = main.sort_values('amount_usd').groupby('asset')['price'].last()
+		ratio = masked_divide(price, pd.Series(assets).map(reference).fillna(0).to_numpy())
+		apart = priced & ((ratio > MAX_ASSET_RATIO) | (ratio < 1 / MAX_ASSET_RATIO))
+		for i in np.flatnonzero(apart):
+			assets[i] = f"{tokens['symbol'].iat[i]} ({tokens['chain'].iat[i]} {tokens['address'].iat[i][:10]})"
+
+		return PriceTable(tokens[['chain', 'address', 'symbol']], self._keys, masked_divide(self._amounts_usd, self._amounts), assets)
+
+	def _token_ids(self, raw_df: pd.DataFrame, side: str) -> np.ndarray:
+		# under the lock: id of the token of every row, new tokens are appended to the index
+		codes, keys = _distinct_tokens(raw_df['project'].to_numpy(), raw_df[f'swaps_token{side}_id'].to_numpy())
+		symbols = raw_df[f'swaps_token{side}_symbol'].to_numpy()
+		_, first_rows = np.unique(codes, return_index=True)
+
+		ids, new_tokens = [], []
+		for key, first_row in zip(keys, first_rows):
+			if key is not None and key not in self._ids:
+				self._ids[key] = len(self._ids)
+				new_tokens.append((*key, symbols[first_row]))
+			ids.append(self._ids.get(key, -1))
+
+		if new_tokens:
+			chains, addresses, new_symbols = zip(*new_tokens)
+			self._tokens = pd.concat([self._tokens, pd.DataFrame({
+				'chain': chains, 'address': addresses, 'symbol': new_symbols,
+				'n_swaps': 0, 'amount': 0.0, 'amount_usd': 0.0,
+			})], ignore_index=True)
+		return np.array(ids, dtype=np.int64)[codes]
+
+	def _merge_prices(self, keys: np.ndarray, amounts: np.ndarray, amounts_usd: np.ndarray) -> None:
+		# under the lock: sums the priced swaps per bucket and merges those buckets into the sorted ones,
+		# into new arrays as the current ones belong to `table`
+		keys, inverse = np.unique(keys, return_inverse=True)
+		amounts = np.bincount(inverse, weights=amounts, minlength=len(keys))
+		amounts_usd = np.bincount(inverse, weights=amounts_usd, minlength=len(keys))
+
+		positions = np.searchsorted(self._keys, keys)
+		existing = positions < len(self._keys)
+		existing[existing] = self._keys[positions[existing]] == keys[existing]
+		new = ~existing
+		self._keys = np.insert(self._keys, positions[new], keys[new])
+		self._amounts = np.insert(self._amounts, positions[new], amounts[new])
+		self._amounts_usd = np.insert(self._amounts_usd, positions[new], amounts_usd[new])
+		rows = np.searchsorted(self._keys, keys[existing])
+		self._amounts[rows] += amounts[existing]
+		self._amounts_usd[rows] += amounts_usd[existing]
+
+	def _remember(self, hashes: np.ndarray, buckets: np.ndarray) -> None:
+		# under the lock: adds the hashes of the swaps just counted, past `max_seen` forgets the oldest swaps
+		positions = np.searchsorted(self._seen, hashes)
+		self._seen = np.insert(self._seen, positions, hashes)
+		self._seen_buckets = np.insert(self._seen_buckets, positions, buckets)
+		if len(self._seen) > self.max_seen:
+			# down to 90% of the cap, so this doesn't run on every update; the whole horizon bucket goes
+			n_dropped = len(self._seen) - int(self.max_seen * 0.9)
+			self._horizon = int(np.partition(self._seen_buckets, n_dropped)[n_dropped]) + 1
+			kept = self._seen_buckets >= self._horizon
+			self._seen, self._seen_buckets = self._seen[kept], self._seen_buckets[kept]
+
+	@instruments.traced("token_index_update")
+	def update(self, raw_df: pd.DataFrame) -> int:
+		"""Adds the tokens and prices of the swaps of a raw df (with its `project` column), returns the number of swaps not seen before."""
+		if len(raw_df) == 0:
+			return 0
+		# swap ids are unique per dex, factorizing them before hashing would only cost time
+		project_codes, projects = pd.factorize(raw_df['project'].to_numpy())
+		hashes = pd.util.hash_array(raw_df['swaps_id'].to_numpy(dtype=object), categorize=False) ^ pd.util.hash_array(np.asarray(projects, dtype=object))[project_codes]
+		buckets = raw_df['swaps_timestamp'].to_numpy(dtype=np.int64) // BUCKET_SECONDS
+
+		with self._lock:
+			hashes, first_rows = np.unique(hashes, return_index=True)
+			# swaps older than the forgotten ones may have been counted already
+			recent = buckets[first_rows] >= self._horizon
+			hashes, first_rows = hashes[recent], first_rows[recent]
+			if len(self._seen) > 0:
+				unseen = self._seen[np.minimum(np.searchsorted(self._seen, hashes), len(self._seen) - 1)] != hashes
+				hashes, first_rows = hashes[unseen], first_rows[unseen]
+			if len(hashes) == 0:
+				return 0
+			order = np.argsort(first_rows)
+			hashes, first_rows = hashes[order], first_rows[order]
+			raw_df, buckets = raw_df.iloc[first_rows], buckets[first_rows]
+
+			amounts = {side: scale_raw_amounts(raw_df[f'swaps_amount{side}'], raw_df[f'swaps_token{side}_decimals']) for side in ('In', 'Out')}
+			usds = {side: raw_df[f'swaps_amount{side}USD'].to_numpy(dtype=np.float64) for side in ('In', 'Out')}
+			# both sides valued alike, or only one of them valued
+			sides_ratio = masked_divide(np.maximum(usds['In'], usds['Out']), np.minimum(usds['In'], usds['Out']))
+			consistent = (sides_ratio <= MAX_SIDES_RATIO) | ~((usds['In'] > 0) & (usds['Out'] > 0))
+
+			new_keys, new_amounts, new_amounts_usd = [], [], []
+			for side in ('In', 'Out'):
+				token_ids = self._token_ids(raw_df, side)
+				amount, usd = amounts[side], usds[side]
+				priced = (token_ids >= 0) & (amount > 0) & (usd > 0) & np.isfinite(amount) & np.isfinite(usd) & consistent
+				new_keys.append((token_ids[priced] << 32) | buckets[priced])
+				new_amounts.append(amount[priced])
+				new_amounts_usd.append(usd[priced])
+
+				n_tokens = len(self._tokens)
+				counted = token_ids >= 0
+				self._tokens['n_swaps'] += np.bincount(token_ids[counted], minlength=n_tokens)
+				self._tokens['amount'] += np.bincount(token_ids[priced], weights=amount[priced], minlength=n_tokens)
+				self._tokens['amount_usd'] += np.bincount(token_ids[priced], weights=usd[priced], minlength=n_tokens)
+
+			self._merge_prices(np.concatenate(new_keys), np.concatenate(new_amounts), np.concatenate(new_amounts_usd))
+			self._remember(np.sort(hashes), buckets[np.argsort(hashes)])
+			self.table = self._build_table()
+			if self.cache_dir is not None:
+				self._save()
+			return len(raw_df)
+
+	def update_in_background(self, raw_dfs: List[pd.DataFrame]) -> Future:
+		"""One `update` with the raw dfs of a whole fetch, run after the updates submitted before it."""
+		future = self._executor.submit(lambda: self.update(pd.concat(raw_dfs, ignore_index=True)) if raw_dfs else 0)
+		future.add_done_callback(self._log_failure)
+		return future
+
+	@staticmethod
+	def _log_failure(future: Future) -> None:
+		if not future.cancelled() and future.exception() is not None:
+			logger.warning("Error updating the token index: %s", future.exception(), extra={"fields": {"error": repr(future.exception())}})
@@ -0,0 +1,79 @@
+"""
+Time of the `Home.py` aggregations: the per-section groupbys over the swaps, as every
+rerun used to do, against building the `SwapsCube` once and serving the rollups from it.
+
+    python benchmarks/bench_aggregates.py --rows 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_clean_df import make_raw_df
+from utils.dex_subgraphs_wrapper import DexSubgraphsWrapper
+from utils.swaps_aggregates import SwapsCube
+
+pd.options.mode.chained_assignment = None
+
+
+def movements(swaps_df: pd.DataFrame, sign: int) -> pd.DataFrame:
+	outflows = swaps_df[['swapper', 'dex', 'swap_datetime', 'token_symbol_in', 'amount_in_usd', 'pool_name']]
+	outflows['amount_in_usd'] = sign * outflows['amount_in_usd']
+	outflows.columns = ['swapper', 'dex', 'swap_datetime', 'token_symbol', 'amount_usd', 'pool_name']
+	inflows = swaps_df[['swapper', 'dex', 'swap_datetime', 'token_symbol_out', 'amount_out_usd', 'pool_name']]
+	inflows.columns = ['swapper', 'dex', 'swap_datetime', 'token_symbol', 'amount_usd', 'pool_name']
+	return pd.concat([outflows, inflows])
+
+
+def legacy_aggregates(swaps_df: pd.DataFrame) -> None:
+	swaps_df.groupby(['token_symbol_in', 'token_symbol_out'], observed=True)['amount_in_usd'].sum().sort_values(ascending=False).reset_index()
+	swaps_df.groupby(['dex', 'pool_name'], observed=True)['amount_in_usd'].sum().reset_index()
+	for by in ['dex', 'pool_name']:
+		swaps_df.set_index('swap_datetime').groupby([pd.Grouper(freq='7d'), by], observed=True)['amount_in_usd'].sum().reset_index()
+	for sign, by in [(-1, ['token_symbol']), (1, ['token_symbol', 'dex'])]:
+		token_movements = movements(swaps_df, sign)
+		token_movements.groupby(by, observed=True)['amount_usd'].sum().reset_index()
+		token_movements.set_index('swap_datetime').groupby([pd.Grouper(freq='7d'), 'token_symbol'], observed=True)['amount_usd'].sum().reset_index()
+
+
+def cube_aggregates(swaps_cube: SwapsCube) -> None:
+	swaps_cube.token_pairs('usd volume')
+	swaps_cube.dex_pools('usd volume')
+	for by in ['dex', 'pool_name']:
+		swaps_cube.weekly_volume(by)
+	for kind, by in [('net', ('token_asset',)), ('abs', ('token_asset', 'dex'))]:
+		swaps_cube.token_volume(kind, by)
+		swaps_cube.weekly_token_volume(kind)
+
+
+def timed(f, *args):
+	start = time.perf_counter()
+	result = f(*args)
+	return result, time.perf_counter() - start
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--rows", type=int, default=1_000_000)
+	args = parser.parse_args()
+
+	swaps_df = DexSubgraphsWrapper.build_clean_df(make_raw_df(args.rows))
+
+	_, legacy = timed(legacy_aggregates, swaps_df)
+	swaps_cube, build = timed(SwapsCube.from_swaps_df, swaps_df)
+	_, cold = timed(cube_aggregates, swaps_cube)
+	_, warm = timed(cube_aggregates, swaps_cube)
+
+	print(f"{'groupbys over the swaps, every rerun':>40}: {legacy * 1000:10.1f} ms")
+	print(f"{'cube build, once per dataset':>40}: {build * 1000:10.1f} ms ({len(swaps_cube.cells)} cells, {len(swaps_cube.movements)} movements)")
+	print(f"{'rollups from the cube, first rerun':>40}: {cold * 1000:10.1f} ms")
+	print(f"{'rollups from the cube, next reruns':>40}: {warm * 1000:10.3f} ms")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,69 @@
+"""
+Cohorts per second of `run_batch` against the mock subgraph, for a growing number of worker
+processes, and the speedup over a single worker. The mock runs in its own process, so it
+doesn't compete with the client for the GIL.
+
+    python benchmarks/bench_batch.py --cohorts 32 --wallets-per-cohort 20 --swaps-per-wallet 500
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_subgraph import LatencyProfile, MockSubgraph, MockSubgraphServer, make_swaps, make_wallets
+from utils.batch_jobs import run_batch
+from utils.dex_subgraphs_wrapper import DexSubgraphsWrapper
+
+
+def serve(wallets, swaps_per_wallet: int, n_projects: int, latency_ms: float, conn) -> None:
+	subgraphs = {
+		project: MockSubgraph(make_swaps(wallets, swaps_per_wallet, seed=i) if i < n_projects else [])
+		for i, project in enumerate(DexSubgraphsWrapper.projects)
+	}
+	with MockSubgraphServer(subgraphs, LatencyProfile(base_ms=latency_ms)) as server:
+		conn.send(server.base_url)
+		conn.recv()
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--cohorts", type=int, default=32)
+	parser.add_argument("--wallets-per-cohort", type=int, default=20)
+	parser.add_argument("--swaps-per-wallet", type=int, default=500)
+	parser.add_argument("--projects", type=int, default=3, help="dexes with swaps of the wallets")
+	parser.add_argument("--latency-ms", type=float, default=20.0)
+	parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count()}))
+	args = parser.parse_args()
+
+	wallets = make_wallets(args.cohorts * args.wallets_per_cohort)
+	cohorts = {f"cohort_{i}": wallets[i * args.wallets_per_cohort:(i + 1) * args.wallets_per_cohort] for i in range(args.cohorts)}
+
+	ctx = multiprocessing.get_context("spawn")
+	parent_conn, child_conn = ctx.Pipe()
+	server = ctx.Process(target=serve, args=(wallets, args.swaps_per_wallet, args.projects, args.latency_ms, child_conn), daemon=True)
+	server.start()
+	try:
+		base_url = parent_conn.recv()
+		print(f"{os.cpu_count()} cores, {args.cohorts} cohorts of {args.wallets_per_cohort * args.swaps_per_wallet * args.projects} swaps")
+		single = None
+		for n_workers in args.workers:
+			wrapper = DexSubgraphsWrapper(base_url=base_url)
+			with tempfile.TemporaryDirectory() as out_dir:
+				start = time.perf_counter()
+				results = run_batch(cohorts, out_dir, wrapper, n_workers=n_workers)
+				elapsed = time.perf_counter() - start
+			assert (results['status'] == 'ok').all(), results
+			single = elapsed if single is None else single
+			print(f"{n_workers:>3} workers: {elapsed:7.2f}s, {args.cohorts / elapsed:7.2f} cohorts/s, {single / elapsed:5.2f}x")
+	finally:
+		parent_conn.send("stop")
+		server.join(timeout=10)
+
+
+if __name__ == "__main__":
+	main()
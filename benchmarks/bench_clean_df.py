@@ -0,0 +1,128 @@
+"""
+Speed and memory of `DexSubgraphsWrapper.build_clean_df` against the row-wise version it replaced.
+
+    python benchmarks/bench_clean_df.py --rows 1000000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from utils.dex_subgraphs_wrapper import DexSubgraphsWrapper
+from utils.swaps_pagination import RAW_COLUMNS
+
+pd.options.mode.chained_assignment = None
+
+
+def legacy_build_clean_df(raw_df: pd.DataFrame) -> pd.DataFrame:
+	clean_df = raw_df[['swaps_to']]
+	clean_df = clean_df.rename(columns={'swaps_to': 'swapper'})
+
+	clean_df['swap_datetime'] = pd.to_datetime(raw_df['swaps_timestamp'], unit='s')
+
+	clean_df['dex'] = raw_df['project']
+
+	clean_df['token_address_in'] = raw_df['swaps_tokenIn_id']
+	clean_df['token_symbol_in'] = raw_df['swaps_tokenIn_symbol']
+	clean_df['amount_in'] = raw_df['swaps_amountIn']/10**raw_df['swaps_tokenIn_decimals']
+	clean_df['amount_in_usd'] = raw_df['swaps_amountInUSD']
+	clean_df['token_in_approx_price_usd'] = clean_df.apply(lambda x: x['amount_in_usd']/x['amount_in'] if x['amount_in']!=0 else 0, axis=1)
+
+	clean_df['token_address_out'] = raw_df['swaps_tokenOut_id']
+	clean_df['token_symbol_out'] = raw_df['swaps_tokenOut_symbol']
+	clean_df['amount_out'] = raw_df['swaps_amountOut']/10**raw_df['swaps_tokenOut_decimals']
+	clean_df['amount_out_usd'] = raw_df['swaps_amountOutUSD']
+	clean_df['token_out_approx_price_usd'] = clean_df.apply(lambda x: x['amount_out_usd']/x['amount_out'] if x['amount_out']!=0 else 0, axis=1)
+
+	clean_df['conversion_rate_in_to_out'] = clean_df.apply(lambda x: x['amount_in']/x['amount_out'] if x['amount_out']!=0 else 0, axis=1)
+
+	clean_df['pool_address'] = raw_df['swaps_pool_id']
+	clean_df['pool_name'] = raw_df['swaps_pool_name']
+
+	clean_df['tx_hash'] = raw_df['swaps_hash']
+	clean_df['log_index'] = raw_df['swaps_logIndex']
+
+	return clean_df
+
+
+def make_raw_df(n_rows: int, seed: int = 0) -> pd.DataFrame:
+	rng = np.random.default_rng(seed)
+	n_tokens, n_pools, n_wallets = 500, 2_000, 1_000
+	token_ids = np.array([f"0x{i:040x}" for i in range(n_tokens)], dtype=object)
+	token_symbols = np.array([f"TKN{i}" for i in range(n_tokens)], dtype=object)
+	token_decimals = rng.choice([6, 8, 18], size=n_tokens)
+	pool_ids = np.array([f"0x{i:040x}" for i in range(n_tokens, n_tokens + n_pools)], dtype=object)
+	wallets = np.array([f"0x{i:040x}" for i in range(n_tokens + n_pools, n_tokens + n_pools + n_wallets)], dtype=object)
+	projects = np.array(DexSubgraphsWrapper.projects, dtype=object)
+
+	token_in = rng.integers(0, n_tokens, n_rows)
+	token_out = rng.integers(0, n_tokens, n_rows)
+	usd_in = rng.lognormal(6, 2, n_rows)
+	# whole token amounts times 10**decimals, 18-decimal ones overflow int64 like on chain
+	amount_in = [int(u * 10**6) * 10**(int(d) - 6) for u, d in zip(usd_in, token_decimals[token_in])]
+	amount_out = [int(u * 10**6) * 10**(int(d) - 6) for u, d in zip(usd_in * 0.99, token_decimals[token_out])]
+	amount_out[::97] = [0] * len(amount_out[::97])
+	pools = rng.integers(0, n_pools, n_rows)
+
+	raw_df = pd.DataFrame({
+		'swaps_timestamp': rng.integers(1_600_000_000, 1_700_000_000, n_rows),
+		'swaps_to': wallets[rng.integers(0, n_wallets, n_rows)],
+		'swaps_from': wallets[rng.integers(0, n_wallets, n_rows)],
+		'swaps_tokenIn_id': token_ids[token_in],
+		'swaps_tokenIn_symbol': token_symbols[token_in],
+		'swaps_tokenIn_decimals': token_decimals[token_in],
+		'swaps_amountIn': pd.Series(amount_in, dtype=object),
+		'swaps_amountInUSD': usd_in,
+		'swaps_tokenOut_id': token_ids[token_out],
+		'swaps_tokenOut_symbol': token_symbols[token_out],
+		'swaps_tokenOut_decimals': token_decimals[token_out],
+		'swaps_amountOut': pd.Series(amount_out, dtype=object),
+		'swaps_amountOutUSD': usd_in * 0.99,
+		'swaps_pool_id': pool_ids[pools],
+		'swaps_pool_name': np.array([f"POOL{i}" for i in range(n_pools)], dtype=object)[pools],
+		'swaps_pool_symbol': np.array([f"P{i}" for i in range(n_pools)], dtype=object)[pools],
+		'swaps_hash': np.array([f"0x{i:064x}" for i in range(n_rows)], dtype=object),
+		'swaps_logIndex': rng.integers(0, 300, n_rows),
+		'swaps_id': np.array([f"0x{i:064x}-0" for i in range(n_rows)], dtype=object),
+	}, columns=RAW_COLUMNS)
+	raw_df['project'] = projects[rng.integers(0, len(projects), n_rows)]
+	return raw_df
+
+
+def measure(build_clean_df, raw_df: pd.DataFrame):
+	tracemalloc.start()
+	start = time.perf_counter()
+	clean_df = build_clean_df(raw_df)
+	elapsed = time.perf_counter() - start
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return clean_df, elapsed, peak
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--rows", type=int, default=1_000_000)
+	args = parser.parse_args()
+
+	raw_df = make_raw_df(args.rows)
+
+	results = {}
+	for name, build_clean_df in [("row-wise apply", legacy_build_clean_df), ("vectorized", DexSubgraphsWrapper.build_clean_df)]:
+		clean_df, elapsed, peak = measure(build_clean_df, raw_df)
+		size = clean_df.memory_usage(deep=True).sum()
+		results[name] = clean_df
+		print(f"{name:>15}: {elapsed:8.2f}s, peak {peak / 2**20:8.1f} MiB, result {size / 2**20:8.1f} MiB")
+
+	legacy, vectorized = results["row-wise apply"], results["vectorized"]
+	for col in ['amount_in', 'amount_out', 'token_in_approx_price_usd', 'token_out_approx_price_usd', 'conversion_rate_in_to_out']:
+		assert np.allclose(legacy[col].astype(float), vectorized[col], rtol=1e-12), col
+
+
+if __name__ == "__main__":
+	main()
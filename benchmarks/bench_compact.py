@@ -0,0 +1,65 @@
+"""
+Memory of the clean swaps as the pandas frame of `build_clean_df` and as `CompactSwaps`,
+with the time and peak memory of building them from the raw swaps, and of converting the
+compact swaps back to pandas for the charts.
+
+    python benchmarks/bench_compact.py --rows 1000000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_clean_df import make_raw_df
+from utils.compact_swaps import CompactSwaps
+from utils.dex_subgraphs_wrapper import DexSubgraphsWrapper
+from utils.swaps_aggregates import SWAPS_COLUMNS
+
+# what the default scatter plot of `Home.py` converts
+SCATTER_COLUMNS = [
+	'swap_datetime', 'dex', 'token_symbol_in', 'amount_in', 'amount_in_usd', 'token_in_approx_price_usd',
+	'token_symbol_out', 'amount_out', 'amount_out_usd', 'token_out_approx_price_usd', 'conversion_rate_in_to_out', 'pool_name',
+]
+
+
+def measure(f, *args):
+	# timed without tracemalloc, which slows down allocations a lot, then run again for the peak
+	start = time.perf_counter()
+	result = f(*args)
+	elapsed = time.perf_counter() - start
+	tracemalloc.start()
+	f(*args)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return result, elapsed, peak
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--rows", type=int, default=1_000_000)
+	args = parser.parse_args()
+
+	raw_df = make_raw_df(args.rows)
+
+	clean_df, elapsed, peak = measure(DexSubgraphsWrapper.build_clean_df, raw_df)
+	size = clean_df.memory_usage(deep=True).sum()
+	print(f"{'build_clean_df':>32}: {elapsed:8.2f}s, peak {peak / 2**20:8.1f} MiB, result {size / 2**20:8.1f} MiB")
+
+	compact, elapsed, peak = measure(CompactSwaps.from_raw_df, raw_df)
+	print(f"{'CompactSwaps.from_raw_df':>32}: {elapsed:8.2f}s, peak {peak / 2**20:8.1f} MiB, result {compact.nbytes / 2**20:8.1f} MiB")
+	print(f"{'':>32}  {size / compact.nbytes:.1f}x smaller")
+
+	for name, columns in [("to_pandas, cube columns", SWAPS_COLUMNS), ("to_pandas, scatter columns", SCATTER_COLUMNS), ("to_pandas, every column", None)]:
+		df, elapsed, peak = measure(compact.to_pandas, columns)
+		print(f"{name:>32}: {elapsed:8.2f}s, peak {peak / 2**20:8.1f} MiB, result {df.memory_usage(deep=True).sum() / 2**20:8.1f} MiB")
+
+	assert df['tx_hash'].equals(clean_df['tx_hash'])
+	assert df['swapper'].astype(object).equals(clean_df['swapper'])
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,43 @@
+"""
+Time, peak memory and size of exporting the clean swaps: the old `to_json()` and `to_csv()`
+byte strings of the "raw data" section of `Home.py`, against streaming every format of
+`swaps_export` from the compact swaps.
+
+    python benchmarks/bench_export.py --rows 1000000
+"""
+import argparse
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_clean_df import make_raw_df
+from bench_compact import measure
+from utils.compact_swaps import CompactSwaps
+from utils.swaps_export import EXPORT_FORMATS, export_swaps
+
+
+def legacy_export(swaps: CompactSwaps) -> int:
+	df = swaps.to_pandas().assign(dummy=999)
+	return len(df.to_json().encode('utf-8')) + len(df.to_csv().encode('utf-8'))
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--rows", type=int, default=1_000_000)
+	args = parser.parse_args()
+
+	swaps = CompactSwaps.from_raw_df(make_raw_df(args.rows))
+	print(f"{args.rows} swaps, {swaps.nbytes / 2**20:.1f} MiB compact")
+
+	n_bytes, elapsed, peak = measure(legacy_export, swaps)
+	print(f"{'to_json + to_csv':>20}: {elapsed:8.2f}s, peak {peak / 2**20:8.1f} MiB, {n_bytes / 2**20:8.1f} MiB")
+	for fmt in EXPORT_FORMATS:
+		n_bytes, elapsed, peak = measure(lambda: export_swaps(swaps, io.BytesIO(), fmt))
+		print(f"{fmt:>20}: {elapsed:8.2f}s, peak {peak / 2**20:8.1f} MiB, {n_bytes / 2**20:8.1f} MiB")
+
+
+if __name__ == "__main__":
+	main()
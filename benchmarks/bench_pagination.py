@@ -0,0 +1,54 @@
+"""
+Rows/second of the keyset pagination engine against the local mock subgraph.
+
+    python benchmarks/bench_pagination.py --swaps 50000 --latency-ms 50
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_subgraph import LatencyProfile, MockSubgraph, MockSubgraphServer, make_swaps, make_wallets
+from utils.swaps_pagination import SwapsPaginator, make_session
+
+
+def run(url: str, wallets, max_shards: int, page_size: int, max_rows=None):
+	paginator = SwapsPaginator(url, {"to_in": wallets}, page_size=page_size, max_shards=max_shards, session=make_session())
+	start = time.perf_counter()
+	df = paginator.fetch_df(max_rows=max_rows)
+	elapsed = time.perf_counter() - start
+	return len(df), df['swaps_id'].nunique(), elapsed
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--swaps", type=int, default=50_000, help="swaps of the benchmarked wallet")
+	parser.add_argument("--latency-ms", type=float, default=50.0, help="simulated server latency per request")
+	parser.add_argument("--page-size", type=int, default=1_000)
+	parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+	args = parser.parse_args()
+
+	wallets = make_wallets(1)
+	subgraph = MockSubgraph(make_swaps(wallets, args.swaps))
+
+	with MockSubgraphServer({"bench": subgraph}, LatencyProfile(base_ms=args.latency_ms)) as server:
+		url = server.url("bench")
+
+		n_rows, _, elapsed = run(url, wallets, 1, args.page_size, max_rows=10_000)
+		print(f"{'capped at 10k (old behaviour)':>32}: {n_rows:>8} rows in {elapsed:6.2f}s -> {n_rows / elapsed:>10,.0f} rows/s")
+
+		for n_shards in args.shards:
+			requests_before = server.n_requests
+			n_rows, n_unique, elapsed = run(url, wallets, n_shards, args.page_size)
+			assert n_rows == n_unique == args.swaps, (n_rows, n_unique, args.swaps)
+			print(
+				f"{f'full history, {n_shards} shard(s)':>32}: {n_rows:>8} rows in {elapsed:6.2f}s -> {n_rows / elapsed:>10,.0f} rows/s"
+				f" ({server.n_requests - requests_before} requests)"
+			)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,71 @@
+"""
+Throughput of a 1,000-wallet cohort for different wallet chunk sizes and chunks per
+aliased document, against the local mock subgraph.
+
+    python benchmarks/bench_query_planner.py --wallets 1000 --chunk-sizes 25 100 250 1000 --chunks-per-document 1 4 10
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_subgraph import LatencyProfile, MockSubgraph, MockSubgraphServer, make_swaps, make_wallets
+from utils.async_fetch import AsyncSubgraphClient, AsyncSwapsPaginator, metrics_to_df
+from utils.query_planner import QueryPlanner, fetch_planned_swaps_df
+
+
+async def run(url: str, wallets, chunk_size: int, chunks_per_document: int, max_concurrency: int):
+	planner = QueryPlanner(wallet_chunk_size=chunk_size, max_chunks_per_document=chunks_per_document, max_chunk_size=len(wallets), adaptive=False)
+	plan = planner.plan("bench", wallets)
+	where = {"to_in": wallets}
+
+	async with AsyncSubgraphClient(max_concurrency=max_concurrency, max_concurrency_per_host=max_concurrency) as client:
+		start = time.perf_counter()
+		if len(plan.chunks) == 1:
+			df = await AsyncSwapsPaginator(client, url, where).fetch_df()
+		else:
+			df = await fetch_planned_swaps_df(client, url, where, plan)
+		elapsed = time.perf_counter() - start
+
+	return df, elapsed, metrics_to_df(client.metrics)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--wallets", type=int, default=1_000)
+	parser.add_argument("--swaps-per-wallet", type=int, default=20)
+	parser.add_argument("--latency-ms", type=float, default=80.0, help="simulated latency of every request")
+	parser.add_argument("--per-wallet-ms", type=float, default=0.5, help="simulated cost of every wallet in a `to_in` filter")
+	parser.add_argument("--per-row-ms", type=float, default=0.05, help="simulated cost of every returned row")
+	parser.add_argument("--max-concurrency", type=int, default=16)
+	parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[25, 50, 100, 250, 1_000])
+	parser.add_argument("--chunks-per-document", type=int, nargs="+", default=[1, 2, 5, 10])
+	args = parser.parse_args()
+
+	wallets = make_wallets(args.wallets)
+	subgraph = MockSubgraph(make_swaps(wallets, args.swaps_per_wallet))
+	latency = LatencyProfile(base_ms=args.latency_ms, per_filter_value_ms=args.per_wallet_ms, per_row_ms=args.per_row_ms)
+	n_swaps = len(subgraph.swaps)
+
+	print(f"{'chunk size':>10} {'per doc':>7} {'requests':>8} {'rows/s':>10} {'MiB':>7} {'p50 ms':>8} {'p95 ms':>8} {'total s':>8}")
+	with MockSubgraphServer({"bench": subgraph}, latency) as server:
+		url = server.url("bench")
+		for chunk_size in args.chunk_sizes:
+			for chunks_per_document in args.chunks_per_document:
+				if chunk_size >= args.wallets and chunks_per_document > 1:
+					continue
+				df, elapsed, metrics = asyncio.run(run(url, wallets, chunk_size, chunks_per_document, args.max_concurrency))
+				assert len(df) == df['swaps_id'].nunique() == n_swaps, (len(df), n_swaps)
+				print(
+					f"{chunk_size:>10} {chunks_per_document:>7} {len(metrics):>8} {len(df) / elapsed:>10,.0f}"
+					f" {metrics['n_bytes'].sum() / 2**20:>7.1f} {metrics['latency_s'].quantile(0.5) * 1000:>8.0f}"
+					f" {metrics['latency_s'].quantile(0.95) * 1000:>8.0f} {elapsed:>8.2f}"
+				)
+
+
+if __name__ == "__main__":
+	main()
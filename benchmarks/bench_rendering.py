@@ -0,0 +1,55 @@
+"""
+Size of the figure sent to the browser and time to build it for the default scatter plot of
+`Home.py` (x swap_datetime, y amount_out_usd, color pool_name, box plots, 12 hover columns),
+drawn with every swap by `px.scatter` against `scatter_figure` (WebGL, downsampled, capped
+colors, swap id hover). The old figure gets too slow to build past a few 10,000 swaps, so it
+is only measured up to `--legacy-max-rows`.
+
+    python benchmarks/bench_rendering.py --rows 10000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import plotly.express as px
+
+from bench_clean_df import make_raw_df
+from bench_compact import SCATTER_COLUMNS
+from utils.chart_rendering import MAX_SCATTER_POINTS, scatter_figure
+from utils.compact_swaps import CompactSwaps
+
+
+def measure(build_figure):
+	# the json is what `st.plotly_chart` sends
+	start = time.perf_counter()
+	fig = build_figure()
+	n_bytes = len(fig.to_json())
+	return time.perf_counter() - start, n_bytes, {trace.type for trace in fig.data}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+	parser.add_argument("--max-points", type=int, default=MAX_SCATTER_POINTS)
+	parser.add_argument("--legacy-max-rows", type=int, default=50_000)
+	args = parser.parse_args()
+
+	for n_rows in args.rows:
+		swaps_df = CompactSwaps.from_raw_df(make_raw_df(n_rows)).to_pandas(SCATTER_COLUMNS).assign(dummy=999)
+		kwargs = dict(x='swap_datetime', y='amount_out_usd', color='pool_name', size='dummy', height=600, opacity=0.5, size_max=10)
+		print(f"{n_rows} swaps, {swaps_df['pool_name'].nunique()} pools")
+
+		if n_rows <= args.legacy_max_rows:
+			elapsed, n_bytes, types = measure(lambda: px.scatter(swaps_df, marginal_y='box', hover_data=SCATTER_COLUMNS, **kwargs))
+			print(f"{'px.scatter':>20}: {elapsed:8.2f}s, {n_bytes / 2**20:8.1f} MiB, {sorted(types)}")
+
+		elapsed, n_bytes, types = measure(lambda: scatter_figure(swaps_df, marginal_box=True, hover_data=SCATTER_COLUMNS, max_points=args.max_points, **kwargs)[0])
+		print(f"{'scatter_figure':>20}: {elapsed:8.2f}s, {n_bytes / 2**20:8.1f} MiB, {sorted(types)}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,80 @@
+"""
+Completeness and wall time of `DexSubgraphsWrapper.get_swaps_df` against a mock that injects
+HTTP errors, GraphQL errors, hangs and slow answers, with the fetch scheduler and without it
+(one attempt, no deadline but the client timeout, no hedging). Two dexes always fail, so the
+repeated fetches show their circuit breakers opening.
+
+    python benchmarks/bench_resilience.py --http-error-rate 0.05 --hang-rate 0.01 --slow-rate 0.05
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_subgraph import FaultProfile, LatencyProfile, MockSubgraph, MockSubgraphServer, make_swaps, make_wallets
+from utils.dex_subgraphs_wrapper import DexSubgraphsWrapper
+from utils.fetch_scheduler import FetchScheduler, HedgePolicy, RetryPolicy
+
+
+def run(server: MockSubgraphServer, wallets, scheduler: FetchScheduler, faults, n_fetches: int, expected_rows: int, **kwargs) -> None:
+	# schemas are loaded before the faults are switched on
+	server.faults = {}
+	wrapper = DexSubgraphsWrapper(base_url=server.base_url, scheduler=scheduler, lazy=False, **kwargs)
+	server.faults = faults
+	for i in range(n_fetches):
+		server.reset_counters()
+		start = time.perf_counter()
+		swaps_df = wrapper.get_swaps_df(wallets)
+		elapsed = time.perf_counter() - start
+
+		report = wrapper.fetch_report
+		counts = report['status'].value_counts().to_dict()
+		print(
+			f"  fetch {i + 1}: {len(swaps_df):>7}/{expected_rows} rows in {elapsed:6.2f}s, {server.n_requests} requests, {server.n_faults} faults,"
+			f" {int(report['n_retries'].sum())} retries, {int(report['n_hedges'].sum())} hedges, statuses {counts}"
+		)
+	print(report[report['status'] != 'ok'][['project', 'status', 'elapsed_s', 'error']].to_string(index=False, max_colwidth=60))
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--wallets", type=int, default=20)
+	parser.add_argument("--swaps-per-wallet", type=int, default=100)
+	parser.add_argument("--latency-ms", type=float, default=30.0)
+	parser.add_argument("--jitter-ms", type=float, default=30.0)
+	parser.add_argument("--http-error-rate", type=float, default=0.05)
+	parser.add_argument("--graphql-error-rate", type=float, default=0.02)
+	parser.add_argument("--hang-rate", type=float, default=0.01)
+	parser.add_argument("--hang-ms", type=float, default=30_000.0)
+	parser.add_argument("--slow-rate", type=float, default=0.05)
+	parser.add_argument("--slow-ms", type=float, default=1_500.0)
+	parser.add_argument("--fetches", type=int, default=3)
+	args = parser.parse_args()
+
+	wallets = make_wallets(args.wallets)
+	subgraph = MockSubgraph(make_swaps(wallets, args.swaps_per_wallet))
+	projects = DexSubgraphsWrapper.projects
+	broken = projects[:2]
+	expected_rows = len(subgraph.swaps) * (len(projects) - len(broken))
+
+	def make_faults(seed: int):
+		faults = {"*": FaultProfile(args.http_error_rate, args.graphql_error_rate, args.hang_rate, args.hang_ms, args.slow_rate, args.slow_ms, seed=seed)}
+		faults.update({project: FaultProfile(http_error_rate=1.0, seed=seed) for project in broken})
+		return faults
+
+	latency = LatencyProfile(base_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+	with MockSubgraphServer({project: subgraph for project in projects}, latency) as server:
+		print("without the scheduler (single attempt, 60s client timeout):")
+		no_retries = FetchScheduler(RetryPolicy(request_timeout=None, max_attempts=1), hedge=None, failure_threshold=10**9)
+		run(server, wallets, no_retries, make_faults(seed=0), 1, expected_rows, project_timeout=None)
+
+		print("with the scheduler (2s deadline, 4 attempts, hedging above p95, breaker after 2 failures):")
+		resilient = FetchScheduler(RetryPolicy(request_timeout=2.0, max_attempts=4), HedgePolicy(percentile=0.95, min_samples=20), failure_threshold=2, reset_timeout=600)
+		run(server, wallets, resilient, make_faults(seed=0), args.fetches, expected_rows)
+
+
+if __name__ == "__main__":
+	main()
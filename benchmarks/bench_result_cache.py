@@ -0,0 +1,72 @@
+"""
+Concurrent dashboard sessions asking for overlapping wallet lists at the same time: requests,
+bytes and wall time with every session fetching its own list (what the old per-list `@st.cache`
+did on misses) against the shared `SwapsResultCache`, then a second wave of sessions served
+from it.
+
+    python benchmarks/bench_result_cache.py --sessions 8 --wallets 40 --wallets-per-session 10
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_subgraph import LatencyProfile, MockSubgraph, MockSubgraphServer, make_swaps, make_wallets
+from utils.dex_subgraphs_wrapper import DexSubgraphsWrapper
+from utils.result_cache import SwapsResultCache
+
+
+def run_sessions(server: MockSubgraphServer, lists_of_wallets, fetch) -> None:
+	server.reset_counters()
+	threads = [threading.Thread(target=fetch, args=(wallets,)) for wallets in lists_of_wallets]
+	start = time.perf_counter()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	print(f"{time.perf_counter() - start:8.2f}s, {server.n_requests:>6} requests, {server.n_bytes / 2**20:8.1f} MiB")
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--sessions", type=int, default=8)
+	parser.add_argument("--wallets", type=int, default=40)
+	parser.add_argument("--wallets-per-session", type=int, default=10)
+	parser.add_argument("--swaps-per-wallet", type=int, default=200)
+	parser.add_argument("--projects", type=int, default=3, help="dexes with swaps of the wallets")
+	parser.add_argument("--latency-ms", type=float, default=50.0)
+	args = parser.parse_args()
+
+	wallets = make_wallets(args.wallets)
+	rng = random.Random(0)
+	lists_of_wallets = [rng.sample(wallets, args.wallets_per_session) for _ in range(args.sessions)]
+	subgraphs = {
+		project: MockSubgraph(make_swaps(wallets, args.swaps_per_wallet, seed=i) if i < args.projects else [])
+		for i, project in enumerate(DexSubgraphsWrapper.projects)
+	}
+
+	with MockSubgraphServer(subgraphs, LatencyProfile(base_ms=args.latency_ms)) as server:
+		wrapper = DexSubgraphsWrapper(base_url=server.base_url, lazy=False)
+
+		print(f"{args.sessions} sessions of {args.wallets_per_session} wallets out of {args.wallets}")
+		print(f"{'every session fetches':>28}: ", end="")
+		run_sessions(server, lists_of_wallets, lambda wallets: wrapper.get_compact_swaps(wallets))
+
+		result_cache = SwapsResultCache(wrapper)
+		print(f"{'SwapsResultCache, cold':>28}: ", end="")
+		run_sessions(server, lists_of_wallets, lambda wallets: list(result_cache.iter_swaps(wallets)))
+		print(f"{'':>28}  {result_cache.n_fetched} wallets fetched, {result_cache.n_waits} waited for, {result_cache.n_hits} hits, {result_cache.nbytes / 2**20:.1f} MiB cached")
+
+		# new lists from the same wallets, assembled without fetching
+		lists_of_wallets = [rng.sample(wallets, args.wallets_per_session) for _ in range(args.sessions)]
+		print(f"{'SwapsResultCache, warm':>28}: ", end="")
+		run_sessions(server, lists_of_wallets, lambda wallets: list(result_cache.iter_swaps(wallets)))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,59 @@
+"""
+Time-to-first-query of `DexSubgraphsWrapper`: eager schema loading (lazy=False) with an empty
+(cold) and a filled (warm) schema cache, against the default, which queries the swaps by url
+and never introspects a schema.
+
+    python benchmarks/bench_startup.py --introspection-ms 800 --latency-ms 80
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_subgraph import LatencyProfile, MockSubgraph, MockSubgraphServer, make_swaps, make_wallets
+from utils.dex_subgraphs_wrapper import DexSubgraphsWrapper
+
+
+def run(server: MockSubgraphServer, wallets, **kwargs):
+	server.reset_counters()
+	start = time.perf_counter()
+	wrapper = DexSubgraphsWrapper(base_url=server.base_url, **kwargs)
+	swaps_df = wrapper.get_swaps_df(wallets)
+	total = time.perf_counter() - start
+	first_query = server.first_query_at - start
+	return first_query, total, server.n_introspections, len(swaps_df)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--introspection-ms", type=float, default=800.0, help="extra simulated latency of an introspection request")
+	parser.add_argument("--latency-ms", type=float, default=80.0, help="simulated latency of every request")
+	parser.add_argument("--jitter-ms", type=float, default=400.0)
+	args = parser.parse_args()
+
+	wallets = make_wallets(1)
+	subgraph = MockSubgraph(make_swaps(wallets, 200))
+	latency = LatencyProfile(base_ms=args.latency_ms, jitter_ms=args.jitter_ms, introspection_ms=args.introspection_ms)
+	schema_dir = tempfile.mkdtemp()
+
+	try:
+		with MockSubgraphServer({project: subgraph for project in DexSubgraphsWrapper.projects}, latency) as server:
+			scenarios = [
+				("eager, cold schema cache", dict(lazy=False, schema_cache_dir=schema_dir)),
+				("eager, warm schema cache", dict(lazy=False, schema_cache_dir=schema_dir)),
+				("lazy, no schema", dict()),
+			]
+			for name, kwargs in scenarios:
+				first_query, total, n_introspections, n_rows = run(server, wallets, **kwargs)
+				print(f"{name:>24}: first query after {first_query:6.2f}s, all dexes after {total:6.2f}s ({n_introspections} introspections, {n_rows} rows)")
+	finally:
+		shutil.rmtree(schema_dir)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,53 @@
+"""
+Time to the first clean chunk of `DexSubgraphsWrapper.iter_swaps` against the time of the
+whole `get_swaps_df`, with every dex of the wrapper served by the local mock subgraph.
+
+    python benchmarks/bench_streaming.py --latency-ms 50 --jitter-ms 3000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_subgraph import LatencyProfile, MockSubgraph, MockSubgraphServer, make_swaps, make_wallets
+from utils.dex_subgraphs_wrapper import DexSubgraphsWrapper
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--wallets", type=int, default=10)
+	parser.add_argument("--swaps-per-wallet", type=int, default=100)
+	parser.add_argument("--latency-ms", type=float, default=50.0, help="simulated latency of every request")
+	parser.add_argument("--jitter-ms", type=float, default=3_000.0, help="random extra latency, the spread between fast and slow dexes")
+	args = parser.parse_args()
+
+	wallets = make_wallets(args.wallets)
+	subgraph = MockSubgraph(make_swaps(wallets, args.swaps_per_wallet))
+	latency = LatencyProfile(base_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+
+	with MockSubgraphServer({project: subgraph for project in DexSubgraphsWrapper.projects}, latency) as server:
+		wrapper = DexSubgraphsWrapper(base_url=server.base_url, lazy=False)
+
+		start = time.perf_counter()
+		swaps_df = wrapper.get_swaps_df(wallets)
+		blocking = time.perf_counter() - start
+
+		start = time.perf_counter()
+		chunks = []
+		for chunk in wrapper.iter_swaps(wallets):
+			if not chunks:
+				first_chunk = time.perf_counter() - start
+			chunks.append(chunk)
+		streamed = time.perf_counter() - start
+		assert len(wrapper.concat_swaps_dfs(chunks)) == len(swaps_df)
+
+	print(f"{'get_swaps_df':>30}: {len(swaps_df):>8} rows after {blocking:6.2f}s")
+	print(f"{'iter_swaps, first chunk':>30}: {len(chunks[0]):>8} rows after {first_chunk:6.2f}s")
+	print(f"{'iter_swaps, all chunks':>30}: {sum(map(len, chunks)):>8} rows after {streamed:6.2f}s ({len(chunks)} chunks)")
+
+
+if __name__ == "__main__":
+	main()
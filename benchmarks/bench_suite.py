@@ -0,0 +1,201 @@
+"""
+Repeatable end to end scenarios of `DexSubgraphsWrapper` against the local mock subgraph:
+schema loading (`_load_subgraphs`), fetching, `build_clean_df` and the `Home.py` aggregations,
+with their time, throughput, request latency percentiles and peak memory.
+
+The mock runs in its own process, so the timings and the tracemalloc peaks are the client's.
+Every scenario serves all the projects, the ones without swaps answer with empty pages.
+
+    python benchmarks/bench_suite.py --profile hosted --json results.json
+    python benchmarks/bench_suite.py --profile hosted --baseline results.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_aggregates import cube_aggregates
+from mock_subgraph import FaultProfile, LatencyProfile, MockSubgraph, MockSubgraphServer, make_swaps, make_wallets
+from utils.dex_subgraphs_wrapper import DexSubgraphsWrapper
+from utils.swaps_aggregates import SwapsCube
+
+STAGES = ["load", "fetch", "clean", "aggregate"]
+
+
+@dataclass(frozen=True)
+class Scenario():
+	name: str
+	n_wallets: int
+	swaps_per_wallet: int
+	# projects with swaps of the wallets, the first ones of `DexSubgraphsWrapper.projects`
+	n_projects: int
+	stages: Tuple[str, ...] = tuple(STAGES)
+
+
+SCENARIOS = [
+	Scenario("cold_init", 0, 0, 0, stages=("load",)),
+	Scenario("single_wallet", 1, 200, 3),
+	Scenario("wallets_100", 100, 50, 3),
+	Scenario("deep_history", 1, 20_000, 3),
+	Scenario("all_projects", 10, 100, len(DexSubgraphsWrapper.projects)),
+]
+
+# latency and faults of the mock: a free local server, the hosted service, and the hosted service on a bad day
+PROFILES = {
+	"local": (LatencyProfile(), None),
+	"hosted": (LatencyProfile(base_ms=80.0, jitter_ms=40.0, introspection_ms=800.0, per_filter_value_ms=0.5, per_row_ms=0.02), None),
+	"flaky": (
+		LatencyProfile(base_ms=80.0, jitter_ms=40.0, introspection_ms=800.0, per_filter_value_ms=0.5, per_row_ms=0.02),
+		FaultProfile(http_error_rate=0.03, graphql_error_rate=0.01, hang_rate=0.005, hang_ms=10_000.0, slow_rate=0.03, slow_ms=1_500.0, seed=0),
+	),
+}
+
+
+def serve(scenario: Scenario, profile: str, conn) -> None:
+	# runs in the mock's process: answers with the base url, then serves until told to stop
+	latency, faults = PROFILES[profile]
+	wallets = make_wallets(scenario.n_wallets)
+	subgraphs = {
+		project: MockSubgraph(make_swaps(wallets, scenario.swaps_per_wallet, seed=i) if i < scenario.n_projects else [])
+		for i, project in enumerate(DexSubgraphsWrapper.projects)
+	}
+	with MockSubgraphServer(subgraphs, latency, faults={"*": faults} if faults is not None else None) as server:
+		conn.send(server.base_url)
+		conn.recv()
+
+
+def percentile_ms(latencies: pd.Series, q: float) -> float:
+	return float(latencies.quantile(q) * 1000) if len(latencies) > 0 else float("nan")
+
+
+def run_stages(scenario: Scenario, base_url: str, wallets: List[str], memory: bool) -> Dict[str, Dict]:
+	# one pass over the stages of the scenario: seconds, rows and request latencies, or the peak memory of each
+	results = {}
+
+	def measure(stage: str, f, *args):
+		if memory:
+			tracemalloc.reset_peak()
+			start_memory = tracemalloc.get_traced_memory()[0]
+		start = time.perf_counter()
+		result = f(*args)
+		results[stage] = {"seconds": time.perf_counter() - start}
+		if memory:
+			results[stage]["peak_mib"] = (tracemalloc.get_traced_memory()[1] - start_memory) / 2**20
+		return result
+
+	wrapper = measure("load", lambda: DexSubgraphsWrapper(base_url=base_url, lazy=False))
+	# schemas loaded, the throughput of this stage is in subgraphs per second
+	results["load"]["rows"] = len(wrapper.subgraphs.loaded())
+	if "fetch" not in scenario.stages:
+		return results
+
+	where = {"to_in": [wallet.lower() for wallet in wallets]}
+	raw_df = measure("fetch", lambda: asyncio.run(wrapper._aget_swaps_df_from_all_dexes(where, wrapper.projects)))
+	results["fetch"]["rows"] = len(raw_df)
+	results["fetch"]["requests"] = len(wrapper.query_metrics)
+	for q in (0.5, 0.95, 0.99):
+		results["fetch"][f"p{int(q * 100)}_ms"] = percentile_ms(wrapper.query_metrics['latency_s'], q)
+
+	clean_df = measure("clean", DexSubgraphsWrapper.build_clean_df, raw_df)
+	results["clean"]["rows"] = len(clean_df)
+
+	measure("aggregate", lambda: cube_aggregates(SwapsCube.from_swaps_df(clean_df)))
+	results["aggregate"]["rows"] = len(clean_df)
+	return results
+
+
+def run_scenario(scenario: Scenario, profile: str, repeats: int) -> List[Dict]:
+	ctx = multiprocessing.get_context("spawn")
+	parent_conn, child_conn = ctx.Pipe()
+	server = ctx.Process(target=serve, args=(scenario, profile, child_conn), daemon=True)
+	server.start()
+	try:
+		base_url = parent_conn.recv()
+		wallets = make_wallets(scenario.n_wallets)
+		runs = [run_stages(scenario, base_url, wallets, memory=False) for _ in range(repeats)]
+
+		tracemalloc.start()
+		try:
+			memory_run = run_stages(scenario, base_url, wallets, memory=True)
+		finally:
+			tracemalloc.stop()
+	finally:
+		parent_conn.send("stop")
+		server.join(timeout=10)
+
+	rows = []
+	for stage in scenario.stages:
+		seconds = np.median([run[stage]["seconds"] for run in runs])
+		last = runs[-1][stage]
+		rows.append({
+			"scenario": scenario.name,
+			"stage": stage,
+			"rows": last["rows"],
+			"seconds": seconds,
+			"rows_per_s": last["rows"] / seconds if seconds > 0 else float("nan"),
+			"requests": last.get("requests"),
+			"p50_ms": last.get("p50_ms"),
+			"p95_ms": last.get("p95_ms"),
+			"p99_ms": last.get("p99_ms"),
+			"peak_mib": memory_run[stage]["peak_mib"],
+		})
+	return rows
+
+
+def find_regressions(results: pd.DataFrame, baseline: pd.DataFrame, tolerance: float) -> pd.DataFrame:
+	# stages slower, or hungrier, than the baseline by more than `tolerance`
+	merged = results.merge(baseline, on=["scenario", "stage"], suffixes=("", "_baseline"))
+	slower = merged['seconds'] > merged['seconds_baseline'] * (1 + tolerance)
+	hungrier = merged['peak_mib'] > merged['peak_mib_baseline'] * (1 + tolerance)
+	return merged.loc[slower | hungrier, ["scenario", "stage", "seconds", "seconds_baseline", "peak_mib", "peak_mib_baseline"]]
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--profile", choices=list(PROFILES), default="hosted")
+	parser.add_argument("--scenarios", nargs="+", choices=[scenario.name for scenario in SCENARIOS], default=[scenario.name for scenario in SCENARIOS])
+	parser.add_argument("--repeats", type=int, default=3, help="timed runs per scenario, the median is reported")
+	parser.add_argument("--json", help="writes the results to this file, to be used as a baseline later")
+	parser.add_argument("--baseline", help="results of a previous run, exits with 1 if a stage regressed")
+	parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown or memory growth over the baseline")
+	args = parser.parse_args()
+
+	rows = []
+	for scenario in SCENARIOS:
+		if scenario.name in args.scenarios:
+			rows += run_scenario(scenario, args.profile, args.repeats)
+	results = pd.DataFrame(rows)
+
+	print(results.to_string(index=False, float_format=lambda x: f"{x:,.2f}"))
+
+	if args.json is not None:
+		with open(args.json, "w") as f:
+			json.dump({"profile": args.profile, "results": rows}, f, indent=2, default=float)
+
+	if args.baseline is not None:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+		if baseline["profile"] != args.profile:
+			print(f"warning: the baseline was run with the {baseline['profile']} profile")
+		regressions = find_regressions(results, pd.DataFrame(baseline["results"]), args.tolerance)
+		if len(regressions) > 0:
+			print(f"\nregressions over {args.tolerance:.0%} of the baseline:")
+			print(regressions.to_string(index=False, float_format=lambda x: f"{x:,.2f}"))
+			sys.exit(1)
+		print(f"\nno regressions over {args.tolerance:.0%} of the baseline")
+
+
+if __name__ == "__main__":
+	main()
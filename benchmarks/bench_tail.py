@@ -0,0 +1,65 @@
+"""
+Cost of keeping the swaps of some wallets up to date: requests, bytes and time of rerunning
+`get_compact_swaps` against a `SwapsTail` poll, for a quiet cycle and for cycles where a few
+new swaps got indexed, with deep histories on a few dexes.
+
+    python benchmarks/bench_tail.py --wallets 10 --swaps-per-wallet 2000 --new-swaps 1 10 100
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_subgraph import LatencyProfile, MockSubgraph, MockSubgraphServer, make_swaps, make_wallets
+from utils.dex_subgraphs_wrapper import DexSubgraphsWrapper
+from utils.swaps_aggregates import SWAPS_COLUMNS, SwapsCube
+from utils.swaps_tail import SwapsTail
+
+
+def measure(server: MockSubgraphServer, name: str, f) -> None:
+	server.reset_counters()
+	start = time.perf_counter()
+	f()
+	print(f"{name:>36}: {time.perf_counter() - start:8.2f}s, {server.n_requests:>6} requests, {server.n_bytes / 2**20:8.2f} MiB")
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--wallets", type=int, default=10)
+	parser.add_argument("--swaps-per-wallet", type=int, default=2000)
+	parser.add_argument("--projects", type=int, default=3, help="dexes with swaps of the wallets")
+	parser.add_argument("--new-swaps", type=int, nargs="+", default=[1, 10, 100])
+	parser.add_argument("--latency-ms", type=float, default=20.0)
+	args = parser.parse_args()
+
+	wallets = make_wallets(args.wallets)
+	subgraphs = {
+		project: MockSubgraph(make_swaps(wallets, args.swaps_per_wallet, seed=i) if i < args.projects else [])
+		for i, project in enumerate(DexSubgraphsWrapper.projects)
+	}
+	active = subgraphs[DexSubgraphsWrapper.projects[0]]
+
+	with MockSubgraphServer(subgraphs, LatencyProfile(base_ms=args.latency_ms)) as server:
+		wrapper = DexSubgraphsWrapper(base_url=server.base_url)
+		swaps = wrapper.get_compact_swaps(wallets)
+		# every dex polled at each cycle, as if all were due
+		tail = SwapsTail.from_swaps(wrapper, wallets, swaps, SwapsCube.from_swaps_df(swaps.to_pandas(SWAPS_COLUMNS)).cells, min_interval=0.0)
+		print(f"{len(swaps)} swaps of {args.wallets} wallets on {args.projects} dexes")
+
+		measure(server, "get_compact_swaps again", lambda: wrapper.get_compact_swaps(wallets))
+		measure(server, "tail poll, nothing new", tail.poll)
+		for seed, n_new in enumerate(args.new_swaps):
+			newest = max(swap["timestamp"] for swap in active.swaps)
+			new_swaps = make_swaps(wallets[:1], n_new, seed=1_000 + seed)
+			for i, swap in enumerate(new_swaps):
+				swap["timestamp"] = newest + 1 + i
+			active.add_swaps(new_swaps)
+			measure(server, f"tail poll, {n_new} new swaps", tail.poll)
+		assert len(tail.swaps) == len(swaps) + sum(args.new_swaps)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,135 @@
+"""
+Cost and effect of the `TokenIndex`: time to index the tokens and hourly prices of the swaps
+(cold, incremental, a small fetch on top of it, and the same swaps again), time of building the compact swaps with and
+without filling the missing usd values from it, how many missing values get filled and how
+far the filled ones are from the hidden true values, and symbols against assets.
+
+    python benchmarks/bench_token_prices.py --rows 1000000 --missing 0.05
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_subgraph import START_TIMESTAMP, TOKENS
+from utils.compact_swaps import CompactSwaps
+from utils.swaps_pagination import RAW_COLUMNS
+from utils.token_prices import TokenIndex
+
+# one dex per chain, the bridged copies of the tokens have their own address and ".e" symbol on avalanche
+PROJECTS = ["uniswap-v3-ethereum", "uniswap-v3-arbitrum", "trader-joe-avalanche", "sushiswap-polygon", "spookyswap-fantom"]
+
+
+def make_priced_raw_df(n_rows: int, missing: float, seed: int = 0):
+	"""
+	Raw swaps whose usd values follow an hourly random walk of each token's price, with the usd
+	values of a `missing` share of the swaps zeroed on both sides and of another share on the
+	sold side only. Also returns the true usd values of the sold side.
+	"""
+	rng = np.random.default_rng(seed)
+	n_hours = 90 * 24
+	chains, addresses, symbols, prices = [], [], [], []
+	for chain_index, project in enumerate(PROJECTS):
+		for address, symbol, _, price in TOKENS:
+			chains.append(chain_index)
+			addresses.append(address if chain_index == 0 else f"0x{chain_index:02x}{address[4:]}")
+			symbols.append(f"{symbol}.e" if project.endswith("avalanche") else symbol)
+			prices.append(price)
+		if chain_index == 0:
+			# a fake USDC on ethereum, priced nothing like USDC
+			chains.append(0)
+			addresses.append(f"0x{'fa' * 20}")
+			symbols.append("USDC")
+			prices.append(0.001)
+
+	chains, addresses, symbols = np.array(chains), np.array(addresses, dtype=object), np.array(symbols, dtype=object)
+	hourly = np.array(prices)[:, None] * np.exp(np.cumsum(rng.normal(0, 0.01, (len(prices), n_hours)), axis=1))
+
+	# tokens are numbered chain after chain, so the ones of a chain are a range
+	chain = rng.integers(0, len(PROJECTS), n_rows)
+	first_token, n_tokens = np.searchsorted(chains, chain), np.bincount(chains)[chain]
+	token_in = first_token + (rng.random(n_rows) * n_tokens).astype(np.int64)
+	token_out = first_token + (rng.random(n_rows) * n_tokens).astype(np.int64)
+	hour = rng.integers(0, n_hours, n_rows)
+	usd_in = rng.lognormal(6, 2, n_rows)
+	usd_out = usd_in * rng.uniform(0.98, 1.0, n_rows)
+
+	raw_df = pd.DataFrame({
+		'swaps_timestamp': START_TIMESTAMP + hour * 3600 + rng.integers(0, 3600, n_rows),
+		'swaps_to': np.array([f"0x{i:040x}" for i in range(100)], dtype=object)[rng.integers(0, 100, n_rows)],
+		'swaps_from': None,
+		'swaps_tokenIn_id': addresses[token_in],
+		'swaps_tokenIn_symbol': symbols[token_in],
+		'swaps_tokenIn_decimals': 0,
+		'swaps_amountIn': usd_in / hourly[token_in, hour],
+		'swaps_amountInUSD': usd_in.copy(),
+		'swaps_tokenOut_id': addresses[token_out],
+		'swaps_tokenOut_symbol': symbols[token_out],
+		'swaps_tokenOut_decimals': 0,
+		'swaps_amountOut': usd_out / hourly[token_out, hour],
+		'swaps_amountOutUSD': usd_out,
+		'swaps_pool_id': "0xpool",
+		'swaps_pool_name': "POOL",
+		'swaps_pool_symbol': "P",
+		'swaps_hash': np.array([f"0x{i:064x}" for i in range(n_rows)], dtype=object),
+		'swaps_logIndex': 0,
+		'swaps_id': np.array([f"0x{i:064x}-0" for i in range(n_rows)], dtype=object),
+	}, columns=RAW_COLUMNS)
+	raw_df['project'] = np.array(PROJECTS, dtype=object)[chain]
+
+	both, one = rng.random(n_rows) < missing, rng.random(n_rows) < missing
+	raw_df.loc[both, ['swaps_amountInUSD', 'swaps_amountOutUSD']] = 0.0
+	raw_df.loc[one & ~both, 'swaps_amountInUSD'] = 0.0
+	return raw_df, usd_in
+
+
+def timed(f, *args):
+	start = time.perf_counter()
+	result = f(*args)
+	return result, time.perf_counter() - start
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--rows", type=int, default=1_000_000)
+	parser.add_argument("--missing", type=float, default=0.05, help="share of swaps without usd values on both sides, and on the sold side only")
+	args = parser.parse_args()
+
+	raw_df, true_usd_in = make_priced_raw_df(args.rows, args.missing)
+	n_old = int(args.rows * 0.9)
+	index = TokenIndex()
+
+	n_new, elapsed = timed(index.update, raw_df.iloc[:n_old])
+	print(f"{'index, cold':>32}: {elapsed:8.2f}s for {n_new} swaps, {len(index.table)} hourly prices of {len(index.table.tokens)} tokens")
+	n_new, elapsed = timed(index.update, raw_df.iloc[:-50])
+	print(f"{'index, 10% new swaps':>32}: {elapsed:8.2f}s for {n_new} new swaps")
+	n_new, elapsed = timed(index.update, raw_df.iloc[-50:])
+	print(f"{'index, 50 new swaps':>32}: {elapsed:8.2f}s for {n_new} new swaps")
+	n_new, elapsed = timed(index.update, raw_df)
+	print(f"{'index, same swaps again':>32}: {elapsed:8.2f}s for {n_new} new swaps")
+
+	plain, elapsed = timed(CompactSwaps.from_raw_df, raw_df)
+	print(f"{'compact swaps':>32}: {elapsed:8.2f}s")
+	enriched, elapsed = timed(CompactSwaps.from_raw_df, raw_df, index.table)
+	print(f"{'compact swaps, usd filled':>32}: {elapsed:8.2f}s")
+
+	before = plain.to_pandas(['amount_in_usd'])['amount_in_usd'].to_numpy()
+	after = enriched.to_pandas(['amount_in_usd'])['amount_in_usd'].to_numpy()
+	both = raw_df['swaps_amountOutUSD'].to_numpy() == 0
+	missing = before == 0
+	error = np.abs(after[both] / true_usd_in[both] - 1)
+	print(f"{'missing amount_in_usd':>32}: {missing.sum()} before, {(after == 0).sum()} after")
+	print(f"{'filled from prices, error':>32}: median {np.median(error):.2%}, p99 {np.quantile(error, 0.99):.2%}")
+
+	df = enriched.to_pandas(['token_symbol_in', 'token_asset_in'])
+	print(f"{'distinct sold tokens':>32}: {df['token_symbol_in'].nunique()} symbols, {df['token_asset_in'].nunique()} assets: {', '.join(sorted(df['token_asset_in'].cat.categories))}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,571 @@
+"""
+Local stand-in for the Messari dex subgraphs, serving the `swaps` entity from synthetic data.
+
+Only the subset of GraphQL that the analyzooor sends is understood: root `swaps` fields
+(aliases allowed) with `first`, `skip`, `orderBy`, `orderDirection` and `where` arguments.
+"""
+import bisect
+import heapq
+import json
+import random
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+TOKENS = [
+	("0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2", "WETH", 18, 1_800.0),
+	("0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48", "USDC", 6, 1.0),
+	("0xdac17f958d2ee523a2206206994597c13d831ec7", "USDT", 6, 1.0),
+	("0x2260fac5e5542a773aa44fbcfedf7c193bc2c599", "WBTC", 8, 25_000.0),
+	("0x6b175474e89094c44da98b954eedeac495271d0f", "DAI", 18, 1.0),
+	("0x1f9840a85d5af5b3bf5d0b4a5d4b4d0a5d4b4d0a", "UNI", 18, 6.0),
+	("0x514910771af9ca656af840dff83e8264ecf986ca", "LINK", 18, 7.0),
+	("0x6b3595068778dd592e39a122f4f5a5cf09c90fe2", "SUSHI", 18, 1.2),
+]
+
+START_TIMESTAMP = 1_600_000_000
+
+
+def _hex(rng: random.Random, n_bytes: int) -> str:
+	return "0x" + "".join(f"{rng.getrandbits(8):02x}" for _ in range(n_bytes))
+
+
+def make_swaps(wallets: List[str], swaps_per_wallet: int, seed: int = 0, n_pools: int = 20, duplicate_timestamp_ratio: float = 0.2) -> List[Dict]:
+	rng = random.Random(seed)
+	pools = []
+	for _ in range(n_pools):
+		token_a, token_b = rng.sample(TOKENS, 2)
+		pools.append({"id": _hex(rng, 20), "name": f"{token_a[1]}/{token_b[1]}", "symbol": f"{token_a[1]}-{token_b[1]}", "tokens": (token_a, token_b)})
+
+	swaps = []
+	for wallet in wallets:
+		timestamp = START_TIMESTAMP
+		for _ in range(swaps_per_wallet):
+			# keep some swaps in the same block to exercise cursor ties
+			if rng.random() >= duplicate_timestamp_ratio:
+				timestamp += rng.randint(1, 3_600)
+			pool = rng.choice(pools)
+			token_in, token_out = pool["tokens"] if rng.random() < 0.5 else pool["tokens"][::-1]
+			amount_in_usd = rng.lognormvariate(6, 2)
+			amount_out_usd = amount_in_usd * rng.uniform(0.98, 1.0)
+			tx_hash = _hex(rng, 32)
+			log_index = rng.randint(0, 300)
+			swaps.append({
+				"id": f"{tx_hash}-{log_index}",
+				"timestamp": timestamp,
+				"to": wallet,
+				"from": wallet,
+				"tokenIn": {"id": token_in[0], "symbol": token_in[1], "decimals": token_in[2]},
+				"amountIn": str(int(amount_in_usd / token_in[3] * 10**token_in[2])),
+				"amountInUSD": repr(amount_in_usd),
+				"tokenOut": {"id": token_out[0], "symbol": token_out[1], "decimals": token_out[2]},
+				"amountOut": str(int(amount_out_usd / token_out[3] * 10**token_out[2])),
+				"amountOutUSD": repr(amount_out_usd),
+				"pool": {"id": pool["id"], "name": pool["name"], "symbol": pool["symbol"]},
+				"hash": tx_hash,
+				"logIndex": log_index,
+			})
+	return swaps
+
+
+def make_wallets(n_wallets: int, seed: int = 0) -> List[str]:
+	rng = random.Random(seed)
+	return [_hex(rng, 20) for _ in range(n_wallets)]
+
+
+# --- introspection: the part of the Messari dex schema the analyzooor reads ---
+
+def _named(kind: str, name: str) -> Dict:
+	return {"kind": kind, "name": name, "ofType": None}
+
+
+def _non_null(type_: Dict) -> Dict:
+	return {"kind": "NON_NULL", "name": None, "ofType": type_}
+
+
+def _list_of(type_: Dict) -> Dict:
+	return _non_null({"kind": "LIST", "name": None, "ofType": _non_null(type_)})
+
+
+def _field(name: str, type_: Dict, args: Optional[List[Dict]] = None) -> Dict:
+	return {"name": name, "description": None, "args": args or [], "type": type_, "isDeprecated": False, "deprecationReason": None}
+
+
+def _input(name: str, type_: Dict) -> Dict:
+	return {"name": name, "description": None, "type": type_, "defaultValue": None}
+
+
+def _object(name: str, fields: List[Dict]) -> Dict:
+	return {"kind": "OBJECT", "name": name, "description": None, "fields": fields, "inputFields": None, "interfaces": [], "enumValues": None, "possibleTypes": None}
+
+
+_SWAP_SCALARS = {
+	"id": "ID", "hash": "String", "logIndex": "Int", "to": "String", "from": "String",
+	"amountIn": "BigInt", "amountInUSD": "BigDecimal", "amountOut": "BigInt", "amountOutUSD": "BigDecimal",
+	"timestamp": "BigInt", "blockNumber": "BigInt",
+}
+
+
+def make_introspection_schema() -> Dict:
+	scalars = [{"kind": "SCALAR", "name": name, "description": None, "fields": None, "inputFields": None, "interfaces": None, "enumValues": None, "possibleTypes": None}
+		for name in ("ID", "String", "Int", "BigInt", "BigDecimal", "Boolean", "Bytes")]
+	scalar = lambda name: _non_null(_named("SCALAR", name))
+
+	token = _object("Token", [_field("id", scalar("ID")), _field("name", scalar("String")), _field("symbol", scalar("String")), _field("decimals", scalar("Int"))])
+	pool = _object("LiquidityPool", [_field("id", scalar("ID")), _field("name", _named("SCALAR", "String")), _field("symbol", _named("SCALAR", "String"))])
+	swap = _object("Swap", [_field(name, scalar(type_)) for name, type_ in _SWAP_SCALARS.items()] + [
+		_field("tokenIn", _non_null(_named("OBJECT", "Token"))),
+		_field("tokenOut", _non_null(_named("OBJECT", "Token"))),
+		_field("pool", _non_null(_named("OBJECT", "LiquidityPool"))),
+	])
+
+	filter_fields = []
+	for name, type_ in list(_SWAP_SCALARS.items()) + [("tokenIn", "String"), ("tokenOut", "String"), ("pool", "String")]:
+		filter_fields.append(_input(name, _named("SCALAR", type_)))
+		for op in ("_not", "_gt", "_lt", "_gte", "_lte"):
+			filter_fields.append(_input(name + op, _named("SCALAR", type_)))
+		for op in ("_in", "_not_in"):
+			filter_fields.append(_input(name + op, {"kind": "LIST", "name": None, "ofType": _non_null(_named("SCALAR", type_))}))
+	swap_filter = {"kind": "INPUT_OBJECT", "name": "Swap_filter", "description": None, "fields": None, "inputFields": filter_fields, "interfaces": None, "enumValues": None, "possibleTypes": None}
+
+	enum = lambda name, values: {"kind": "ENUM", "name": name, "description": None, "fields": None, "inputFields": None, "interfaces": None,
+		"enumValues": [{"name": v, "description": None, "isDeprecated": False, "deprecationReason": None} for v in values], "possibleTypes": None}
+	swap_order_by = enum("Swap_orderBy", list(_SWAP_SCALARS) + ["tokenIn", "tokenOut", "pool"])
+	order_direction = enum("OrderDirection", ["asc", "desc"])
+
+	query = _object("Query", [
+		_field("swap", _named("OBJECT", "Swap"), [_input("id", scalar("ID"))]),
+		_field("swaps", _list_of(_named("OBJECT", "Swap")), [
+			_input("skip", _named("SCALAR", "Int")),
+			_input("first", _named("SCALAR", "Int")),
+			_input("orderBy", _named("ENUM", "Swap_orderBy")),
+			_input("orderDirection", _named("ENUM", "OrderDirection")),
+			_input("where", _named("INPUT_OBJECT", "Swap_filter")),
+		]),
+	])
+
+	return {"__schema": {
+		"queryType": {"name": "Query"},
+		"mutationType": None,
+		"subscriptionType": None,
+		"types": scalars + [token, pool, swap, swap_filter, swap_order_by, order_direction, query],
+		"directives": [],
+	}}
+
+
+# --- a tiny GraphQL parser, good enough for the queries the analyzooor builds ---
+
+_TOKEN_RE = re.compile(r'\s*(?:(\.\.\.)|("(?:[^"\\]|\\.)*")|(-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)|([_A-Za-z][_0-9A-Za-z]*)|(\$)|([{}()\[\]:,!=@]))')
+
+_ENUM_LITERALS = {"true": True, "false": False, "null": None}
+
+
+def _tokenize(text: str) -> List[str]:
+	tokens = []
+	pos = 0
+	text = re.sub(r"#[^\n]*", "", text).rstrip()
+	while pos < len(text):
+		m = _TOKEN_RE.match(text, pos)
+		if not m:
+			raise ValueError(f"Unexpected character at {pos}: {text[pos:pos + 20]!r}")
+		tokens.append(next(g for g in m.groups() if g is not None))
+		pos = m.end()
+	return tokens
+
+
+class _Parser():
+	def __init__(self, text: str, variables: Optional[Dict] = None) -> None:
+		self.tokens = _tokenize(text)
+		self.pos = 0
+		self.variables = variables or {}
+
+	def peek(self) -> Optional[str]:
+		return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+	def take(self, expected: Optional[str] = None) -> str:
+		token = self.peek()
+		if expected is not None and token != expected:
+			raise ValueError(f"Expected {expected!r}, got {token!r}")
+		self.pos += 1
+		return token
+
+	def document(self) -> List[Dict]:
+		if self.peek() == "query":
+			self.take()
+			if self.peek() not in ("{", "("):
+				self.take()
+			if self.peek() == "(":
+				# variable definitions are only needed for their names, values come from `variables`
+				depth = 0
+				while True:
+					token = self.take()
+					depth += token == "("
+					depth -= token == ")"
+					if depth == 0:
+						break
+		return self.selection_set()
+
+	def selection_set(self) -> List[Dict]:
+		self.take("{")
+		selections = []
+		while self.peek() != "}":
+			selections.append(self.selection())
+		self.take("}")
+		return selections
+
+	def selection(self) -> Dict:
+		name = self.take()
+		alias = name
+		if self.peek() == ":":
+			self.take()
+			name = self.take()
+		args = {}
+		if self.peek() == "(":
+			self.take()
+			while self.peek() != ")":
+				arg_name = self.take()
+				self.take(":")
+				args[arg_name] = self.value()
+				if self.peek() == ",":
+					self.take()
+			self.take(")")
+		children = self.selection_set() if self.peek() == "{" else None
+		return {"name": name, "alias": alias, "args": args, "children": children}
+
+	def value(self):
+		token = self.take()
+		if token == "$":
+			return self.variables.get(self.take())
+		if token == "[":
+			values = []
+			while self.peek() != "]":
+				values.append(self.value())
+				if self.peek() == ",":
+					self.take()
+			self.take("]")
+			return values
+		if token == "{":
+			values = {}
+			while self.peek() != "}":
+				key = self.take()
+				self.take(":")
+				values[key] = self.value()
+				if self.peek() == ",":
+					self.take()
+			self.take("}")
+			return values
+		if token.startswith('"'):
+			return json.loads(token)
+		if re.fullmatch(r"-?\d+", token):
+			return int(token)
+		if re.fullmatch(r"-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?", token):
+			return float(token)
+		return _ENUM_LITERALS.get(token, token)
+
+
+def parse_query(text: str, variables: Optional[Dict] = None) -> List[Dict]:
+	return _Parser(text, variables).document()
+
+
+# --- query execution ---
+
+_FILTER_OPS = ("_not_in", "_in", "_not", "_gte", "_lte", "_gt", "_lt")
+
+
+def _field_value(swap: Dict, name: str):
+	value = swap[name]
+	if isinstance(value, dict):
+		return value["id"]
+	if name in ("amountIn", "amountOut"):
+		return int(value)
+	if name in ("amountInUSD", "amountOutUSD"):
+		return float(value)
+	return value
+
+
+def _coerce(value, reference):
+	if isinstance(reference, (int, float)) and isinstance(value, str):
+		return type(reference)(value)
+	return value
+
+
+def _iter_range(swaps: List[Dict], lo: int, hi: int, descending: bool):
+	indexes = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+	return (swaps[i] for i in indexes)
+
+
+def _make_predicate(key: str, expected):
+	name, op = key, ""
+	for suffix in _FILTER_OPS:
+		if key.endswith(suffix):
+			name, op = key[:-len(suffix)], suffix
+			break
+
+	def predicate(swap: Dict) -> bool:
+		actual = _field_value(swap, name)
+		if op in ("_in", "_not_in"):
+			values = {_coerce(v, actual) for v in expected}
+			return (actual in values) == (op == "_in")
+		value = _coerce(expected, actual)
+		if op == "":
+			return actual == value
+		if op == "_not":
+			return actual != value
+		if op == "_gt":
+			return actual > value
+		if op == "_gte":
+			return actual >= value
+		if op == "_lt":
+			return actual < value
+		return actual <= value
+
+	return predicate
+
+
+@dataclass
+class MockSubgraph():
+	swaps: List[Dict]
+	by_wallet: Dict[str, List[Dict]] = field(default_factory=dict)
+	timestamps_by_wallet: Dict[str, List[int]] = field(default_factory=dict)
+
+	def __post_init__(self) -> None:
+		for swap in sorted(self.swaps, key=lambda s: (s["timestamp"], s["id"])):
+			self.by_wallet.setdefault(swap["to"], []).append(swap)
+		for wallet, swaps in self.by_wallet.items():
+			self.timestamps_by_wallet[wallet] = [s["timestamp"] for s in swaps]
+
+	def add_swaps(self, swaps: List[Dict]) -> None:
+		# swaps indexed after the server started, for the live tail
+		self.swaps.extend(swaps)
+		for swap in swaps:
+			wallet_swaps = self.by_wallet.setdefault(swap["to"], [])
+			wallet_swaps.append(swap)
+			wallet_swaps.sort(key=lambda s: (s["timestamp"], s["id"]))
+			self.timestamps_by_wallet[swap["to"]] = [s["timestamp"] for s in wallet_swaps]
+
+	def _candidates(self, where: Dict, descending: bool):
+		# per wallet ranges narrowed by the timestamp filters, merged lazily in timestamp order
+		wallets = where.get("to_in", [where["to"]] if "to" in where else list(self.by_wallet))
+		low = max([int(where[k]) + (k == "timestamp_gt") for k in ("timestamp_gt", "timestamp_gte") if k in where] + [int(where.get("timestamp", -1))])
+		high = min([int(where[k]) - (k == "timestamp_lt") for k in ("timestamp_lt", "timestamp_lte") if k in where] + [int(where["timestamp"]) if "timestamp" in where else float("inf")])
+
+		ranges = []
+		for wallet in wallets:
+			if wallet not in self.by_wallet:
+				continue
+			timestamps = self.timestamps_by_wallet[wallet]
+			lo = bisect.bisect_left(timestamps, low)
+			hi = bisect.bisect_right(timestamps, high)
+			ranges.append(_iter_range(self.by_wallet[wallet], lo, hi, descending))
+
+		key = lambda s: (s["timestamp"], s["id"])
+		return heapq.merge(*ranges, key=key, reverse=descending)
+
+	def resolve_swaps(self, args: Dict) -> List[Dict]:
+		where = args.get("where") or {}
+		first = args.get("first", 100)
+		skip = args.get("skip", 0)
+		order_by = args.get("orderBy", "id")
+		descending = args.get("orderDirection", "asc") == "desc"
+
+		predicates = [_make_predicate(k, v) for k, v in where.items() if k not in ("to", "to_in")]
+		candidates = (s for s in self._candidates(where, descending) if all(p(s) for p in predicates))
+
+		if order_by == "timestamp":
+			result = []
+			for swap in candidates:
+				result.append(swap)
+				if len(result) >= first + skip:
+					break
+		else:
+			result = sorted(candidates, key=lambda s: _field_value(s, order_by), reverse=descending)
+		return result[skip:skip + first]
+
+	def execute(self, query: str, variables: Optional[Dict] = None, stats: Optional[Dict] = None) -> Dict:
+		if "__schema" in query:
+			return make_introspection_schema()
+
+		data = {}
+		n_filter_values = n_rows = 0
+		for selection in parse_query(query, variables):
+			if selection["name"] != "swaps":
+				raise ValueError(f"Unknown root field {selection['name']}")
+			rows = self.resolve_swaps(selection["args"])
+			data[selection["alias"]] = [_select(row, selection["children"]) for row in rows]
+			n_filter_values += len((selection["args"].get("where") or {}).get("to_in", []))
+			n_rows += len(rows)
+		if stats is not None:
+			stats.update(n_filter_values=n_filter_values, n_rows=n_rows)
+		return data
+
+
+def _select(entity: Dict, selections: List[Dict]) -> Dict:
+	result = {}
+	for selection in selections:
+		value = entity[selection["name"]]
+		if selection["children"] is not None:
+			value = _select(value, selection["children"])
+		elif selection["name"] == "timestamp":
+			value = str(value)
+		result[selection["alias"]] = value
+	return result
+
+
+@dataclass
+class LatencyProfile():
+	base_ms: float = 0.0
+	jitter_ms: float = 0.0
+	# the hosted service takes far longer to answer introspection than a small query
+	introspection_ms: float = 0.0
+	# query cost grows with the size of `to_in` filters and with the rows returned
+	per_filter_value_ms: float = 0.0
+	per_row_ms: float = 0.0
+
+	def sleep(self, introspection: bool = False, n_filter_values: int = 0, n_rows: int = 0) -> None:
+		delay = self.base_ms + random.uniform(0, self.jitter_ms) + (self.introspection_ms if introspection else 0.0)
+		delay += self.per_filter_value_ms * n_filter_values + self.per_row_ms * n_rows
+		if delay > 0:
+			time.sleep(delay / 1_000)
+
+
+@dataclass
+class FaultProfile():
+	"""
+	Failures injected into the answers of a project, each drawn independently per request:
+	HTTP 500s, GraphQL errors, hangs (longer than any sane client timeout) and slow tails.
+	"""
+	http_error_rate: float = 0.0
+	graphql_error_rate: float = 0.0
+	hang_rate: float = 0.0
+	hang_ms: float = 120_000.0
+	slow_rate: float = 0.0
+	slow_ms: float = 2_000.0
+	seed: Optional[int] = None
+
+	def __post_init__(self) -> None:
+		self._rng = random.Random(self.seed)
+		self._lock = threading.Lock()
+
+	def draw(self) -> Optional[str]:
+		with self._lock:
+			roll = self._rng.random()
+		for fault, rate in [("http_error", self.http_error_rate), ("graphql_error", self.graphql_error_rate), ("hang", self.hang_rate), ("slow", self.slow_rate)]:
+			if roll < rate:
+				return fault
+			roll -= rate
+		return None
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+	# the default backlog of 5 drops connections when a fetch opens dozens at once, and the
+	# client's reconnect delays would be measured as subgraph latency
+	request_queue_size = 128
+
+	def handle_error(self, request, client_address) -> None:
+		# clients dropping their connection (a cancelled fetch) is expected, not an error
+		if not isinstance(sys.exc_info()[1], ConnectionError):
+			super().handle_error(request, client_address)
+
+
+class MockSubgraphServer():
+	"""
+	Serves one `MockSubgraph` per project at `/subgraphs/name/messari/<project>`,
+	mirroring the hosted service url layout.
+	"""
+
+	def __init__(self, subgraphs: Dict[str, MockSubgraph], latency: LatencyProfile = None, host: str = "127.0.0.1", port: int = 0, faults: Optional[Dict[str, FaultProfile]] = None) -> None:
+		self.subgraphs = subgraphs
+		self.latency = latency or LatencyProfile()
+		# project -> injected faults, "*" applies to projects without their own profile
+		self.faults = faults or {}
+		self.n_faults = 0
+		self.n_requests = 0
+		self.n_introspections = 0
+		self.n_bytes = 0
+		# perf_counter() when the first non-introspection query arrived
+		self.first_query_at = None
+		self._lock = threading.Lock()
+		self.httpd = _QuietHTTPServer((host, port), self._make_handler())
+		self.httpd.daemon_threads = True
+		self._thread = None
+
+	@property
+	def base_url(self) -> str:
+		host, port = self.httpd.server_address[:2]
+		return f"http://{host}:{port}/subgraphs/name/messari"
+
+	def url(self, project: str) -> str:
+		return f"{self.base_url}/{project}"
+
+	def reset_counters(self) -> None:
+		with self._lock:
+			self.n_requests = self.n_introspections = self.n_bytes = self.n_faults = 0
+			self.first_query_at = None
+
+	def _make_handler(self):
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = "HTTP/1.1"
+
+			def log_message(self, *args) -> None:
+				pass
+
+			def do_POST(self) -> None:
+				body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+				project = self.path.rstrip("/").split("/")[-1]
+				introspection = "__schema" in body["query"]
+				with server._lock:
+					if introspection:
+						server.n_introspections += 1
+					elif server.first_query_at is None:
+						server.first_query_at = time.perf_counter()
+				stats = {}
+				try:
+					payload = {"data": server.subgraphs[project].execute(body["query"], body.get("variables"), stats)}
+				except Exception as e:
+					payload = {"errors": [{"message": str(e)}]}
+				server.latency.sleep(introspection, **stats)
+
+				profile = server.faults.get(project, server.faults.get("*"))
+				fault = profile.draw() if profile is not None else None
+				if fault is not None:
+					with server._lock:
+						server.n_faults += 1
+				if fault in ("hang", "slow"):
+					time.sleep((profile.hang_ms if fault == "hang" else profile.slow_ms) / 1_000)
+				elif fault == "http_error":
+					self.send_error(500, "injected fault")
+					return
+				elif fault == "graphql_error":
+					payload = {"errors": [{"message": "injected fault: indexers unavailable"}]}
+				raw = json.dumps(payload).encode()
+				with server._lock:
+					server.n_requests += 1
+					server.n_bytes += len(raw)
+				self.send_response(200)
+				self.send_header("Content-Type", "application/json")
+				self.send_header("Content-Length", str(len(raw)))
+				self.end_headers()
+				self.wfile.write(raw)
+
+		return Handler
+
+	def start(self) -> "MockSubgraphServer":
+		self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self) -> None:
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+	def __enter__(self) -> "MockSubgraphServer":
+		return self.start()
+
+	def __exit__(self, *exc) -> None:
+		self.stop()